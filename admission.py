@@ -0,0 +1,193 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Hashable, Optional
+from config import MODEL_RATE_LIMIT, MODEL_RATE_BURST, MODEL_PER_USER_INFLIGHT, OPENROUTER_MAX_CONCURRENCY
+
+
+# Допуск запросов к модели. Один пользователь с пачкой фото не должен занимать весь лимит
+# OpenRouter (и бюджет) на всех остальных:
+#   - глобальный token bucket держит темп запросов на уровне лимита провайдера, без шквала 429;
+#   - у каждого пользователя не больше MODEL_PER_USER_INFLIGHT генераций одновременно
+#     (задача с несколькими фото, например альбом, может разрешить себе больше — allowance);
+#   - всего в полёте не больше OPENROUTER_MAX_CONCURRENCY генераций;
+#   - ожидающие обслуживаются по кругу: по одному запросу от каждого пользователя за проход.
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity про запас"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> float:
+        """Забирает токен. Возвращает 0 при успехе, иначе — сколько секунд ждать следующего"""
+        if self.rate <= 0:
+            return 0.0
+
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    """Справедливая очередь перед вызовами модели"""
+
+    def __init__(self, rate: float = MODEL_RATE_LIMIT, burst: float = MODEL_RATE_BURST,
+                 per_user: int = MODEL_PER_USER_INFLIGHT, max_inflight: int = OPENROUTER_MAX_CONCURRENCY):
+        self.bucket = TokenBucket(rate, max(burst, 1))
+        self.per_user = per_user
+        self.max_inflight = max_inflight
+        self._loop = None
+        self._reset()
+
+    def _reset(self):
+        # порядок ключей — порядок обхода по кругу; обслуженный пользователь уходит в конец
+        self._waiting: OrderedDict[Hashable, deque[asyncio.Future]] = OrderedDict()
+        self._inflight: dict[Hashable, int] = {}
+        self._allowance: dict[Hashable, int] = {}  # лимит пользователя выше per_user, пока у него есть запросы
+        self._total_inflight = 0
+        self._timer = None
+
+    def _bind_loop(self):
+        # futures привязаны к event loop — при смене loop (новый вызов функции) начинаем с чистого листа
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._reset()
+            self._loop = loop
+
+    def position(self, user_id: Hashable) -> int:
+        """Место последнего запроса пользователя в очереди (1 — следующий), 0 — запросов в очереди нет"""
+        queue = self._waiting.get(user_id)
+        if not queue:
+            return 0
+
+        # при обходе по кругу k-й запрос пользователя обслуживается в (k+1)-м проходе:
+        # пользователи до него в порядке обхода успевают отдать по k+1 запросу, после него — по k
+        k = len(queue) - 1
+        ahead = 0
+        before = True
+        for other, other_queue in self._waiting.items():
+            if other == user_id:
+                before = False
+                continue
+            ahead += min(len(other_queue), k + 1 if before else k)
+        return ahead + k + 1
+
+    def stats(self) -> dict:
+        return {
+            "waiting": sum(len(queue) for queue in self._waiting.values()),
+            "waiting_users": len(self._waiting),
+            "inflight": self._total_inflight,
+            "tokens": self.bucket.tokens,
+        }
+
+    def _pump(self):
+        """Пропускает ожидающих, пока есть токены и свободные места"""
+        self._timer = None
+
+        while self._waiting and self._total_inflight < self.max_inflight:
+            # первый по кругу пользователь, у которого не исчерпан свой лимит
+            user_id = next((user for user in self._waiting
+                            if self._inflight.get(user, 0) < self._allowance.get(user, self.per_user)), None)
+            if user_id is None:
+                return
+
+            wait = self.bucket.try_take()
+            if wait > 0:
+                self._timer = self._loop.call_later(wait, self._pump)
+                return
+
+            queue = self._waiting[user_id]
+            future = queue.popleft()
+            if queue:
+                self._waiting.move_to_end(user_id)
+            else:
+                del self._waiting[user_id]
+
+            self._inflight[user_id] = self._inflight.get(user_id, 0) + 1
+            self._total_inflight += 1
+            future.set_result(None)
+
+    def _forget(self, user_id: Hashable):
+        # запросов пользователя не осталось — его повышенный лимит больше не действует
+        if user_id not in self._inflight and user_id not in self._waiting:
+            self._allowance.pop(user_id, None)
+
+    def _release(self, user_id: Hashable):
+        self._inflight[user_id] -= 1
+        if not self._inflight[user_id]:
+            del self._inflight[user_id]
+        self._total_inflight -= 1
+        self._forget(user_id)
+
+        if self._timer is None:
+            self._pump()
+
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[Hashable] = None,
+                   on_queued: Optional[Callable[[int], Awaitable[None]]] = None, allowance: int = 1):
+        """
+        Ожидание своей очереди на вызов модели.
+        on_queued(position) вызывается, если запрос не пропущен сразу.
+        allowance — сколько генераций одновременно можно пользователю, если это больше per_user
+        (фото одного альбома восстанавливаются параллельно, а не по одному)
+        """
+        self._bind_loop()
+
+        # запросы без пользователя не делят лимит друг с другом
+        if user_id is None:
+            user_id = object()
+
+        if allowance > self.per_user:
+            self._allowance[user_id] = max(self._allowance.get(user_id, self.per_user), allowance)
+
+        future = self._loop.create_future()
+        self._waiting.setdefault(user_id, deque()).append(future)
+        position = self.position(user_id)
+
+        if self._timer is None:
+            self._pump()
+
+        try:
+            if not future.done():
+                if on_queued is not None:
+                    try:
+                        await on_queued(position)
+                    except Exception as e:
+                        logging.warning("⚠️ Не удалось сообщить место в очереди: %s", e)
+                await future
+        except BaseException:
+            # отмена ожидания: убираем запрос из очереди, а если место уже выдано — возвращаем его
+            if future.done() and not future.cancelled():
+                self._release(user_id)
+            else:
+                queue = self._waiting.get(user_id)
+                if queue is not None and future in queue:
+                    queue.remove(future)
+                    if not queue:
+                        del self._waiting[user_id]
+                self._forget(user_id)
+            raise
+
+        try:
+            yield
+        finally:
+            self._release(user_id)
+
+
+admission = AdmissionController()
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+from aiogram import types
+from config import ALBUM_WINDOW
+
+
+# Альбом Telegram присылает отдельным сообщением на каждое фото с общим media_group_id.
+# Сборщик копит сообщения альбома ALBUM_WINDOW секунд после первого и отдаёт их обработчику
+# одним списком: один счёт, одна задача реставрации и один ответ на весь альбом.
+
+
+class AlbumCollector:
+    def __init__(self, window: float = ALBUM_WINDOW):
+        self.window = window
+        self._loop = None
+        self._albums: dict[tuple[int, str], list[types.Message]] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self._failed: set[tuple[int, str]] = set()
+
+    def _bind_loop(self):
+        # задачи привязаны к event loop — при смене loop (новый вызов функции) начинаем с чистого листа
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._albums = {}
+            self._tasks = set()
+            self._failed = set()
+            self._loop = loop
+
+    def add(self, message: types.Message, on_album: Callable[[list[types.Message]], Awaitable[None]]):
+        """Добавить фото альбома; on_album(messages) вызовется один раз на альбом по истечении окна"""
+        self._bind_loop()
+
+        key = (message.chat.id, message.media_group_id)
+        album = self._albums.get(key)
+        if album is not None:
+            album.append(message)
+            return
+
+        self._albums[key] = [message]
+        task = asyncio.create_task(self._flush(key, on_album))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, key: tuple[int, str], on_album: Callable[[list[types.Message]], Awaitable[None]]):
+        await asyncio.sleep(self.window)
+        messages = sorted(self._albums.pop(key), key=lambda message: message.message_id)
+        try:
+            await on_album(messages)
+        except Exception as e:
+            logging.error("⚠️ Ошибка обработки альбома %s: %s", key[1], e)
+            self._failed.add(key)
+
+    async def join(self) -> set[tuple[int, str]]:
+        """
+        Дождаться обработки всех собираемых альбомов.
+        Возвращает (chat_id, media_group_id) альбомов, обработка которых упала: их апдейты нужно доставить повторно
+        """
+        self._bind_loop()
+        while self._tasks:
+            await asyncio.gather(*self._tasks)
+
+        failed, self._failed = self._failed, set()
+        return failed
+
+
+albums = AlbumCollector()
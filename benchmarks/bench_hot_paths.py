@@ -0,0 +1,324 @@
+"""
+Микробенчмарки горячих путей. Сеть, Telegram и YDB не нужны: бэкенды подменены заглушками.
+
+  - кодирование запроса и декодирование ответа в restore() на разных размерах картинки;
+  - _to_params и _row_to_* в ydb_models;
+  - get_texts;
+  - разбор payload счёта;
+  - полный проход синтетического апдейта через dp.feed_webhook_update.
+
+Результаты пишутся в JSON, чтобы сравнивать версии между собой.
+
+Запуск:              python benchmarks/bench_hot_paths.py --output before.json
+Сравнение:           python benchmarks/bench_hot_paths.py --compare before.json
+Только часть тестов: python benchmarks/bench_hot_paths.py --filter dispatch
+"""
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# бот без сети: токен-заглушка, лимиты Telegram и окно склейки удалений не должны мерить сон
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+os.environ.setdefault("OPENROUTER_API_KEY", "benchmark")
+os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "1000000000")
+os.environ.setdefault("TELEGRAM_CHAT_RATE", "1000000000")
+os.environ.setdefault("TELEGRAM_CHAT_BURST", "1000000000")
+os.environ.setdefault("TELEGRAM_DELETE_WINDOW", "0")
+
+from photo_restorer import build_request_body, extract_image
+from languages import get_texts
+from ydb_models import (User, UserClient, Cache, CacheClient, Payment, PaymentClient, Job, JobClient,
+                        Result, ResultClient, YDBClient)
+
+
+MODEL = "google/gemini-2.5-flash-image"
+PROMPT = "Restore and colorize this old or damaged photo. Remove photo frame and repair torn edges"
+IMAGE_SIZES_KB = [64, 512, 2048, 8192]
+REPEAT = 5
+MIN_TIME = 0.2  # сек. на один замер — число итераций подбирается под него
+
+
+# ------------------------------------------------------------------ ЗАМЕР ------------------------------------------------------------------
+
+
+def _calibrate(run) -> int:
+    """Число итераций, при котором один замер длится не меньше MIN_TIME"""
+    number = 1
+    while True:
+        elapsed = run(number)
+        if elapsed >= MIN_TIME or number >= 10 ** 7:
+            return number
+        number = max(number * 2, int(number * MIN_TIME / max(elapsed, 1e-9)))
+
+
+def bench(func) -> dict:
+    """Синхронная функция без аргументов: лучшее и медианное время одного вызова в микросекундах"""
+    def run(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - start
+
+    return bench_loop(run)
+
+
+def bench_async(loop: asyncio.AbstractEventLoop, coro_func) -> dict:
+    """То же для корутины: итерации крутятся внутри одного run_until_complete"""
+    async def batch(number: int) -> float:
+        start = time.perf_counter()
+        for _ in range(number):
+            await coro_func()
+        return time.perf_counter() - start
+
+    return bench_loop(lambda number: loop.run_until_complete(batch(number)))
+
+
+def bench_loop(run) -> dict:
+    """run(number) — время number итераций в секундах"""
+    number = _calibrate(run)
+    timings = [run(number) / number for _ in range(REPEAT)]
+    return {"best_us": round(min(timings) * 1e6, 3), "median_us": round(statistics.median(timings) * 1e6, 3),
+            "iterations": number}
+
+
+# ------------------------------------------------------------------ СЛУЧАИ ------------------------------------------------------------------
+
+
+def fake_response(image: bytes) -> bytes:
+    """Ответ OpenRouter в том виде, в каком он приходит по сети"""
+    url = "data:image/png;base64," + base64.b64encode(image).decode()
+    return json.dumps({
+        "choices": [{"message": {"role": "assistant", "content": "", "images": [{"type": "image_url", "image_url": {"url": url}}]}}]
+    }).encode()
+
+
+def image_cases() -> dict:
+    cases = {}
+    for size_kb in IMAGE_SIZES_KB:
+        image = os.urandom(size_kb * 1024)
+        raw_response = fake_response(image)
+        cases[f"restore.encode[{size_kb}KB]"] = lambda image=image: build_request_body(MODEL, PROMPT, image, "image/jpeg")
+        cases[f"restore.decode[{size_kb}KB]"] = lambda raw=raw_response: extract_image(raw)
+    return cases
+
+
+def ydb_cases() -> dict:
+    now = int(time.time())
+    user = User(123456789, "Иван Иванов", "ru", True, now)
+    cache = Cache(123456789, 42, "AgACAgIAAxkBAAIB" * 4, 43, now)
+    payment = Payment(123456789, 42, 50, "restoration", now)
+    job = Job("0" * 32, 123456789, 42, "AgACAgIAAxkBAAIB" * 4, "image", "AQADAgAT" * 2, None, "ru", 44, True,
+              status="queued", attempts=0, created_at=now, updated_at=now)
+    result = Result("k" * 64, b"\x89PNG" * 1000, now)
+
+    # строки результата YDB читаются как row["x"] и row.get("x") — dict ведёт себя так же
+    user_row = dict(vars(user))
+    cache_row = dict(vars(cache))
+    payment_row = dict(vars(payment))
+    job_row = dict(vars(job))
+    result_row = dict(vars(result))
+
+    user_client, cache_client, payment_client = UserClient(), CacheClient(), PaymentClient()
+    job_client, result_client = JobClient(), ResultClient()
+
+    return {
+        "ydb.user._to_params": lambda: user_client._to_params(user),
+        "ydb.user._row_to_user": lambda: user_client._row_to_user(user_row),
+        "ydb.cache._to_params": lambda: cache_client._to_params(cache),
+        "ydb.cache._key_params": lambda: cache_client._key_params(cache.telegram_id, cache.photo_message_id),
+        "ydb.cache._row_to_cache": lambda: cache_client._row_to_cache(cache_row),
+        "ydb.payment._to_params": lambda: payment_client._to_params(payment),
+        "ydb.payment._row_to_payment": lambda: payment_client._row_to_payment(payment_row),
+        "ydb.job._to_params": lambda: job_client._to_params(job),
+        "ydb.job._row_to_job": lambda: job_client._row_to_job(job_row),
+        "ydb.result._to_params": lambda: result_client._to_params(result),
+        "ydb.result._row_to_result": lambda: result_client._row_to_result(result_row),
+    }
+
+
+def payload_cases() -> dict:
+    from main import parse_invoice_payload
+
+    return {
+        "invoice.parse_payload": lambda: parse_invoice_payload("payment|50|12345|image|AQADAgATxr4xG3Qh"),
+        "invoice.parse_payload[legacy]": lambda: parse_invoice_payload("payment|50|12345|file_image"),
+    }
+
+
+def text_cases(loop: asyncio.AbstractEventLoop) -> dict:
+    return {
+        "texts.get_texts[ru]": lambda: bench_async(loop, lambda: get_texts("ru")),
+        "texts.get_texts[fallback]": lambda: bench_async(loop, lambda: get_texts("de")),
+    }
+
+
+# --------------------------------------------------------------- ДИСПЕТЧЕР ---------------------------------------------------------------
+
+
+class _ResultSet:
+    def __init__(self, rows: list):
+        self.rows = rows
+
+
+def stub_backends(state: dict):
+    """
+    Подмена сети: Bot API отвечает сразу из make_request сессии (middleware бота при этом работают),
+    YDB — из execute_query (параметры и разбор строк остаются настоящими), очередь задач — в никуда
+    """
+    import main
+    from aiogram.methods import SendMessage, SendInvoice
+    from aiogram.types import Chat, Message
+
+    async def make_request(bot, method, timeout=None):
+        if isinstance(method, (SendMessage, SendInvoice)):
+            state["message_id"] += 1
+            return Message(message_id=state["message_id"], date=datetime.now(timezone.utc),
+                           chat=Chat(id=method.chat_id, type="private"), text=getattr(method, "text", None))
+        return True
+
+    async def connect(self):
+        self.pool = self.driver = object()
+
+    async def execute_query(self, query, params=None):
+        return [_ResultSet([dict(telegram_id=params["$telegram_id"][0], full_name="Иван Иванов", language_code="ru",
+                                 free_generate=state["free_generate"], created_at=0,
+                                 taken=state["free_generate"])])]
+
+    class NullQueue:
+        async def submit(self, job):
+            return job
+
+    main.bot.session.make_request = make_request
+    YDBClient.connect = connect
+    YDBClient.execute_query = execute_query
+    main.job_queue = NullQueue()
+
+
+def make_update(update_id: int, user_id: int, **message) -> dict:
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private"},
+        "from": {"id": user_id, "is_bot": False, "first_name": "Иван", "language_code": "ru"},
+        **message,
+    }
+    return {"update_id": update_id, "message": message}
+
+
+def dispatch_cases(loop: asyncio.AbstractEventLoop) -> dict:
+    from main import dp, bot
+
+    state = {"message_id": 1000, "free_generate": True}
+    stub_backends(state)
+    counter = iter(range(1, 10 ** 9))
+
+    photo = {"photo": [{"file_id": "AgACAgIAAxkBAAIB", "file_unique_id": "AQADAgATxr4xG3Qh", "width": 1280, "height": 960}]}
+
+    async def feed(free_generate: bool = True, **message):
+        update_id = next(counter)
+        state["free_generate"] = free_generate
+        await dp.feed_webhook_update(bot=bot, update=make_update(update_id, update_id, **message))
+
+    return {
+        "dispatch.start": lambda: bench_async(loop, lambda: feed(text="/start", entities=[
+            {"type": "bot_command", "offset": 0, "length": 6}])),
+        "dispatch.photo[free]": lambda: bench_async(loop, lambda: feed(True, **photo)),
+        "dispatch.photo[paid]": lambda: bench_async(loop, lambda: feed(False, **photo)),
+        "dispatch.stray_text": lambda: bench_async(loop, lambda: feed(text="привет")),
+    }
+
+
+# ----------------------------------------------------------------- ЗАПУСК -----------------------------------------------------------------
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run(name_filter: str = "") -> dict:
+    # логи aiogram и бота на каждый апдейт мерили бы вывод в консоль, а не обработку
+    logging.disable(logging.INFO)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    cases = {}
+    cases.update({name: (lambda func=func: bench(func)) for name, func in image_cases().items()})
+    cases.update({name: (lambda func=func: bench(func)) for name, func in ydb_cases().items()})
+    cases.update({name: (lambda func=func: bench(func)) for name, func in payload_cases().items()})
+    cases.update(text_cases(loop))
+    cases.update(dispatch_cases(loop))
+
+    results = {}
+    for name, measure in cases.items():
+        if name_filter and name_filter not in name:
+            continue
+        results[name] = measure()
+        print(f"{name:<36} {results[name]['best_us']:>14.3f} us  (median {results[name]['median_us']:.3f})")
+
+    loop.close()
+
+    return {
+        "revision": _git_revision(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, threshold: float) -> bool:
+    """Печатает разницу с базовой версией. False — есть замедление больше threshold"""
+    ok = True
+    print(f"\nСравнение с {baseline.get('revision')} ({baseline.get('timestamp')}):")
+    for name, result in report["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            continue
+        change = result["best_us"] / base["best_us"] - 1
+        mark = ""
+        if change > threshold:
+            mark, ok = "  <-- замедление", False
+        print(f"{name:<36} {base['best_us']:>14.3f} -> {result['best_us']:>14.3f} us  {change:+.1%}{mark}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", help="куда сохранить результаты (JSON)")
+    parser.add_argument("--compare", help="JSON с результатами базовой версии")
+    parser.add_argument("--threshold", type=float, default=0.2, help="допустимое замедление (доля), по умолчанию 0.2")
+    parser.add_argument("--filter", default="", help="запускать только случаи, в имени которых есть подстрока")
+    args = parser.parse_args()
+
+    report = run(args.filter)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if not compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Бенчмарк пути картинки через PhotoRestorer.restore(): кодирование запроса и декодирование ответа.
+Сравнивает старый путь (bytes -> base64 str -> f-string -> json SDK) с новым (build_request_body / extract_image).
+Сеть не нужна. Запуск: python benchmarks/bench_image_path.py
+"""
+import base64
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from photo_restorer import build_request_body, extract_image
+
+
+MODEL = "google/gemini-2.5-flash-image"
+PROMPT = "Restore and colorize this old or damaged photo. Remove photo frame and repair torn edges"
+SIZES_MB = [0.5, 2, 5, 10]
+REPEAT = 5
+
+
+def fake_response(image: bytes) -> bytes:
+    """Ответ OpenRouter в том виде, в каком он приходит по сети"""
+    url = "data:image/png;base64," + base64.b64encode(image).decode()
+    return json.dumps({
+        "choices": [{"message": {"role": "assistant", "content": "", "images": [{"type": "image_url", "image_url": {"url": url}}]}}]
+    }).encode()
+
+
+def legacy_path(downloaded: io.BytesIO, raw_response: bytes) -> bytes:
+    # запрос: как было в restore() + сериализация тела в SDK
+    img_bytes = downloaded.read()
+    img_b64 = base64.b64encode(img_bytes).decode("utf-8")
+    messages = [{"role": "user", "content": [{"type": "text", "text": PROMPT},
+                                             {"type": "image_url", "image_url": f"data:image/png;base64,{img_b64}"}]}]
+    body = json.dumps({"model": MODEL, "messages": messages}).encode()
+    del img_bytes, img_b64, messages, body
+
+    # ответ: json -> data URL -> split -> b64decode
+    data = json.loads(raw_response)
+    image_data_url = data["choices"][0]["message"]["images"][0]["image_url"]["url"]
+    image_b64 = image_data_url.split(",")[1]
+    return base64.b64decode(image_b64)
+
+
+def new_path(downloaded: io.BytesIO, raw_response: bytes) -> bytes:
+    img_buffer = downloaded.getbuffer()
+    body = build_request_body(MODEL, PROMPT, img_buffer)
+    img_buffer.release()
+    del body
+
+    return extract_image(raw_response)
+
+
+def measure(func, image: bytes, raw_response: bytes) -> dict:
+    timings = []
+    for _ in range(REPEAT):
+        downloaded = io.BytesIO(image)
+        start = time.perf_counter()
+        func(downloaded, raw_response)
+        timings.append(time.perf_counter() - start)
+
+    downloaded = io.BytesIO(image)
+    tracemalloc.start()
+    func(downloaded, raw_response)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"time_ms": round(min(timings) * 1000, 2), "peak_mb": round(peak / 2**20, 2)}
+
+
+def main() -> list[dict]:
+    results = []
+    for size_mb in SIZES_MB:
+        image = os.urandom(int(size_mb * 2**20))
+        raw_response = fake_response(image)
+
+        legacy = measure(legacy_path, image, raw_response)
+        new = measure(new_path, image, raw_response)
+        results.append({"size_mb": size_mb, "legacy": legacy, "new": new})
+
+        print(f"{size_mb:>5} MB | legacy {legacy['time_ms']:>8} ms {legacy['peak_mb']:>7} MB peak "
+              f"| new {new['time_ms']:>8} ms {new['peak_mb']:>7} MB peak")
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Бенчмарк подготовки входного изображения (image_preprocess.normalize_image).
+Показывает размер до/после, время подготовки и размер тела запроса в OpenRouter.
+Сеть не нужна. Запуск: python benchmarks/bench_preprocess.py
+"""
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image
+from image_preprocess import normalize_image
+from photo_restorer import build_request_body
+
+
+MODEL = "google/gemini-2.5-flash-image"
+PROMPT = "Restore and colorize this old or damaged photo. Remove photo frame and repair torn edges"
+CASES = [
+    ("JPEG", (1280, 960)),
+    ("JPEG", (3024, 4032)),
+    ("JPEG", (4000, 6000)),
+    ("PNG", (1280, 960)),
+    ("PNG", (3024, 4032)),
+]
+REPEAT = 3
+
+
+def synthetic_photo(size: tuple[int, int], image_format: str) -> bytes:
+    """Похожая на скан фотография картинка: градиент + шум, с EXIF"""
+    noise = Image.effect_noise(size, 40).convert("RGB")
+    gradient = Image.linear_gradient("L").resize(size).convert("RGB")
+    image = Image.blend(noise, gradient, 0.6)
+
+    exif = Image.Exif()
+    exif[0x010F] = "Scanner"  # Make
+    exif[0x0112] = 1  # Orientation
+
+    output = io.BytesIO()
+    if image_format == "JPEG":
+        image.save(output, format="JPEG", quality=95, exif=exif)
+    else:
+        image.save(output, format="PNG", exif=exif)
+    return output.getvalue()
+
+
+def main() -> list[dict]:
+    results = []
+    for image_format, size in CASES:
+        data = synthetic_photo(size, image_format)
+
+        timings = []
+        for _ in range(REPEAT):
+            start = time.perf_counter()
+            normalized, mime_type = normalize_image(data)
+            timings.append(time.perf_counter() - start)
+
+        body_before = len(build_request_body(MODEL, PROMPT, data))
+        body_after = len(build_request_body(MODEL, PROMPT, normalized, mime_type))
+
+        result = {
+            "format": image_format,
+            "size": f"{size[0]}x{size[1]}",
+            "input_kb": len(data) // 1024,
+            "output_kb": len(normalized) // 1024,
+            "mime_type": mime_type,
+            "preprocess_ms": round(min(timings) * 1000, 1),
+            "body_before_kb": body_before // 1024,
+            "body_after_kb": body_after // 1024,
+        }
+        results.append(result)
+
+        print(f"{image_format:>4} {result['size']:>9} | {result['input_kb']:>6} KB -> {result['output_kb']:>5} KB "
+              f"({mime_type}) | {result['preprocess_ms']:>6} ms | body {result['body_before_kb']:>6} KB -> {result['body_after_kb']:>5} KB")
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Бенчмарк холодного старта точек входа. Каждый замер — новый процесс python.
+Падает (exit code 1), если медиана превышает бюджет из startup_budget.json.
+Бюджет — замеренная медиана плюс около 25% на разброс: после ускорения старта его стоит опустить.
+
+Запуск:             python benchmarks/bench_startup.py
+Профиль импортов:   python benchmarks/bench_startup.py --profile index
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGET_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_budget.json")
+REPEAT = 5
+
+# что замеряем: имя -> код, выполняемый в чистом процессе
+TARGETS = {
+    # worker очереди: импорт модуля функции (так начинается каждый холодный вызов)
+    "index": "import index",
+    # бот целиком: aiogram, Bot и Dispatcher, все роутеры
+    "main": "import main",
+    # redirect_function: импорт модуля функции
+    "redirect_function": "import index",
+}
+
+SCRIPT = "import time; t = time.perf_counter(); {code}; print(time.perf_counter() - t)"
+
+
+def _env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    return env
+
+
+def _cwd(target: str) -> str:
+    return os.path.join(ROOT, "redirect_function") if target == "redirect_function" else ROOT
+
+
+def measure(target: str) -> float:
+    """Медиана времени импорта в миллисекундах"""
+    timings = []
+    for _ in range(REPEAT):
+        output = subprocess.run(
+            [sys.executable, "-c", SCRIPT.format(code=TARGETS[target])],
+            cwd=_cwd(target), env=_env(), capture_output=True, text=True, check=True,
+        ).stdout
+        timings.append(float(output.strip().splitlines()[-1]) * 1000)
+    return round(statistics.median(timings), 1)
+
+
+def profile(target: str, top: int = 20):
+    """Самые дорогие импорты (python -X importtime), по накопленному времени"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", TARGETS[target]],
+        cwd=_cwd(target), env=_env(), capture_output=True, text=True, check=True,
+    ).stderr
+
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        self_us, cumulative_us, name = line.replace("import time:", "").split("|")
+        rows.append((int(cumulative_us), int(self_us), name.rstrip()))
+
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:top]:
+        print(f"{cumulative_us / 1000:>9.1f} ms  {self_us / 1000:>8.1f} ms  {name}")
+
+
+def main() -> int:
+    with open(BUDGET_FILE, encoding="utf-8") as f:
+        budget = json.load(f)
+
+    failed = False
+    results = {}
+    for target in TARGETS:
+        results[target] = measure(target)
+        limit = budget.get(target)
+        status = "ok" if limit is None or results[target] <= limit else "REGRESSION"
+        failed |= status == "REGRESSION"
+        print(f"{target:>18}: {results[target]:>8} ms (бюджет {limit} ms) {status}")
+
+    print(json.dumps(results))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--profile":
+        profile(sys.argv[2])
+    else:
+        sys.exit(main())
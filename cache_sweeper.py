@@ -0,0 +1,67 @@
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, Optional
+from config import INVOICE_EXPIRE, INVOICE_SWEEP_BATCH, INVOICE_SWEEP_MAX_BATCHES
+from ydb_models import CacheClient
+
+if TYPE_CHECKING:
+    from aiogram import Bot
+
+
+# Уборка брошенных счетов: записи cache старше INVOICE_EXPIRE удаляются вместе с сообщением-счётом в Telegram.
+# За один проход — не больше INVOICE_SWEEP_MAX_BATCHES пачек по INVOICE_SWEEP_BATCH записей.
+
+
+async def sweep_expired_invoices(bot: Optional["Bot"] = None, batch_size: int = INVOICE_SWEEP_BATCH,
+                                 max_batches: int = INVOICE_SWEEP_MAX_BATCHES) -> int:
+    """
+    Один ограниченный проход уборки. Возвращает число удалённых записей.
+    Без bot бот (и aiogram) загружается, только если есть что удалять в Telegram
+    """
+    created_before = int(datetime.now(timezone.utc).timestamp()) - INVOICE_EXPIRE
+    removed = 0
+
+    async with CacheClient() as cache_client:
+        for _ in range(max_batches):
+            expired = await cache_client.get_expired_cache(created_before, batch_size)
+            if not expired:
+                break
+
+            # сообщения со счетами удаляем пачками по чатам (deleteMessages — до 100 id за вызов);
+            # у фото одного альбома счёт общий — id не повторяем
+            by_chat = defaultdict(list)
+            for cache in expired:
+                if cache.pay_message_id is not None and cache.pay_message_id not in by_chat[cache.telegram_id]:
+                    by_chat[cache.telegram_id].append(cache.pay_message_id)
+
+            if by_chat and bot is None:
+                from main import bot
+
+            for chat_id, message_ids in by_chat.items():
+                for i in range(0, len(message_ids), 100):
+                    try:
+                        await bot.delete_messages(chat_id, message_ids[i:i + 100])
+                    except Exception as e:
+                        logging.warning("⚠️ Не удалось удалить счета в чате %s: %s", chat_id, e)
+
+            await cache_client.delete_cache_batch(expired)
+            removed += len(expired)
+
+            if len(expired) < batch_size:
+                break
+
+    if removed:
+        logging.info("🧹 Удалено просроченных счетов: %s", removed)
+    return removed
+
+
+async def run_invoice_sweeper(bot: "Bot", interval: int):
+    """Фоновая уборка раз в interval секунд (для режима polling)"""
+    while True:
+        try:
+            await sweep_expired_invoices(bot)
+        except Exception as e:
+            logging.error("⚠️ Ошибка уборки просроченных счетов: %s", e)
+        await asyncio.sleep(interval)
@@ -1,4 +1,5 @@
 import os
+from urllib.parse import urlparse
 from dotenv import dotenv_values
 
 
@@ -8,16 +9,112 @@ config = dotenv_values(".env")
 # Конфигурация
 TELEGRAM_BOT_TOKEN = os.environ.get("TELEGRAM_BOT_TOKEN") or config.get("TELEGRAM_BOT_TOKEN")
 OPENROUTER_API_KEY =  os.environ.get("OPENROUTER_API_KEY") or config.get("OPENROUTER_API_KEY")
+OPENROUTER_TIMEOUT = float(os.environ.get("OPENROUTER_TIMEOUT") or config.get("OPENROUTER_TIMEOUT") or 120)  # сек. на генерацию
+OPENROUTER_CONNECT_TIMEOUT = float(os.environ.get("OPENROUTER_CONNECT_TIMEOUT") or config.get("OPENROUTER_CONNECT_TIMEOUT") or 10)
+OPENROUTER_MAX_CONNECTIONS = int(os.environ.get("OPENROUTER_MAX_CONNECTIONS") or config.get("OPENROUTER_MAX_CONNECTIONS") or 20)
+OPENROUTER_MAX_CONCURRENCY = int(os.environ.get("OPENROUTER_MAX_CONCURRENCY") or config.get("OPENROUTER_MAX_CONCURRENCY") or 10)  # генераций одновременно
+
+# Модели генерации: основная и запасные (через запятую) для хеджа и переключения при ошибках
+MODEL_PRIMARY = os.environ.get("MODEL_PRIMARY") or config.get("MODEL_PRIMARY") or "google/gemini-2.5-flash-image"
+MODEL_FALLBACKS = [model.strip() for model in (os.environ.get("MODEL_FALLBACKS") or config.get("MODEL_FALLBACKS")
+                   or "google/gemini-2.5-flash-image-preview").split(",") if model.strip()]
+# Хедж: после какого перцентиля задержки основной модели, с какого числа замеров и не больше какой доли запросов
+MODEL_HEDGE_PERCENTILE = float(os.environ.get("MODEL_HEDGE_PERCENTILE") or config.get("MODEL_HEDGE_PERCENTILE") or 95)
+MODEL_HEDGE_MIN_SAMPLES = int(os.environ.get("MODEL_HEDGE_MIN_SAMPLES") or config.get("MODEL_HEDGE_MIN_SAMPLES") or 20)
+MODEL_HEDGE_MAX_RATIO = float(os.environ.get("MODEL_HEDGE_MAX_RATIO") or config.get("MODEL_HEDGE_MAX_RATIO") or 0.1)
+# Circuit breaker: ошибок подряд до отключения модели и на сколько секунд
+MODEL_BREAKER_FAILURES = int(os.environ.get("MODEL_BREAKER_FAILURES") or config.get("MODEL_BREAKER_FAILURES") or 5)
+MODEL_BREAKER_COOLDOWN = float(os.environ.get("MODEL_BREAKER_COOLDOWN") or config.get("MODEL_BREAKER_COOLDOWN") or 60)
+# Допуск к модели: темп запросов (в сек.) под лимит провайдера, запас на всплеск и генераций одного пользователя одновременно
+MODEL_RATE_LIMIT = float(os.environ.get("MODEL_RATE_LIMIT") or config.get("MODEL_RATE_LIMIT") or 2)
+MODEL_RATE_BURST = float(os.environ.get("MODEL_RATE_BURST") or config.get("MODEL_RATE_BURST") or 5)
+MODEL_PER_USER_INFLIGHT = int(os.environ.get("MODEL_PER_USER_INFLIGHT") or config.get("MODEL_PER_USER_INFLIGHT") or 1)
 
 YDB_PATH = os.environ.get("YDB_PATH") or config.get("YDB_PATH")
 YDB_ENDPOINT = os.environ.get("YDB_ENDPOINT") or config.get("YDB_ENDPOINT")
 YDB_TOKEN = os.environ.get("YDB_TOKEN") or config.get("YDB_TOKEN")
+YDB_POOL_SIZE = int(os.environ.get("YDB_POOL_SIZE") or config.get("YDB_POOL_SIZE") or 10)  # макс. сессий в общем пуле
+YDB_POOL_WARMUP = int(os.environ.get("YDB_POOL_WARMUP") or config.get("YDB_POOL_WARMUP") or 2)  # сессий, открываемых при старте
 
 AMOUNT = 1
 
+# Подготовка входного изображения перед отправкой в модель
+IMAGE_MAX_SIDE = int(os.environ.get("IMAGE_MAX_SIDE") or config.get("IMAGE_MAX_SIDE") or 2048)  # px по длинной стороне
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY") or config.get("IMAGE_JPEG_QUALITY") or 90)
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS") or config.get("PREPROCESS_WORKERS") or 4)  # потоков
+# Сколько секунд после первого фото альбома ждать остальные (Telegram присылает альбом отдельными сообщениями)
+ALBUM_WINDOW = float(os.environ.get("ALBUM_WINDOW") or config.get("ALBUM_WINDOW") or 1.0)
+
+# Неоплаченные счета (таблица cache): свипер удаляет счёт и сообщение через INVOICE_EXPIRE,
+# TTL таблицы — страховка, если свипер не запущен. Telegram даёт удалить сообщение бота только в течение 48 ч
+INVOICE_EXPIRE = int(os.environ.get("INVOICE_EXPIRE") or config.get("INVOICE_EXPIRE") or 24 * 3600)  # сек.
+CACHE_TTL = int(os.environ.get("CACHE_TTL") or config.get("CACHE_TTL") or 7 * 24 * 3600)  # сек.
+INVOICE_SWEEP_BATCH = int(os.environ.get("INVOICE_SWEEP_BATCH") or config.get("INVOICE_SWEEP_BATCH") or 100)  # записей за проход
+INVOICE_SWEEP_MAX_BATCHES = int(os.environ.get("INVOICE_SWEEP_MAX_BATCHES") or config.get("INVOICE_SWEEP_MAX_BATCHES") or 5)
+INVOICE_SWEEP_INTERVAL = int(os.environ.get("INVOICE_SWEEP_INTERVAL") or config.get("INVOICE_SWEEP_INTERVAL") or 0)  # сек., 0 — фоновый свипер выключен
+
+# Кэш результатов генераций: memory | disk | ydb | off
+RESULT_CACHE_BACKEND = os.environ.get("RESULT_CACHE_BACKEND") or config.get("RESULT_CACHE_BACKEND") or "memory"
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL") or config.get("RESULT_CACHE_TTL") or 7 * 24 * 3600)  # сек.
+RESULT_CACHE_MAX_MB = int(os.environ.get("RESULT_CACHE_MAX_MB") or config.get("RESULT_CACHE_MAX_MB") or 200)
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR") or config.get("RESULT_CACHE_DIR") or "/tmp/restavrator_results"
+
 ADMIN_ID = os.environ.get("ADMIN_ID") or config.get("ADMIN_ID")
 
-WEBHOOK_URL = os.environ.get("WEBHOOK_URL")
-WEBAPP_HOST = os.environ.get("WEBAPP_HOST")
-WEBAPP_PORT = os.environ.get("WEBAPP_PORT")
+# Очередь задач реставрации: memory — воркеры в этом же процессе, ydb — таблица jobs,
+# из которой задачи берут отдельные процессы restore_worker.py
+JOB_QUEUE_BACKEND = os.environ.get("JOB_QUEUE_BACKEND") or config.get("JOB_QUEUE_BACKEND") or "memory"
+RESTORE_WORKERS = int(os.environ.get("RESTORE_WORKERS") or config.get("RESTORE_WORKERS") or 4)  # воркеров в процессе
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL") or config.get("JOB_POLL_INTERVAL") or 1)  # сек., для ydb
+JOB_TTL = int(os.environ.get("JOB_TTL") or config.get("JOB_TTL") or 7 * 24 * 3600)  # сек. хранения задач в jobs
+JOB_POLL_MAX_INTERVAL = float(os.environ.get("JOB_POLL_MAX_INTERVAL") or config.get("JOB_POLL_MAX_INTERVAL") or 30)  # сек., потолок опроса пустой очереди
+# Аренда задачи (ydb): воркер продлевает её, пока работает; задача в running без продления дольше
+# JOB_LEASE сек. — воркер упал, её берёт другой. После JOB_MAX_ATTEMPTS попыток задача завершается с возвратом
+JOB_LEASE = int(os.environ.get("JOB_LEASE") or config.get("JOB_LEASE") or 300)
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS") or config.get("JOB_MAX_ATTEMPTS") or 3)
+
+# Сколько пользователей обрабатывает worker очереди одновременно
+WORKER_CONCURRENCY = int(os.environ.get("WORKER_CONCURRENCY") or config.get("WORKER_CONCURRENCY") or 8)
+
+# Отбрасывание повторов апдейтов по update_id: ydb — фильтр в памяти + таблица processed_updates,
+# memory — только фильтр в памяти процесса, off — выключено
+UPDATE_DEDUP = os.environ.get("UPDATE_DEDUP") or config.get("UPDATE_DEDUP") or "ydb"
+DEDUP_TTL = int(os.environ.get("DEDUP_TTL") or config.get("DEDUP_TTL") or 2 * 24 * 3600)  # сек. хранения update_id в YDB
+DEDUP_LEASE = int(os.environ.get("DEDUP_LEASE") or config.get("DEDUP_LEASE") or 600)  # сек., через сколько незавершённый апдейт можно взять снова
+# Фильтр Блума: update_id в одном поколении (поколений два) и допустимая доля ложных срабатываний
+DEDUP_FILTER_SIZE = int(os.environ.get("DEDUP_FILTER_SIZE") or config.get("DEDUP_FILTER_SIZE") or 100000)
+DEDUP_FALSE_POSITIVE = float(os.environ.get("DEDUP_FALSE_POSITIVE") or config.get("DEDUP_FALSE_POSITIVE") or 1e-9)
+
+# Логирование: уровень, доля апдейтов, тело которых попадает в лог, и предел длины тела в логе
+LOG_LEVEL = os.environ.get("LOG_LEVEL") or config.get("LOG_LEVEL") or "INFO"
+LOG_BODY_SAMPLE_RATE = float(os.environ.get("LOG_BODY_SAMPLE_RATE") or config.get("LOG_BODY_SAMPLE_RATE") or 0.1)
+LOG_BODY_MAX_CHARS = int(os.environ.get("LOG_BODY_MAX_CHARS") or config.get("LOG_BODY_MAX_CHARS") or 1000)
+
+# Метрики в формате OpenMetrics для режима polling: http://METRICS_HOST:METRICS_PORT/metrics (0 — выключено)
+METRICS_HOST = os.environ.get("METRICS_HOST") or config.get("METRICS_HOST") or "0.0.0.0"
+METRICS_PORT = int(os.environ.get("METRICS_PORT") or config.get("METRICS_PORT") or 0)
+
+# Исходящие вызовы Bot API: вызовов в секунду на бота и на чат, запас на всплеск в чате,
+# повторов после 429 и окно (сек.), за которое удаления в одном чате склеиваются в deleteMessages
+TELEGRAM_GLOBAL_RATE = float(os.environ.get("TELEGRAM_GLOBAL_RATE") or config.get("TELEGRAM_GLOBAL_RATE") or 30)
+TELEGRAM_CHAT_RATE = float(os.environ.get("TELEGRAM_CHAT_RATE") or config.get("TELEGRAM_CHAT_RATE") or 1)
+TELEGRAM_CHAT_BURST = float(os.environ.get("TELEGRAM_CHAT_BURST") or config.get("TELEGRAM_CHAT_BURST") or 3)
+TELEGRAM_MAX_RETRIES = int(os.environ.get("TELEGRAM_MAX_RETRIES") or config.get("TELEGRAM_MAX_RETRIES") or 3)
+TELEGRAM_DELETE_WINDOW = float(os.environ.get("TELEGRAM_DELETE_WINDOW") or config.get("TELEGRAM_DELETE_WINDOW") or 0.05)
+
+# Режим webhook (python main.py при заданном WEBHOOK_URL): публичный адрес, путь и секрет webhook,
+# адрес сервера, число процессов на одном порту и сколько секунд ждать апдейты в обработке при остановке
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL") or config.get("WEBHOOK_URL")
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH") or config.get("WEBHOOK_PATH") or urlparse(WEBHOOK_URL or "").path or "/webhook"
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET") or config.get("WEBHOOK_SECRET")
+WEBAPP_HOST = os.environ.get("WEBAPP_HOST") or config.get("WEBAPP_HOST") or "0.0.0.0"
+WEBAPP_PORT = int(os.environ.get("WEBAPP_PORT") or config.get("WEBAPP_PORT") or 8080)
+WEBAPP_WORKERS = int(os.environ.get("WEBAPP_WORKERS") or config.get("WEBAPP_WORKERS") or 1)
+WEBAPP_SHUTDOWN_TIMEOUT = float(os.environ.get("WEBAPP_SHUTDOWN_TIMEOUT") or config.get("WEBAPP_SHUTDOWN_TIMEOUT") or 30)
 
+# Шардирование апдейтов по хешу id пользователя: очередей-обработчиков в процессе (0 — без шардирования,
+# каждый апдейт — отдельная задача), предел очереди шарда и первый порт для пересылки апдейтов
+# между процессами webhook (процесс i слушает 127.0.0.1:SHARD_PORT_BASE+i)
+UPDATE_SHARDS = int(os.environ.get("UPDATE_SHARDS") or config.get("UPDATE_SHARDS") or 0)
+SHARD_QUEUE_SIZE = int(os.environ.get("SHARD_QUEUE_SIZE") or config.get("SHARD_QUEUE_SIZE") or 1000)
+SHARD_PORT_BASE = int(os.environ.get("SHARD_PORT_BASE") or config.get("SHARD_PORT_BASE") or WEBAPP_PORT + 100)
@@ -0,0 +1,118 @@
+import hashlib
+import logging
+import math
+from config import UPDATE_DEDUP, DEDUP_LEASE, DEDUP_FILTER_SIZE, DEDUP_FALSE_POSITIVE
+from metrics import DUPLICATE_UPDATES
+from ydb_models import ProcessedUpdateClient
+
+
+# Повторы апдейтов: очередь между redirect_function и воркером доставляет «хотя бы один раз»,
+# Telegram повторяет webhook. Повтор — это второй вызов модели, а то и вторая бесплатная генерация.
+#   - фильтр Блума в памяти: апдейт, уже обработанный этим процессом, отбрасывается без запроса в базу;
+#   - таблица processed_updates в YDB: апдейт берётся в обработку одной транзакцией на весь вызов,
+#     после обработки отмечается done, а при ошибке освобождается — повторная доставка его обработает;
+#   - апдейт, взятый и не завершённый (процесс упал), можно взять снова через DEDUP_LEASE секунд;
+#     до тех пор его повторная доставка не отбрасывается, а возвращается в очередь.
+# Если YDB недоступна, апдейты обрабатываются без проверки: лучше повтор, чем потерянный апдейт.
+
+
+class UpdateFilter:
+    """
+    Фильтр Блума из двух поколений по capacity update_id: когда текущее заполнено,
+    старое выбрасывается. Ложное «уже видели» — с вероятностью около error_rate
+    """
+
+    def __init__(self, capacity: int = DEDUP_FILTER_SIZE, error_rate: float = DEDUP_FALSE_POSITIVE):
+        self.capacity = capacity
+        self.bits = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._current = bytearray((self.bits + 7) // 8)
+        self._previous = bytearray(len(self._current))
+        self._count = 0
+
+    def _positions(self, update_id: int):
+        # k независимых позиций: по 4 байта SHAKE-128 на каждую
+        digest = hashlib.shake_128(str(update_id).encode()).digest(4 * self.hashes)
+        return [int.from_bytes(digest[i:i + 4], "little") % self.bits for i in range(0, len(digest), 4)]
+
+    @staticmethod
+    def _contains(bits: bytearray, positions: list[int]) -> bool:
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+    def __contains__(self, update_id: int) -> bool:
+        positions = self._positions(update_id)
+        return self._contains(self._current, positions) or self._contains(self._previous, positions)
+
+    def add(self, update_id: int):
+        if self._count >= self.capacity:
+            self._previous = self._current
+            self._current = bytearray(len(self._previous))
+            self._count = 0
+
+        for position in self._positions(update_id):
+            self._current[position >> 3] |= 1 << (position & 7)
+        self._count += 1
+
+
+class UpdateDeduplicator:
+    def __init__(self, backend: str = UPDATE_DEDUP, lease: int = DEDUP_LEASE):
+        if backend not in ("ydb", "memory", "off"):
+            raise ValueError(f"Неизвестный режим отбрасывания повторов: {backend}")
+
+        self.backend = backend
+        self.lease = lease
+        self.filter = UpdateFilter() if backend != "off" else None
+
+    async def claim(self, update_ids: list[int]) -> tuple[set[int], set[int]]:
+        """
+        (update_id, которые нужно обработать; update_id, которые сейчас обрабатывает другой вызов).
+        Остальные — повторы уже обработанных, их можно отбросить. Занятые другим вызовом отбрасывать нельзя:
+        если тот вызов упадёт, апдейт потеряется — их нужно доставить повторно, когда истечёт аренда
+        """
+        if self.backend == "off":
+            return set(update_ids), set()
+
+        fresh = []
+        for update_id in update_ids:
+            if update_id in self.filter or update_id in fresh:
+                DUPLICATE_UPDATES.inc(source="filter")
+                continue
+            fresh.append(update_id)
+
+        if self.backend != "ydb" or not fresh:
+            return set(fresh), set()
+
+        try:
+            async with ProcessedUpdateClient() as client:
+                done, busy = await client.claim_updates(fresh, self.lease)
+        except Exception as e:
+            logging.warning("⚠️ Не удалось проверить повторы апдейтов, обрабатываем все: %s", e)
+            return set(fresh), set()
+
+        if done:
+            DUPLICATE_UPDATES.inc(len(done), source="ydb")
+            logging.info("🔁 Повторы апдейтов отброшены: %s", sorted(done))
+        if busy:
+            logging.info("⏳ Апдейты обрабатывает другой вызов, вернём их в очередь: %s", sorted(busy))
+        return set(fresh) - done - busy, busy
+
+    async def finish(self, done_ids: list[int], failed_ids: list[int]):
+        """Апдейты обработаны (done_ids) или должны быть доставлены повторно (failed_ids)"""
+        if self.backend == "off":
+            return
+
+        # в фильтр — только обработанные: апдейт с ошибкой при повторной доставке должен пройти
+        for update_id in done_ids:
+            self.filter.add(update_id)
+
+        if self.backend != "ydb" or not (done_ids or failed_ids):
+            return
+
+        try:
+            async with ProcessedUpdateClient() as client:
+                await client.finish_updates(done_ids, failed_ids)
+        except Exception as e:
+            logging.warning("⚠️ Не удалось отметить обработанные апдейты: %s", e)
+
+
+dedup = UpdateDeduplicator()
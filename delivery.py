@@ -0,0 +1,80 @@
+import logging
+from typing import Optional
+from aiogram import Bot, types
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputMediaDocument, InputMediaPhoto
+from result_cache import result_cache
+from metrics import stage
+
+
+# Доставка готовых фото: если результат уже загружался в Telegram, шлём его по file_id
+# (без повторной загрузки PNG), иначе загружаем и запоминаем file_id, который вернул Telegram.
+
+
+async def _send(bot: Bot, chat_id: int, photo, file_type: str, caption: str, reply_to_message_id: int) -> types.Message:
+    if file_type == "image":
+        return await bot.send_photo(chat_id, photo=photo, caption=caption, reply_to_message_id=reply_to_message_id)
+    return await bot.send_document(chat_id, document=photo, reply_to_message_id=reply_to_message_id)
+
+
+async def send_by_file_id(bot: Bot, chat_id: int, cache_key: Optional[str], file_type: str,
+                          caption: str, reply_to_message_id: int) -> bool:
+    """Отправка результата по сохранённому file_id. False — file_id нет или Telegram его не принял"""
+    if not cache_key:
+        return False
+
+    file_id = await result_cache.get_file_id(cache_key, file_type)
+    if file_id is None:
+        return False
+
+    try:
+        await _send(bot, chat_id, file_id, file_type, caption, reply_to_message_id)
+    except TelegramBadRequest as e:
+        logging.warning("⚠️ Не удалось отправить по file_id, загружаем заново: %s", e)
+        return False
+
+    logging.info("♻️ Результат отправлен по file_id")
+    return True
+
+
+async def send_result(bot: Bot, chat_id: int, cache_key: Optional[str], photo_file: BufferedInputFile,
+                      file_type: str, caption: str, reply_to_message_id: int) -> types.Message:
+    """Загрузка результата в Telegram и сохранение полученного file_id"""
+    with stage("upload"):
+        sent = await _send(bot, chat_id, photo_file, file_type, caption, reply_to_message_id)
+
+    if cache_key:
+        file_id = sent.photo[-1].file_id if file_type == "image" else sent.document.file_id
+        await result_cache.set_file_id(cache_key, file_type, file_id)
+
+    return sent
+
+
+async def send_album(bot: Bot, chat_id: int, items: list[tuple[Optional[str], object]], file_type: str,
+                     caption: str, reply_to_message_id: int) -> list[types.Message]:
+    """
+    Отправка результатов альбома одним sendMediaGroup.
+    items — (ключ кэша, file_id или BufferedInputFile); для загруженных файлов запоминается file_id
+    """
+    if len(items) == 1:
+        cache_key, photo = items[0]
+        if isinstance(photo, str):
+            return [await _send(bot, chat_id, photo, file_type, caption, reply_to_message_id)]
+        return [await send_result(bot, chat_id, cache_key, photo, file_type, caption, reply_to_message_id)]
+
+    # подпись альбома — подпись первого фото (документы, как и в _send, без подписи);
+    # фото и документы в одном альбоме Telegram не смешивает
+    if file_type == "image":
+        media = [InputMediaPhoto(media=photo, caption=caption if i == 0 else None) for i, (_, photo) in enumerate(items)]
+    else:
+        media = [InputMediaDocument(media=photo) for _, photo in items]
+
+    with stage("upload"):
+        sent = await bot.send_media_group(chat_id, media=media, reply_to_message_id=reply_to_message_id)
+
+    for (cache_key, photo), message in zip(items, sent):
+        if cache_key and not isinstance(photo, str):
+            file_id = message.photo[-1].file_id if file_type == "image" else message.document.file_id
+            await result_cache.set_file_id(cache_key, file_type, file_id)
+
+    return sent
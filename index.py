@@ -1,32 +1,156 @@
+import asyncio
 import json
-from main import dp, bot, logger
+import logging
+from collections import defaultdict
+from config import WORKER_CONCURRENCY, JOB_QUEUE_BACKEND
+from cache_sweeper import sweep_expired_invoices
+from metrics import flush_metrics
+from log_config import setup_logging, set_request_id, sample_payload, flush_logging
+from sharding import get_user_id
+from dedup import dedup
 
 
-async def handler(event, context):
-    """Обработчик очереди (worker)"""
-    messages = event.get("messages", [])
-    logger.info(f"Worker получил {len(messages)} сообщений")
+# Настройка логирования
+setup_logging()
+logger = logging.getLogger(__name__)
+
+
+def get_dispatcher():
+    """
+    Бот и диспетчер загружаются при первом настоящем апдейте:
+    aiogram — самая тяжёлая часть холодного старта, ping-сообщениям он не нужен
+    """
+    from main import dp, bot
+
+    # feed_webhook_update не вызывает dp.startup — воркеры очереди в памяти запускаем сами
+    if JOB_QUEUE_BACKEND == "memory":
+        from restore_worker import start_restore_workers
+        start_restore_workers(bot)
+
+    return dp, bot
+
 
-    for msg in messages:
-        body_str = msg.get("details", {}).get("message", {}).get("body")
+async def process_message(msg: dict) -> bool:
+    """Обработка одного сообщения очереди. False — ошибка, сообщение нужно доставить повторно"""
+    body_str = msg.get("details", {}).get("message", {}).get("body")
 
-        if not body_str:
-            continue
+    if not body_str:
+        return True
 
-        logger.info(f"Worker BODY: {body_str}")
+    try:
+        body = json.loads(body_str)
+    except Exception as e:
+        # битое сообщение повторная доставка не исправит
+        logger.error("Ошибка парсинга body: %s", e)
+        return True
 
+    # все логи обработки этого апдейта помечены его update_id
+    set_request_id(body.get("update_id", "-") if isinstance(body, dict) else "-")
+
+    if logger.isEnabledFor(logging.INFO):
+        preview = sample_payload(body_str)
+        if preview is not None:
+            logger.info("Worker BODY: %s", preview)
+
+    if body.get("ping"):
+        logger.info("⚙️ Получен ping — убираем просроченные счета")
         try:
-            body = json.loads(body_str)
+            await sweep_expired_invoices()
         except Exception as e:
-            logger.error(f"Ошибка парсинга body: {e}")
-            continue
+            logger.error("Ошибка уборки просроченных счетов: %s", e)
+        return True
+
+    try:
+        dp, bot = get_dispatcher()
+        await dp.feed_webhook_update(bot=bot, update=body)
+    except Exception as e:
+        logger.error("Ошибка при обработке update: %s", e)
+        return False
 
-        if body.get("ping"):
-            logger.info("⚙️ Получен ping — пропускаем")
-            continue
+    return True
+
+
+async def handler(event, context):
+    """
+    Обработчик очереди (worker).
+    Апдейты разных пользователей обрабатываются параллельно (не больше WORKER_CONCURRENCY),
+    апдейты одного пользователя — строго по порядку.
+    При нескольких очередях в MQ2_URL у каждой свой триггер: функция получает только пользователей своего шарда
+    """
+    messages = event.get("messages", [])
+    logger.info("Worker получил %s сообщений", len(messages))
 
+    # группируем по пользователю, сохраняя порядок внутри группы
+    groups = defaultdict(list)
+    update_ids = {}
+    album_keys = {}
+    for i, msg in enumerate(messages):
         try:
-            await dp.feed_webhook_update(bot=bot, update=body)
-        except Exception as e:
-            logger.error(f"Ошибка при обработке update: {e}")
+            update = json.loads(msg.get("details", {}).get("message", {}).get("body") or "{}")
+            user_key = get_user_id(update) if isinstance(update, dict) else None
+            if isinstance(update, dict) and isinstance(update.get("update_id"), int):
+                update_ids[i] = update["update_id"]
+            message = update.get("message") if isinstance(update, dict) else None
+            if isinstance(message, dict) and message.get("media_group_id"):
+                album_keys[i] = (message.get("chat", {}).get("id"), message["media_group_id"])
+        except Exception:
+            user_key = None
+        groups[user_key if user_key is not None else ("message", i)].append((i, msg))
+
+    # повторы уже обработанных апдейтов отбрасываем до диспетчера; апдейты, которые сейчас
+    # обрабатывает другой вызов (возможно, упавший), возвращаем в очередь — после аренды их возьмут снова
+    fresh, busy = await dedup.claim(list(update_ids.values())) if update_ids else (set(), set())
+
+    semaphore = asyncio.Semaphore(WORKER_CONCURRENCY)
+    failed = []
+    results = {}
+
+    async def process_group(group: list[tuple[int, dict]]):
+        async with semaphore:
+            for i, msg in group:
+                update_id = update_ids.get(i)
+                if update_id in busy:
+                    failed.append(msg)
+                    continue
+                if update_id is not None and update_id not in fresh:
+                    continue
+                # каждый update_id обрабатывается один раз, даже если пришёл в пачке дважды
+                fresh.discard(update_id)
+
+                results[i] = await process_message(msg)
+
+    await asyncio.gather(*(process_group(group) for group in groups.values()))
+
+    # после ответа функция замораживается — собираемые альбомы и задачи из очереди в памяти доделываем до возврата.
+    # Фото альбома обработчик принял сразу, а альбом целиком мог упасть позже — такие апдейты тоже с ошибкой
+    from albums import albums
+    failed_albums = await albums.join()
+    for i, key in album_keys.items():
+        if key in failed_albums and i in results:
+            results[i] = False
+    if JOB_QUEUE_BACKEND == "memory":
+        from jobs import job_queue
+        await job_queue.join()
+
+    done_ids, failed_ids = [], []
+    for i, ok in results.items():
+        if not ok:
+            failed.append(messages[i])
+        if i in update_ids:
+            (done_ids if ok else failed_ids).append(update_ids[i])
+
+    await dedup.finish(done_ids, failed_ids)
+
+    if failed:
+        logger.error("Worker: не обработано %s из %s сообщений", len(failed), len(messages))
+
+    # метрики вызова — одной строкой в лог
+    flush_metrics(logger)
+    await flush_logging()
+
+    # у триггера очереди нет частичного подтверждения: обычный возврат удаляет из очереди всю пачку.
+    # Ошибка — пачка доставляется заново целиком, уже обработанные апдейты отбросит dedup
+    if failed:
+        raise RuntimeError(f"Не обработано {len(failed)} из {len(messages)} сообщений, пачка будет доставлена повторно")
 
+    return {"statusCode": 200}
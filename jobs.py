@@ -0,0 +1,149 @@
+import asyncio
+import uuid
+from collections import OrderedDict
+from typing import Optional
+from config import JOB_QUEUE_BACKEND
+from ydb_models import Job, JobClient, JobStatus
+
+
+# Очередь задач реставрации. Обработчик апдейта только ставит задачу и сразу отвечает,
+# скачивание → модель → отправку выполняют воркеры из restore_worker.py.
+
+
+def new_job_id() -> str:
+    return uuid.uuid4().hex
+
+
+def paid_job_id(telegram_id: int, message_id: int) -> str:
+    """id задачи по оплате: одинаковый при повторной доставке платежа, чтобы не поставить задачу дважды"""
+    return uuid.uuid5(uuid.NAMESPACE_OID, f"payment:{telegram_id}:{message_id}").hex
+
+
+class JobQueue:
+    """Базовая очередь задач"""
+
+    async def submit(self, job: Job) -> Job:
+        raise NotImplementedError
+
+    async def submit_once(self, job: Job) -> bool:
+        """Поставить задачу, если задачи с таким job_id ещё не было. False — уже поставлена"""
+        raise NotImplementedError
+
+    async def claim(self) -> Optional[Job]:
+        """Следующая задача (уже в статусе running) или None, если очередь пуста"""
+        raise NotImplementedError
+
+    async def set_status(self, job: Job, status: JobStatus) -> None:
+        raise NotImplementedError
+
+    async def get_status(self, job_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+    async def heartbeat(self, job: Job) -> None:
+        """Воркер ещё выполняет задачу: продлить её аренду"""
+
+    def done(self, job: Job):
+        """Воркер закончил с задачей (успешно или нет)"""
+
+    async def join(self):
+        """Дождаться выполнения всех задач, поставленных этим процессом"""
+
+
+class MemoryJobQueue(JobQueue):
+    """asyncio-очередь в памяти процесса: задачи выполняют воркеры этого же процесса"""
+
+    def __init__(self, max_tracked: int = 10000):
+        self.max_tracked = max_tracked
+        self._queue = None
+        self._loop = None
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+
+    @property
+    def queue(self) -> asyncio.Queue:
+        # asyncio.Queue привязана к event loop — при смене loop очередь создаётся заново
+        loop = asyncio.get_running_loop()
+        if self._queue is None or self._loop is not loop:
+            self._queue = asyncio.Queue()
+            self._loop = loop
+        return self._queue
+
+    async def submit(self, job: Job) -> Job:
+        job.status = JobStatus.QUEUED.value
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.max_tracked:
+            self._jobs.popitem(last=False)
+
+        self.queue.put_nowait(job)
+        return job
+
+    async def submit_once(self, job: Job) -> bool:
+        # помним только задачи этого процесса (последние max_tracked)
+        if job.job_id in self._jobs:
+            return False
+        await self.submit(job)
+        return True
+
+    async def claim(self) -> Optional[Job]:
+        job = await self.queue.get()
+        job.status = JobStatus.RUNNING.value
+        job.attempts += 1
+        return job
+
+    async def set_status(self, job: Job, status: JobStatus) -> None:
+        job.status = status.value
+
+    async def get_status(self, job_id: str) -> Optional[str]:
+        job = self._jobs.get(job_id)
+        return job.status if job else None
+
+    def done(self, job: Job):
+        self.queue.task_done()
+
+    async def join(self):
+        await self.queue.join()
+
+
+class YDBJobQueue(JobQueue):
+    """Таблица jobs в YDB: задачи переживают рестарт, их берут процессы restore_worker.py на любых машинах"""
+
+    async def submit(self, job: Job) -> Job:
+        job.status = JobStatus.QUEUED.value
+        async with JobClient() as job_client:
+            await job_client.insert_job(job)
+        return job
+
+    async def submit_once(self, job: Job) -> bool:
+        job.status = JobStatus.QUEUED.value
+        async with JobClient() as job_client:
+            return await job_client.insert_job_once(job)
+
+    async def claim(self) -> Optional[Job]:
+        async with JobClient() as job_client:
+            return await job_client.claim_job()
+
+    async def set_status(self, job: Job, status: JobStatus) -> None:
+        job.status = status.value
+        async with JobClient() as job_client:
+            await job_client.update_job_status(job.job_id, status)
+
+    async def heartbeat(self, job: Job) -> None:
+        async with JobClient() as job_client:
+            await job_client.touch_job(job.job_id)
+
+    async def get_status(self, job_id: str) -> Optional[str]:
+        async with JobClient() as job_client:
+            job = await job_client.get_job_by_id(job_id)
+        return job.status if job else None
+
+
+def create_job_queue(backend: str = JOB_QUEUE_BACKEND) -> JobQueue:
+    """Очередь по имени бэкенда из конфига"""
+    if backend == "memory":
+        return MemoryJobQueue()
+    if backend == "ydb":
+        return YDBJobQueue()
+
+    raise ValueError(f"Неизвестный бэкенд очереди задач: {backend}")
+
+
+job_queue = create_job_queue()
@@ -26,7 +26,9 @@ TEXT = {
         'payment_accepted': "✅ Payment received!\n🪄 Restoring your photo... This won’t take long!"
     },
 
-    'photo_is_ready': "✨ Done! Your photo has been restored."
+    'photo_is_ready': "✨ Done! Your photo has been restored.",
+
+    'queue_position': "⏳ Lots of photos right now. Your place in the queue: {position}"
 }
 
 BUTTONS_TEXT = {
@@ -26,7 +26,9 @@ TEXT = {
         'payment_accepted': "✅ Төлем қабылданды!\n🪄 Сурет қалпына келтіріліп жатыр... Бұл көп уақыт алмайды!"
     },
 
-    'photo_is_ready': "✨ Дайын! Сурет қалпына келтірілді."
+    'photo_is_ready': "✨ Дайын! Сурет қалпына келтірілді.",
+
+    'queue_position': "⏳ Қазір суреттер көп. Кезектегі орныңыз: {position}"
 }
 
 BUTTONS_TEXT = {
@@ -18,7 +18,8 @@ TEXT = {'start': "👋 Привет! Я бот для реставрации ф
                     "description": "✨ Восстановите старую или повреждённую фотографию!\n"
                     "После оплаты я верну ей чёткость, цвет и жизнь",
                     "payment_accepted": "Платеж принят ✅\n🪄 Восстанавливаю фото, это не займет много времени..."},
-        "photo_is_ready": "✨ Готово! Фото восстановлено"
+        "photo_is_ready": "✨ Готово! Фото восстановлено",
+        "queue_position": "⏳ Сейчас много фото. Ваше место в очереди: {position}"
         }
 
 BUTTONS_TEXT = {'pay': "Оплатить ⭐ {amount}"}
\ No newline at end of file
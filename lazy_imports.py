@@ -0,0 +1,23 @@
+import importlib.util
+import sys
+
+
+# Тяжёлые SDK (openai, ydb, Pillow) не нужны для холодного старта функции и ping-апдейтов.
+# lazy_import отдаёт модуль-заглушку, который реально загружается при первом обращении к атрибуту.
+
+
+def lazy_import(name: str):
+    """Ленивый импорт модуля: загрузка откладывается до первого обращения к его атрибуту"""
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named '{name}'", name=name)
+
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
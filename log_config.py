@@ -0,0 +1,91 @@
+import asyncio
+import atexit
+import contextvars
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+from typing import Optional
+from config import LOG_LEVEL, LOG_BODY_SAMPLE_RATE, LOG_BODY_MAX_CHARS
+
+
+# Логирование без блокировки event loop: обработчики только кладут запись в очередь,
+# вывод в stdout делает отдельный поток (QueueListener).
+# В каждой строке — id запроса (update_id или id задачи), чтобы собрать путь одного апдейта по логам.
+
+
+request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_queue: Optional[queue.Queue] = None
+
+
+class RequestIdFilter(logging.Filter):
+    """Добавляет в запись id текущего запроса из contextvars"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id.get()
+        return True
+
+
+def set_request_id(value) -> contextvars.Token:
+    """id запроса для всех логов текущей задачи asyncio (и задач, созданных из неё)"""
+    return request_id.set(str(value))
+
+
+def setup_logging(level: str = LOG_LEVEL):
+    """Настройка корневого логгера (повторный вызов ничего не делает)"""
+    global _listener, _queue
+
+    if _listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s"))
+
+    # queue.Queue (а не SimpleQueue): QueueListener отмечает task_done, и flush_logging может дождаться вывода
+    _queue = queue.Queue()
+    queue_handler = logging.handlers.QueueHandler(_queue)
+    # фильтр на обработчике: id запроса берётся в потоке, который пишет лог, а не в потоке вывода
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописать всё из очереди и остановить поток вывода"""
+    global _listener
+
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+async def flush_logging():
+    """
+    Дождаться вывода всех записей. Облачная функция замораживается сразу после ответа —
+    без этого хвост логов вызова появился бы только при следующем вызове
+    """
+    if _listener is not None:
+        await asyncio.to_thread(_queue.join)
+
+
+def sample_payload(payload: str, rate: float = LOG_BODY_SAMPLE_RATE, max_chars: int = LOG_BODY_MAX_CHARS) -> Optional[str]:
+    """
+    Большие тела (апдейты целиком) логируем выборочно и обрезанными.
+    None — это тело в лог не попадает
+    """
+    if rate < 1 and random.random() >= rate:
+        return None
+    if len(payload) > max_chars:
+        return f"{payload[:max_chars]}... ({len(payload)} символов)"
+    return payload
@@ -1,5 +1,6 @@
 import asyncio
 import logging
+from typing import Optional
 from aiogram import Bot, Dispatcher, types, Router, F
 from aiogram.filters import CommandStart
 from aiogram.filters.command import Command
@@ -7,8 +8,16 @@ from aiogram.client.default import DefaultBotProperties
 from aiogram.enums import ParseMode
 from buttons import *
 from languages import get_texts
-from config import TELEGRAM_BOT_TOKEN, AMOUNT, ADMIN_ID
-from photo_restorer import PhotoRestorer
+from config import (TELEGRAM_BOT_TOKEN, AMOUNT, ADMIN_ID, INVOICE_SWEEP_INTERVAL, JOB_QUEUE_BACKEND, METRICS_HOST,
+                    METRICS_PORT, WEBHOOK_URL)
+from photo_restorer import close_model_client
+from cache_sweeper import run_invoice_sweeper
+from outbound import OutboundScheduler
+from albums import albums
+from metrics import start_metrics_server
+from log_config import setup_logging
+from jobs import job_queue, new_job_id, paid_job_id
+from restore_worker import start_restore_workers, stop_restore_workers
 from ydb_models import *
 from languages.desc import DESCRIPTIONS, SHORT_DESCRIPTIONS, NAMES
 
@@ -17,12 +26,14 @@ from languages.desc import DESCRIPTIONS, SHORT_DESCRIPTIONS, NAMES
 
 
 # Настройка логирования
-logging.basicConfig(level=logging.INFO)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 
 # Инициализация бота и диспетчера
 bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+# все исходящие вызовы — через планировщик с лимитами Telegram и склейкой удалений
+bot.session.middleware(OutboundScheduler())
 dp = Dispatcher()
 
 
@@ -38,6 +49,44 @@ dp.include_router(media_router)
 dp.include_router(cleanup_router)
 
 
+sweeper_task = None
+metrics_runner = None
+
+
+@dp.startup()
+async def on_startup():
+    global sweeper_task, metrics_runner
+
+    # прогрев общего пула сессий YDB до первого апдейта
+    await YDBClient.startup()
+
+    # фоновая уборка брошенных счетов
+    if INVOICE_SWEEP_INTERVAL > 0:
+        sweeper_task = asyncio.create_task(run_invoice_sweeper(bot, INVOICE_SWEEP_INTERVAL))
+
+    # очередь в памяти обслуживают воркеры этого же процесса, очередь в YDB — отдельные процессы
+    if JOB_QUEUE_BACKEND == "memory":
+        start_restore_workers(bot)
+
+    # /metrics для сборщика метрик (в режиме webhook /metrics отдаёт сам сервер webhook)
+    if METRICS_PORT > 0 and not WEBHOOK_URL:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+
+
+@dp.shutdown()
+async def on_shutdown():
+    if sweeper_task is not None:
+        sweeper_task.cancel()
+
+    await stop_restore_workers()
+
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+    await close_model_client()
+    await YDBClient.shutdown()
+
+
 # установка описания
 @commands_router.message(Command("set_description"))
 async def cmd_set_description(message: types.Message):
@@ -48,27 +97,27 @@ async def cmd_set_description(message: types.Message):
             try:
                 await bot.set_my_description(description=text, language_code=lang)
             except Exception as e:
-                print(f"Ошбика установки описания для языка {lang} - {e}")
+                logger.error("Ошбика установки описания для языка %s - %s", lang, e)
             else:
-                print("Описание для бота установлено ✅")
+                logger.info("Описание для бота установлено ✅")
 
         # установка короткого описания для бота на разных языках
         for lang, text in SHORT_DESCRIPTIONS.items():
             try:
                 await bot.set_my_short_description(short_description=text, language_code=lang)
             except Exception as e:
-                print(f"Ошбика установки короткого описания для языка {lang} - {e}")
+                logger.error("Ошбика установки короткого описания для языка %s - %s", lang, e)
             else:
-                print("Короткое описание для бота установлено ✅")
+                logger.info("Короткое описание для бота установлено ✅")
 
         # установка имени бота на разных языках
         for lang, name in NAMES.items():
             try:
                 await bot.set_my_name(name=name, language_code=lang)
             except Exception as e:
-                print(f"Ошбика установки имени для языка {lang} - {e}")
+                logger.error("Ошбика установки имени для языка %s - %s", lang, e)
             else:
-                print("Название бота установлено ✅")
+                logger.info("Название бота установлено ✅")
 
 
 # ------------------------------------------------------------------------ ЛОГИКА --------------------------------------------------------
@@ -90,79 +139,169 @@ async def cmd_start(message: types.Message):
     await message.answer(texts["TEXT"]["start"])
 
 
+def get_image(message: types.Message) -> Optional[tuple[str, str, str]]:
+    """(file_id, file_unique_id, file_type) вложения или None, если это не изображение"""
+    if message.photo:
+        return message.photo[-1].file_id, message.photo[-1].file_unique_id, "image"
+    if message.document and message.document.mime_type in {"image/jpeg", "image/png"}:
+        return message.document.file_id, message.document.file_unique_id, "file_image"
+    return None
+
+
+async def start_free_restoration(message: types.Message, texts: dict, file_id: str, file_type: str, file_unique_id: str):
+    """Бесплатная генерация (уже списана take_free_generate, при ошибке воркер её вернёт): постановка задачи"""
+    user_id = message.from_user.id
+    try:
+        notif_mess = await message.answer(texts["TEXT"]["photo_accepted"])
+
+        # реставрацию выполняет воркер, обработчик апдейта сразу освобождается
+        await job_queue.submit(Job(new_job_id(), user_id, message.message_id, file_id, file_type, file_unique_id,
+                                   message.caption, message.from_user.language_code, notif_mess.message_id))
+    except Exception:
+        # задача не поставлена — возвращаем генерацию, иначе повторная доставка апдейта выставит счёт
+        async with UserClient() as user_client:
+            await user_client.update_field_free_generate(user_id, True)
+        raise
+
+
+async def send_invoice(message: types.Message, texts: dict, file_id: str, file_type: str, file_unique_id: str):
+    """Счёт на реставрацию одного фото"""
+    user_id = message.from_user.id
+    message_id = message.message_id
+
+    label = texts["TEXT"]["payment"]["label"]
+    title = texts["TEXT"]["payment"]["title"]
+    description = texts["TEXT"]["payment"]["description"]
+
+    prices = [types.LabeledPrice(label=label, amount=AMOUNT)]
+
+    pay_message = await message.answer_invoice(
+        title=title,
+        description=description,
+        payload=f"payment|{AMOUNT}|{message_id}|{file_type}|{file_unique_id}",
+        provider_token="",
+        currency="XTR",
+        prices=prices,
+        reply_markup=payment_button(texts["BUTTONS_TEXT"]["pay"].format(amount=AMOUNT)),
+        reply_to_message_id=message_id
+    )
+
+    # сохраняем в Кэш "ссылку" на фото
+    async with CacheClient() as cache_client:
+        new_cache = Cache(user_id, message_id, file_id, pay_message.message_id)
+        await cache_client.insert_cache(new_cache)
+
+
+async def send_album_invoice(items: list[tuple[types.Message, str, str, str]], texts: dict):
+    """Один счёт на все фото альбома: items — (сообщение, file_id, file_unique_id, file_type)"""
+    first = items[0][0]
+    user_id = first.from_user.id
+    file_type = items[0][3]
+    amount = AMOUNT * len(items)
+
+    label = texts["TEXT"]["payment"]["label"]
+    title = texts["TEXT"]["payment"]["title"]
+    description = texts["TEXT"]["payment"]["description"]
+
+    prices = [types.LabeledPrice(label=label, amount=amount)]
+
+    pay_message = await first.answer_invoice(
+        title=title,
+        description=description,
+        payload=make_album_payload(amount, file_type, [message.message_id for message, *_ in items]),
+        provider_token="",
+        currency="XTR",
+        prices=prices,
+        reply_markup=payment_button(texts["BUTTONS_TEXT"]["pay"].format(amount=amount)),
+        reply_to_message_id=first.message_id
+    )
+
+    # "ссылки" на все фото альбома — одним запросом, со ссылкой на общий счёт
+    async with CacheClient() as cache_client:
+        await cache_client.insert_cache_batch([
+            Cache(user_id, message.message_id, file_id, pay_message.message_id) for message, file_id, *_ in items
+        ])
+
+
 @media_router.message(F.photo | F.document)
 async def handle_photo_or_document(message: types.Message):
     user_id = message.from_user.id
     user_lang = message.from_user.language_code
-    message_id = message.message_id
     texts = await get_texts(user_lang)
-    caption = message.caption
 
     # Определяем тип вложения
-    if message.photo:
-        file_id = message.photo[-1].file_id
-        file_type = "image"
-    elif message.document and message.document.mime_type in {"image/jpeg", "image/png"}:
-        file_id = message.document.file_id
-        file_type = "file_image"
-    else:
+    image = get_image(message)
+    if image is None:
         await message.answer(texts["TEXT"]["error_not_image"])
         return
 
-    # Получаем данные пользователя
+    # фото альбома собираем вместе: один счёт, одна задача и один ответ на весь альбом
+    if message.media_group_id:
+        albums.add(message, handle_album)
+        return
+
+    file_id, file_unique_id, file_type = image
+
+    # Бесплатная или возвращённая за неудачу (credits) генерация: списывается в базе условным UPDATE —
+    # кэш процесса мог устареть
     async with UserClient() as user_client:
-        user = await user_client.get_user_by_id(user_id)
+        free = await user_client.take_free_generate(user_id)
 
-    # Бесплатная генерация
-    if user.free_generate:
-        notif_mess = await message.answer(texts["TEXT"]["photo_accepted"])
+    if free:
+        await start_free_restoration(message, texts, file_id, file_type, file_unique_id)
+    else:
+        await send_invoice(message, texts, file_id, file_type, file_unique_id)
 
-        # получение и обработка фотографии
-        file_info = await bot.get_file(file_id)
-        file_path = file_info.file_path
 
-        photo_restorer = PhotoRestorer()
-        photo_file = await photo_restorer.restore(bot, file_path, caption)
+async def handle_album(messages: list[types.Message]):
+    """Все фото одного альбома (по возрастанию message_id)"""
+    first = messages[0]
+    user_id = first.from_user.id
+    texts = await get_texts(first.from_user.language_code)
 
-        if photo_file is None:
-            await message.answer(texts["TEXT"]["generation_error"])
-        else:
-            if file_type == "image":
-                await message.answer_photo(photo=photo_file, caption=texts["TEXT"]["photo_is_ready"], reply_to_message_id=message_id)
-            else:
-                await message.answer_document(document=photo_file, reply_to_message_id=message_id)
+    items = [(message, *get_image(message)) for message in messages]
 
-            # Блокируем дальнейшие бесплатные генерации
-            async with UserClient() as user_client:
-                await user_client.update_field_free_generate(user_id, False)
+    async with UserClient() as user_client:
+        free = await user_client.take_free_generate(user_id)
 
-        await bot.delete_message(user_id, notif_mess.message_id)
+    # бесплатная генерация — это одно фото: первое фото альбома, за остальные — общий счёт
+    if free:
+        message, file_id, file_unique_id, file_type = items.pop(0)
+        await start_free_restoration(message, texts, file_id, file_type, file_unique_id)
 
-    else:
-        label = texts["TEXT"]["payment"]["label"]
-        title = texts["TEXT"]["payment"]["title"]
-        description = texts["TEXT"]["payment"]["description"]
+    if len(items) == 1:
+        message, file_id, file_unique_id, file_type = items[0]
+        await send_invoice(message, texts, file_id, file_type, file_unique_id)
+    elif items:
+        await send_album_invoice(items, texts)
 
-        prices = [types.LabeledPrice(label=label, amount=AMOUNT)]
 
-        pay_message = await message.answer_invoice(
-            title=title,
-            description=description,
-            payload=f"payment|{AMOUNT}|{message_id}|{file_type}",
-            provider_token="",
-            currency="XTR",
-            prices=prices,
-            reply_markup=payment_button(texts["BUTTONS_TEXT"]["pay"].format(amount=AMOUNT)),
-            reply_to_message_id=message_id
-        )
+# ------------------------------------------------------------------- ОПЛАТА -------------------------------------------------------
 
-        # сохраняем в Кэш "ссылку" на фото
-        async with CacheClient() as cache_client:
-            new_cache = Cache(user_id, message_id, file_id, pay_message.message_id)
-            await cache_client.insert_cache(new_cache)
 
+def parse_invoice_payload(payload: str) -> tuple[int, int, str, Optional[str]]:
+    """payment|amount|message_id|file_type[|file_unique_id] -> (amount, message_id, file_type, file_unique_id)"""
+    _, amount, message_id_str, file_type, *rest = payload.split("|")
+    file_unique_id = rest[0] if rest else None # в старых счетах file_unique_id нет
+    return int(amount), int(message_id_str), file_type, file_unique_id
 
-# ------------------------------------------------------------------- ОПЛАТА -------------------------------------------------------
+
+def make_album_payload(amount: int, file_type: str, message_ids: list[int]) -> str:
+    """
+    album|amount|file_type|первый message_id|приращения через запятую.
+    id фото альбома идут подряд — приращения короткие, payload укладывается в 128 байт
+    """
+    deltas = ",".join(str(b - a) for a, b in zip(message_ids, message_ids[1:]))
+    return f"album|{amount}|{file_type}|{message_ids[0]}|{deltas}"
+
+
+def parse_album_payload(payload: str) -> tuple[int, str, list[int]]:
+    """album|... -> (amount, file_type, message_ids)"""
+    _, amount, file_type, first_id, deltas = payload.split("|")
+    message_ids = [int(first_id)]
+    for delta in filter(None, deltas.split(",")):
+        message_ids.append(message_ids[-1] + int(delta))
+    return int(amount), file_type, message_ids
 
 
 @payment_router.pre_checkout_query()
@@ -173,68 +312,93 @@ async def pre_checkout(pre_checkout_query: types.PreCheckoutQuery):
 @payment_router.message(F.successful_payment)
 async def on_successful_payment(message: types.Message):
     payload = message.successful_payment.invoice_payload
+    if payload.startswith("album|"):
+        await on_album_payment(message, payload)
+        return
+
     user_id = message.from_user.id
     user_lang = message.from_user.language_code
     caption = message.caption
 
     texts = await get_texts(user_lang) # получение текста на языке пользователя
     
-    _, amount, message_id_str, file_type = payload.split("|") # получение данных
+    amount, photo_message_id, file_type, file_unique_id = parse_invoice_payload(payload) # получение данных
 
-    # добавление платежа в бд
+    # проведение платежа: запись в payments и чтение записи из кэша — одной транзакцией
     async with PaymentClient() as payment_client:
-        new_payment = Payment(user_id, int(message_id_str), int(amount), PaymentType.RESTORATION.value)
-        await payment_client.insert_payment(new_payment)
+        new_payment = Payment(user_id, photo_message_id, amount, PaymentType.RESTORATION.value)
+        settlement = await payment_client.settle_payment(new_payment)
 
-    # получаем кэш
-    async with CacheClient() as cache_client:
-        cache = await cache_client.get_cache_by_telegram_id(user_id)
-    
-    cache = cache.get(int(message_id_str))
-    file_id = cache.get("photo")
-    pay_message_id = cache.get("pay_message_id")
+    # повторная доставка платежа: записи в кэше нет — задача уже поставлена.
+    # Если есть — первая доставка упала до постановки задачи, ставим её сейчас
+    if settlement.already_settled and settlement.file_id is None:
+        logger.info("Платёж %s/%s уже проведён, задача поставлена, пропускаем", user_id, photo_message_id)
+        return
+
+    file_id = settlement.file_id
+    pay_message_id = settlement.pay_message_id
 
     # сообщение о приеме платежа
     notif_mess = await message.answer(texts["TEXT"]["payment"]["payment_accepted"])
 
     # удаление сообщения об оплате
     try:
-        await bot.delete_message(user_id, pay_message_id)
+        if pay_message_id is not None:
+            await bot.delete_message(user_id, pay_message_id)
     except Exception as e:
-        print("Ошибка удаления сообщений:", e)
-
-    # получение и обработка фотографии
-    file_info = await bot.get_file(file_id)
-    file_path = file_info.file_path
-    
-    photo_restorer = PhotoRestorer()
+        logger.error("Ошибка удаления сообщений: %s", e)
+
+    # реставрацию выполняет воркер, обработчик апдейта сразу освобождается;
+    # id задачи — от платежа: гонка двух доставок не поставит её дважды
+    submitted = await job_queue.submit_once(Job(paid_job_id(user_id, photo_message_id), user_id, photo_message_id,
+                                                file_id, file_type, file_unique_id, caption, user_lang,
+                                                notif_mess.message_id, paid=True,
+                                                charge_id=message.successful_payment.telegram_payment_charge_id))
+    if not submitted:
+        await bot.delete_message(user_id, notif_mess.message_id)
 
-    try:
-        photo_file = await photo_restorer.restore(bot, file_path, caption)
-    except Exception as e:
-        print("Ошибка при обработке изображения Nano Banano:", e)
-        photo_file = None
-    
-    if photo_file is None:
-        await message.answer(texts["TEXT"]["generation_error"])
-        
-        # +1 генерация
-        async with UserClient() as user_client:
-            await user_client.update_field_free_generate(user_id, True)
-    else:
-        if file_type == "image":
-            await message.answer_photo(photo=photo_file, caption=texts["TEXT"]["photo_is_ready"], reply_to_message_id=int(message_id_str))
-        else:
-            await message.answer_document(document=photo_file, reply_to_message_id=int(message_id_str))
-    
-    # подчищаем мусор
+    # задача поставлена — запись кэша больше не нужна
     async with CacheClient() as cache_client:
-        await cache_client.delete_cache_by_telegram_id_and_photo_message_id(user_id, int(message_id_str))
+        await cache_client.delete_cache_by_telegram_id_and_photo_message_id(user_id, photo_message_id)
+
+
+async def on_album_payment(message: types.Message, payload: str):
+    """Оплата альбома: одна задача на все оплаченные фото"""
+    user_id = message.from_user.id
+    user_lang = message.from_user.language_code
+    texts = await get_texts(user_lang)
+
+    amount, file_type, message_ids = parse_album_payload(payload)
+
+    # платёж записывается на первое фото альбома, записи cache всех фото читаются той же транзакцией
+    async with PaymentClient() as payment_client:
+        new_payment = Payment(user_id, message_ids[0], amount, PaymentType.RESTORATION.value)
+        settlement = await payment_client.settle_album_payment(new_payment, message_ids)
+
+    # как и для одного фото: записей кэша нет — задача уже поставлена
+    if settlement.already_settled and not settlement.album_file_ids:
+        logger.info("Платёж %s/%s уже проведён, задача поставлена, пропускаем", user_id, message_ids[0])
+        return
+
+    notif_mess = await message.answer(texts["TEXT"]["payment"]["payment_accepted"])
 
     try:
-        await bot.delete_message(user_id, notif_mess.message_id)
+        if settlement.pay_message_id is not None:
+            await bot.delete_message(user_id, settlement.pay_message_id)
     except Exception as e:
-        print("Ошибка удаления сообщений:", e)
+        logger.error("Ошибка удаления сообщений: %s", e)
+
+    album = [{"message_id": message_id, "file_id": settlement.album_file_ids.get(message_id), "file_unique_id": None}
+             for message_id in message_ids]
+    submitted = await job_queue.submit_once(Job(paid_job_id(user_id, message_ids[0]), user_id, message_ids[0], None,
+                                                file_type, None, None, user_lang, notif_mess.message_id,
+                                                paid=True, album=album,
+                                                charge_id=message.successful_payment.telegram_payment_charge_id))
+    if not submitted:
+        await bot.delete_message(user_id, notif_mess.message_id)
+
+    async with CacheClient() as cache_client:
+        await cache_client.delete_cache_batch([Cache(user_id, message_id) for message_id in message_ids])
 
 
 # ------------------------------------------------------------------------ ДРУГИЕ ФОРМАТЫ --------------------------------------------------------
@@ -245,17 +409,21 @@ async def delete_unwanted(message: types.Message):
     try:
         await message.delete()
     except Exception as e:
-        print(f"⚠️ Не удалось удалить сообщение: {e}")
+        logger.warning("⚠️ Не удалось удалить сообщение: %s", e)
 
 
 # ------------------------------------------------------------------------ ЗАПУСК --------------------------------------------------------
 
 
 async def main():
-    print("Бот запущен...")
+    logger.info("Бот запущен...")
     await dp.start_polling(bot)
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    if WEBHOOK_URL:
+        from webhook_server import run_webhook
+        run_webhook(dp, bot)
+    else:
+        asyncio.run(main())
 
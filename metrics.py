@@ -0,0 +1,203 @@
+import bisect
+import json
+import logging
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+
+# Метрики процесса: счётчики и гистограммы времени по этапам.
+#   - в режиме polling отдаются в формате OpenMetrics (METRICS_PORT, /metrics);
+#   - в облачной функции сбрасываются одной структурированной строкой лога в конце вызова.
+# Без внешних зависимостей: гистограмма — фиксированные корзины, как в Prometheus.
+
+
+# корзины в секундах: от быстрых запросов YDB до долгих генераций
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key: tuple, extra: Optional[tuple] = None) -> str:
+    items = list(key) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in items)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = _labels_key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def reset(self):
+        self.values = {}
+
+    def render(self) -> list[str]:
+        lines = [f"# TYPE {self.name} counter", f"# HELP {self.name} {self.documentation}"]
+        for key, value in self.values.items():
+            lines.append(f"{self.name}_total{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+    def snapshot(self) -> dict:
+        return {_format_labels(key) or "total": value for key, value in self.values.items()}
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (последняя — +Inf), сумма, количество]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = _labels_key(labels)
+        item = self.values.get(key)
+        if item is None:
+            item = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        item[0][bisect.bisect_left(self.buckets, value)] += 1
+        item[1] += value
+        item[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замер блока кода (работает и вокруг await)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def reset(self):
+        self.values = {}
+
+    def render(self) -> list[str]:
+        lines = [f"# TYPE {self.name} histogram", f"# HELP {self.name} {self.documentation}"]
+        for key, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += bucket_count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', le))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+    def quantile(self, key: tuple, q: float) -> Optional[float]:
+        """Оценка квантиля по корзинам: верхняя граница корзины, в которую он попал"""
+        counts, _, count = self.values[key]
+        rank = q * count
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            if cumulative >= rank:
+                return bound
+        return None  # дольше последней корзины
+
+    def snapshot(self) -> dict:
+        return {
+            _format_labels(key) or "total": {
+                "count": count,
+                "sum": round(total, 6),
+                "p50": self.quantile(key, 0.5),
+                "p95": self.quantile(key, 0.95),
+            }
+            for key, (_, total, count) in self.values.items()
+        }
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Counter | Histogram] = {}
+
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, documentation))
+
+    def histogram(self, name: str, documentation: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, documentation, buckets))
+
+    def render(self) -> str:
+        """Все метрики в текстовом формате OpenMetrics"""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        return {name: metric.snapshot() for name, metric in self.metrics.items() if metric.values}
+
+    def reset(self):
+        for metric in self.metrics.values():
+            metric.reset()
+
+
+registry = Registry()
+
+STAGE_SECONDS = registry.histogram("restore_stage_seconds", "Время этапа реставрации (get_file, download, encode, model, ...)")
+YDB_QUERY_SECONDS = registry.histogram("ydb_query_seconds", "Время запроса YDB по имени метода клиента")
+CACHE_REQUESTS = registry.counter("cache_requests", "Обращения к кэшам (result, file_id) с результатом hit/miss")
+ERRORS = registry.counter("errors", "Ошибки по этапам")
+GENERATIONS = registry.counter("generations", "Генерации: free/paid и чем закончились")
+REFUNDS = registry.counter("refunds", "Возвраты за невосстановленные фото: stars, credits, free")
+DUPLICATE_UPDATES = registry.counter("duplicate_updates", "Отброшенные повторы апдейтов: где распознан повтор (filter/ydb)")
+
+
+@contextmanager
+def stage(name: str):
+    """Замер этапа реставрации; исключение считается ошибкой этапа и пробрасывается дальше"""
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.inc(stage=name)
+        raise
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - start, stage=name)
+
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+
+async def handle_metrics(request):
+    """aiohttp-обработчик /metrics"""
+    from aiohttp import web
+    return web.Response(body=registry.render().encode(), headers={"Content-Type": OPENMETRICS_CONTENT_TYPE})
+
+
+async def start_metrics_server(host: str, port: int):
+    """HTTP-сервер с /metrics для режима polling. Возвращает runner, чтобы его остановить"""
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logging.info("📈 Метрики доступны на http://%s:%s/metrics", host, port)
+    return runner
+
+
+def flush_metrics(logger: logging.Logger = logging.getLogger(__name__)):
+    """
+    Сброс накопленного одной JSON-строкой в лог (для облачной функции) и обнуление:
+    каждая строка — приращение за один вызов, суммировать их можно уже в системе логов
+    """
+    snapshot = registry.snapshot()
+    if snapshot and logger.isEnabledFor(logging.INFO):
+        logger.info(json.dumps({"event": "metrics", "metrics": snapshot}, ensure_ascii=False))
+    registry.reset()
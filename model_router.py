@@ -0,0 +1,223 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import AsyncContextManager, Awaitable, Callable, Optional, TypeVar
+from config import (MODEL_PRIMARY, MODEL_FALLBACKS, MODEL_HEDGE_PERCENTILE, MODEL_HEDGE_MIN_SAMPLES,
+                    MODEL_HEDGE_MAX_RATIO, MODEL_BREAKER_FAILURES, MODEL_BREAKER_COOLDOWN)
+
+
+# Выбор модели для генерации:
+#   - по каждой модели копим задержки и ошибки;
+#   - после MODEL_BREAKER_FAILURES ошибок подряд модель выключается (circuit breaker)
+#     на MODEL_BREAKER_COOLDOWN секунд, потом пробуется одним запросом;
+#   - если основная модель думает дольше своего MODEL_HEDGE_PERCENTILE-го перцентиля,
+#     параллельно отправляется запрос в запасную, берётся первый ответ (hedged request);
+#   - хеджей не больше MODEL_HEDGE_MAX_RATIO от числа запросов, чтобы не платить дважды за каждую генерацию;
+#   - хедж — отдельный вызов модели: он занимает своё место в admission (hedge_slot), а не место основного;
+#   - ошибка модели — сразу пробуем следующую (это не двойная трата: первая попытка ничего не вернула);
+#   - ответ без результата (отказ, только текст — NoResultError) — не сбой модели: breaker его не считает
+#     и на запасную не переключаемся, ведь такой ответ уже оплачен, а фото, скорее всего, откажут и там.
+
+
+T = TypeVar("T")
+
+_WINDOW = 200  # задержек по модели храним для перцентиля
+
+
+class NoResultError(Exception):
+    """Модель ответила, но без результата: отказ или только текст. Это не сбой модели"""
+
+
+class CircuitBreaker:
+    """closed → open после failures ошибок подряд → half-open через cooldown секунд (один пробный запрос)"""
+
+    def __init__(self, failures: int = MODEL_BREAKER_FAILURES, cooldown: float = MODEL_BREAKER_COOLDOWN):
+        self.failures = failures
+        self.cooldown = cooldown
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.cooldown:
+            return "open"
+        return "half-open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "half-open":
+            # пропускаем один пробный запрос, остальные ждут его результата ещё cooldown
+            self.opened_at = time.monotonic()
+            return True
+        return state == "closed"
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.opened_at is not None or self.consecutive_failures >= self.failures:
+            self.opened_at = time.monotonic()
+
+
+class ModelStats:
+    """Задержки успешных ответов и счётчики по одной модели"""
+
+    def __init__(self):
+        self.latencies = deque(maxlen=_WINDOW)
+        self.requests = 0
+        self.errors = 0
+        self.no_results = 0
+        self.wins = 0
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+class ModelRouter:
+    def __init__(self, models: Optional[list[str]] = None, hedge_percentile: float = MODEL_HEDGE_PERCENTILE,
+                 hedge_min_samples: int = MODEL_HEDGE_MIN_SAMPLES, hedge_max_ratio: float = MODEL_HEDGE_MAX_RATIO):
+        self.models = models or [MODEL_PRIMARY, *MODEL_FALLBACKS]
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_ratio = hedge_max_ratio
+
+        self.breakers = {model: CircuitBreaker() for model in self.models}
+        self.model_stats = {model: ModelStats() for model in self.models}
+        self.requests = 0
+        self.hedges = 0
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Через сколько секунд хеджировать запрос к model. None — хеджировать нельзя"""
+        stats = self.model_stats[model]
+        if len(stats.latencies) < self.hedge_min_samples:
+            return None
+        # бюджет на хеджи: доля от всех запросов
+        if self.hedges + 1 > self.requests * self.hedge_max_ratio:
+            return None
+        return stats.percentile(self.hedge_percentile)
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "models": {
+                model: {
+                    "state": self.breakers[model].state,
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "no_results": stats.no_results,
+                    "wins": stats.wins,
+                    "p50": stats.percentile(50),
+                    "p95": stats.percentile(95),
+                    "p99": stats.percentile(99),
+                }
+                for model, stats in self.model_stats.items()
+            },
+        }
+
+    async def _attempt(self, model: str, call: Callable[[str], Awaitable[T]]) -> tuple[T, str]:
+        stats = self.model_stats[model]
+        stats.requests += 1
+        started = time.monotonic()
+        try:
+            result = await call(model)
+        except asyncio.CancelledError:
+            # проигравший хедж — не ошибка модели
+            raise
+        except NoResultError as e:
+            stats.no_results += 1
+            logging.warning("⚠️ Модель %s ответила без результата: %s", model, e)
+            raise
+        except Exception as e:
+            stats.errors += 1
+            self.breakers[model].record_failure()
+            logging.warning("⚠️ Модель %s ответила ошибкой: %s", model, e)
+            raise
+
+        stats.latencies.append(time.monotonic() - started)
+        self.breakers[model].record_success()
+        return result, model
+
+    async def _hedge(self, model: str, call: Callable[[str], Awaitable[T]],
+                     hedge_slot: Optional[Callable[[], AsyncContextManager]]) -> tuple[T, str]:
+        if hedge_slot is None:
+            return await self._attempt(model, call)
+        async with hedge_slot():
+            return await self._attempt(model, call)
+
+    def _next_model(self, reserve: list[str]) -> Optional[str]:
+        """
+        Следующая модель, которую пропускает её breaker. allow() спрашиваем только у той,
+        к которой действительно идём: у half-open он забирает единственный пробный запрос
+        """
+        while reserve:
+            model = reserve.pop(0)
+            if self.breakers[model].allow():
+                return model
+        return None
+
+    async def run(self, call: Callable[[str], Awaitable[T]],
+                  hedge_slot: Optional[Callable[[], AsyncContextManager]] = None) -> tuple[T, str]:
+        """
+        Выполняет call(model) на лучшей доступной модели, с хеджем и переключением на запасную.
+        hedge_slot() — допуск для хеджа (основная попытка и переключение идут в месте вызывающего).
+        Возвращает (результат, модель, которая его дала)
+        """
+        self.requests += 1
+
+        reserve = list(self.models)
+        # выключены все — всё равно пробуем основную, иначе пользователь гарантированно получит ошибку
+        primary = self._next_model(reserve) or self.models[0]
+        hedge_delay = self.hedge_delay(primary) if reserve else None
+        hedge_at = time.monotonic() + hedge_delay if hedge_delay is not None else None
+
+        running = {asyncio.create_task(self._attempt(primary, call))}
+        last_error = None
+        refused = False
+
+        try:
+            while running:
+                timeout = max(0.0, hedge_at - time.monotonic()) if hedge_at is not None and reserve else None
+                done, running = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                # основная модель медленнее обычного — хеджируем запасной
+                if not done:
+                    hedge_at = None
+                    model = self._next_model(reserve)
+                    if model is not None:
+                        self.hedges += 1
+                        logging.info("🔀 Хедж: %s дольше %.1f сек., параллельно запрашиваем %s",
+                                     primary, hedge_delay, model)
+                        running.add(asyncio.create_task(self._hedge(model, call, hedge_slot)))
+                    continue
+
+                for task in done:
+                    if task.exception() is None:
+                        result, model = task.result()
+                        self.model_stats[model].wins += 1
+                        return result, model
+                    last_error = task.exception()
+                    refused = refused or isinstance(last_error, NoResultError)
+
+                # все запущенные попытки упали — переключаемся на следующую модель (но не после отказа)
+                if not running and not refused:
+                    hedge_at = None
+                    model = self._next_model(reserve)
+                    if model is not None:
+                        running.add(asyncio.create_task(self._attempt(model, call)))
+        finally:
+            for task in running:
+                task.cancel()
+
+        raise last_error
+
+
+model_router = ModelRouter()
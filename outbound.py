@@ -0,0 +1,138 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import DeleteMessage, DeleteMessages, TelegramMethod
+from admission import TokenBucket
+from config import (TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST,
+                    TELEGRAM_MAX_RETRIES, TELEGRAM_DELETE_WINDOW)
+
+
+# Планировщик исходящих вызовов Bot API. Подключается middleware к сессии бота, поэтому
+# через него проходят все вызовы: message.answer, bot.delete_message, message.delete() и т.д.
+#   - глобальный лимит и лимит на чат (token bucket) — чтобы не ловить flood-бан;
+#   - на 429 ждём retry_after из ответа Telegram и повторяем, пока чат (или бот) на паузе — ждут все;
+#   - одиночные deleteMessage в один чат за TELEGRAM_DELETE_WINDOW склеиваются в один deleteMessages.
+
+
+_MAX_CHATS = 10000  # лимитов по чатам храним не больше, давно молчавшие чаты вытесняются
+_DELETE_BATCH = 100  # предел deleteMessages
+
+
+class OutboundScheduler(BaseRequestMiddleware):
+    def __init__(self, global_rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 chat_burst: float = TELEGRAM_CHAT_BURST, max_retries: int = TELEGRAM_MAX_RETRIES,
+                 delete_window: float = TELEGRAM_DELETE_WINDOW):
+        self.global_bucket = TokenBucket(global_rate, max(global_rate, 1))
+        self.chat_rate = chat_rate
+        self.chat_burst = max(chat_burst, 1)
+        self.max_retries = max_retries
+        self.delete_window = delete_window
+
+        self._chat_buckets: OrderedDict[Any, TokenBucket] = OrderedDict()
+        self._paused_until: dict[Any, float] = {}  # чат (None — весь бот) -> loop.time() конца паузы
+        self._pending_deletes: dict[tuple, list[tuple[int, asyncio.Future]]] = {}
+        self._flush_tasks: set[asyncio.Task] = set()
+
+    # --------------------------------------------------------- ЛИМИТЫ ---------------------------------------------------------
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._chat_buckets) > _MAX_CHATS:
+                self._chat_buckets.popitem(last=False)
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _wait_paused(self, chat_id):
+        loop = asyncio.get_running_loop()
+        for key in (None, chat_id):
+            delay = self._paused_until.get(key, 0) - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    @staticmethod
+    async def _take(bucket: TokenBucket):
+        while (wait := bucket.try_take()) > 0:
+            await asyncio.sleep(wait)
+
+    async def _acquire(self, chat_id):
+        await self._wait_paused(chat_id)
+        if chat_id is not None:
+            await self._take(self._chat_bucket(chat_id))
+        await self._take(self.global_bucket)
+
+    def _pause(self, chat_id, seconds: int):
+        loop = asyncio.get_running_loop()
+        self._paused_until[chat_id] = max(self._paused_until.get(chat_id, 0), loop.time() + seconds)
+
+    async def _send(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        """Вызов с учётом лимитов и повторами по retry_after"""
+        chat_id = getattr(method, "chat_id", None)
+
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                logging.warning("⏳ Flood control на %s (чат %s): ждём %s сек.", method.__api_method__, chat_id, e.retry_after)
+                self._pause(chat_id, e.retry_after)
+
+    # --------------------------------------------------------- УДАЛЕНИЯ ---------------------------------------------------------
+
+    async def _delete(self, make_request: NextRequestMiddlewareType, bot: Bot, method: DeleteMessage):
+        key = (bot.id, method.chat_id)
+        future = asyncio.get_running_loop().create_future()
+
+        pending = self._pending_deletes.setdefault(key, [])
+        pending.append((method.message_id, future))
+
+        if len(pending) == 1:
+            asyncio.get_running_loop().call_later(self.delete_window, self._schedule_flush, make_request, bot, key)
+        elif len(pending) >= _DELETE_BATCH:
+            self._schedule_flush(make_request, bot, key)
+
+        return await future
+
+    def _schedule_flush(self, make_request: NextRequestMiddlewareType, bot: Bot, key: tuple):
+        task = asyncio.create_task(self._flush_deletes(make_request, bot, key))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_deletes(self, make_request: NextRequestMiddlewareType, bot: Bot, key: tuple):
+        pending = self._pending_deletes.pop(key, None)
+        if not pending:
+            return
+
+        chat_id = key[1]
+        message_ids = [message_id for message_id, _ in pending]
+
+        try:
+            # одно сообщение — обычный deleteMessage, чтобы ошибки были те же, что без планировщика
+            if len(message_ids) == 1:
+                method = DeleteMessage(chat_id=chat_id, message_id=message_ids[0])
+            else:
+                method = DeleteMessages(chat_id=chat_id, message_ids=message_ids)
+            result = await self._send(make_request, bot, method)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for _, future in pending:
+                if not future.done():
+                    future.set_result(result)
+
+    # --------------------------------------------------------- MIDDLEWARE ---------------------------------------------------------
+
+    async def __call__(self, make_request: NextRequestMiddlewareType, bot: Bot, method: TelegramMethod):
+        if isinstance(method, DeleteMessage) and self.delete_window > 0:
+            return await self._delete(make_request, bot, method)
+        return await self._send(make_request, bot, method)
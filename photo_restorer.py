@@ -1,77 +1,243 @@
+import asyncio
 import base64
-from openai import OpenAI
+import binascii
+import io
+import json
 from aiogram.types import BufferedInputFile
-from config import OPENROUTER_API_KEY
+from typing import Awaitable, Callable, Optional
+from config import (OPENROUTER_API_KEY, OPENROUTER_TIMEOUT, OPENROUTER_CONNECT_TIMEOUT, OPENROUTER_MAX_CONNECTIONS,
+                    MODEL_PRIMARY)
 from aiogram import Bot
+from admission import admission
+from model_router import model_router, NoResultError
+from metrics import stage
+from result_cache import result_cache, make_key, image_hash
+from image_preprocess import preprocess_image
+from lazy_imports import lazy_import
 import logging
 
 
+# SDK модели загружается при первой генерации, а не при старте функции
+httpx = lazy_import("httpx")
+openai = lazy_import("openai")
+
+
 # 21.5 тг себестоимость 1 фото
 # лимит 5$ - 3000 тг
 
 
+_IMAGE_PLACEHOLDER = "__IMAGE__"
+_B64_CHUNK = 3 * 64 * 1024  # кратно 3 — куски base64 склеиваются без паддинга посередине
+
+
+def build_request_body(model: str, prompt: str, image: memoryview | bytes, mime_type: str = "image/png") -> bytes:
+    """
+    Собирает JSON-тело запроса chat.completions сразу в байтах,
+    минуя str, f-string data URL и повторную JSON-сериализацию в SDK.
+    В памяти держится одна полноразмерная копия — само тело запроса
+    """
+    template = json.dumps({
+        "model": model,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt},
+                    {"type": "image_url", "image_url": _IMAGE_PLACEHOLDER},
+                ],
+            }
+        ],
+    }).encode()
+    head, tail = template.split(f'"{_IMAGE_PLACEHOLDER}"'.encode())
+    head += f'"data:{mime_type};base64,'.encode()
+    tail = b'"' + tail
+
+    image = memoryview(image)
+    size = len(head) + 4 * ((len(image) + 2) // 3) + len(tail)
+
+    # буфер сразу нужного размера: base64 пишется в него кусками, getvalue() отдаёт его без копирования
+    body = io.BytesIO()
+    body.seek(size - 1)
+    body.write(b"\0")
+    body.seek(0)
+
+    body.write(head)
+    for offset in range(0, len(image), _B64_CHUNK):
+        body.write(binascii.b2a_base64(image[offset:offset + _B64_CHUNK], newline=False))
+    body.write(tail)
+
+    return body.getvalue()
+
+
+def extract_image(raw: bytes) -> bytes:
+    """
+    Достаёт первую картинку из сырого JSON ответа chat.completions.
+    Base64 декодируется прямо из буфера ответа (memoryview), без json.loads и промежуточных строк.
+    Ответ без картинки — NoResultError, ответ с ошибкой провайдера — RuntimeError
+    """
+    images = raw.find(b'"images"')
+    start = raw.find(b";base64,", images) if images != -1 else -1
+    end = raw.find(b'"', start) if start != -1 else -1
+
+    # экранирование внутри строки (например "\/") — разбираем ответ честно через json
+    if end == -1 or raw.find(b"\\", start, end) != -1:
+        data = json.loads(raw)
+        if isinstance(data, dict) and data.get("error"):
+            raise RuntimeError(f"Ошибка провайдера: {data['error']}")
+        try:
+            image_data_url = data["choices"][0]["message"]["images"][0]["image_url"]["url"]
+        except (KeyError, IndexError, TypeError):
+            raise NoResultError("В ответе нет изображения") from None
+        return base64.b64decode(image_data_url.split(",", 1)[1])
+
+    return binascii.a2b_base64(memoryview(raw)[start + len(b";base64,"):end])
+
+
+# Общий на процесс async-клиент OpenRouter (один keep-alive пул соединений).
+# Число генераций в полёте ограничивает admission
+_client = None
+_loop = None
+
+
+async def get_model_client() -> "openai.AsyncOpenAI":
+    """Возвращает общий AsyncOpenAI клиент"""
+    global _client, _loop
+
+    loop = asyncio.get_running_loop()
+
+    # пул соединений httpx привязан к event loop — при смене loop создаём клиент заново,
+    # а прежний закрываем, чтобы не утекали его соединения (ошибка закрытия не мешает создать новый)
+    if _client is None or _loop is not loop:
+        stale = _client
+
+        http_client = openai.DefaultAsyncHttpxClient(
+            timeout=httpx.Timeout(OPENROUTER_TIMEOUT, connect=OPENROUTER_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=OPENROUTER_MAX_CONNECTIONS,
+                                max_keepalive_connections=OPENROUTER_MAX_CONNECTIONS),
+        )
+        _client = openai.AsyncOpenAI(base_url="https://openrouter.ai/api/v1", api_key=OPENROUTER_API_KEY, http_client=http_client)
+        _loop = loop
+
+        # новый клиент уже на месте — параллельный вызов не закроет его и не создаст ещё один
+        if stale is not None:
+            try:
+                await asyncio.wait_for(stale.close(), timeout=5)
+            except Exception as e:
+                logging.warning("⚠️ Ошибка закрытия клиента OpenRouter прежнего event loop: %s", e)
+
+    return _client
+
+
+async def close_model_client():
+    """Закрытие общего клиента OpenRouter"""
+    global _client, _loop
+
+    if _client is not None:
+        await _client.close()
+
+    _client = None
+    _loop = None
+
+
 class PhotoRestorer:
     """Класс для восстановления фото"""
     def __init__(self):
-        self.client = OpenAI(base_url="https://openrouter.ai/api/v1", api_key=OPENROUTER_API_KEY)
         self.standart_promt = "Restore and colorize this old or damaged photo. Remove photo frame and repair torn edges"
-        self.model = "google/gemini-2.5-flash-image"
+        self.model = MODEL_PRIMARY  # ключ кэша; ответить может и запасная модель (model_router)
         
-    async def restore(self, bot: Bot, file_path: str, user_promt: str = None):
+    def cache_key(self, file_unique_id: str, user_promt: str = None):
+        """Ключ результата в кэше для фото с данным file_unique_id и промтом"""
+        if not file_unique_id:
+            return None
+        return make_key(file_unique_id, user_promt or self.standart_promt, self.model)
+
+    async def restore(self, bot: Bot, file_id: str, user_promt: str = None, file_unique_id: str = None,
+                      user_id: Optional[int] = None, on_queued: Optional[Callable[[int], Awaitable[None]]] = None,
+                      allowance: int = 1):
+        """
+        Восстановление фото. Вызов модели проходит через admission:
+        user_id — чей это запрос, on_queued(position) — уведомление, если придётся подождать,
+        allowance — сколько фото пользователя можно восстанавливать одновременно (альбом)
+        """
         try:
-            logging.info(f"🔄 Начало обработки: {file_path}")
-
-            # скачивание изображение по file_id
-            downloaded = await bot.download_file(file_path)
-            img_bytes = downloaded.read()
-            logging.info(f"📥 Скачано байт: {len(img_bytes)}")
-
-            img_b64 = base64.b64encode(img_bytes).decode("utf-8")
-            logging.info(f"🔐 Base64 закодировано")
-
-            logging.info(f"📤 Отправка в OpenRouter...")
-            # отправка изображения в нано банана. Универсальный вызов — через chat.completions
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": user_promt or self.standart_promt
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": f"data:image/png;base64,{img_b64}"
-                            }
-                        ],
-                    }
-                ],
-            )
+            prompt = user_promt or self.standart_promt
 
-            # 💾 Сохраняем весь ответ в файл
-            # with open("response_full.txt", "w", encoding="utf-8") as f:
-            #     json.dump(response.model_dump(), f, ensure_ascii=False, indent=2)
-            
-            logging.info(f"✅ Получен ответ от OpenRouter")
-            logging.info(f"📊 Тип ответа: {type(response)}")
-            logging.info(f"📊 Choices: {len(response.choices)}")
-            
-            # получаем ответ от нано банана
-            image_data_url = response.choices[0].message.images[0]["image_url"]["url"]
-            image_b64 = image_data_url.split(",")[1]
-            
-            # Декодируем base64 в байты
-            image_bytes = base64.b64decode(image_b64)
-            logging.info(f"✅ Изображение декодировано, размер: {len(image_bytes)}")
+            # повторное фото с тем же промтом — отдаём готовый результат без скачивания и генерации
+            cache_key = self.cache_key(file_unique_id, user_promt)
+            if cache_key:
+                cached = await result_cache.get(cache_key)
+                if cached is not None:
+                    logging.info("♻️ Результат взят из кэша: %s", file_unique_id)
+                    return BufferedInputFile(cached, filename="restored.png")
+
+            # получение пути к файлу и скачивание изображения (BytesIO — читаем через memoryview, без копии)
+            with stage("get_file"):
+                file_info = await bot.get_file(file_id)
+            file_path = file_info.file_path
+            logging.info("🔄 Начало обработки: %s", file_path)
+
+            with stage("download"):
+                downloaded = await bot.download_file(file_path)
+            img_buffer = downloaded.getbuffer()
+            logging.debug("📥 Скачано байт: %s", len(img_buffer))
+
+            # без file_unique_id ключом служит хэш самой картинки
+            if cache_key is None and result_cache.enabled:
+                cache_key = make_key(image_hash(img_buffer), prompt, self.model)
+                cached = await result_cache.get(cache_key)
+                if cached is not None:
+                    logging.info("♻️ Результат взят из кэша по хэшу изображения")
+                    return BufferedInputFile(cached, filename="restored.png")
+
+            # уменьшение до входного разрешения модели, без метаданных, с правильным mime type
+            try:
+                with stage("preprocess"):
+                    img_data, mime_type = await preprocess_image(img_buffer)
+                logging.debug("🖼 Изображение подготовлено: %s -> %s байт, %s", len(img_buffer), len(img_data), mime_type)
+            except Exception as e:
+                logging.warning("⚠️ Не удалось подготовить изображение, отправляем как есть: %s", e)
+                img_data, mime_type = img_buffer, "image/png"
+
+            # исходник больше не нужен, если подготовленная картинка — отдельная копия
+            if img_data is not img_buffer:
+                img_buffer.release()
+                del downloaded
+
+            client = await get_model_client()
+
+            async def generate(model: str) -> bytes:
+                # тело запроса собираем сразу в байтах: base64 пишется прямо в JSON, без str и f-string
+                with stage("encode"):
+                    body = build_request_body(model, prompt, img_data, mime_type)
+                logging.debug("📤 Отправка в OpenRouter (%s), размер запроса: %s", model, len(body))
+
+                # универсальный вызов — через chat.completions, ответ берём сырым,
+                # чтобы не строить pydantic-модель с копией base64 строки
+                with stage("model"):
+                    response = await client.post("/chat/completions", body=body, cast_to=httpx.Response)
+                del body
+                logging.debug("✅ Получен ответ от OpenRouter, размер: %s", len(response.content))
+
+                # декодируем base64 в байты; ответ без картинки — ошибка этой модели
+                with stage("decode"):
+                    return extract_image(response.content)
+
+            # модель выбирает model_router (хедж, переключение при ошибках), темп — admission.
+            # Хедж идёт параллельно основной попытке и берёт своё место без пользователя:
+            # лимит пользователя уже занят основной, а токен и место в max_inflight он тратит сам
+            async with admission.slot(user_id, on_queued, allowance):
+                image_bytes, model = await model_router.run(generate, hedge_slot=admission.slot)
+            logging.info("✅ Изображение декодировано (%s), размер: %s", model, len(image_bytes))
+
+            if cache_key:
+                await result_cache.set(cache_key, image_bytes)
             
             # Создаём буффер изображения напрямую из байтов
             photo_file = BufferedInputFile(image_bytes, filename="restored.png")
 
         except Exception as e:
-            logging.error(f"⚠️ Ошибка при обработке изображения: {e}")
+            logging.error("⚠️ Ошибка при обработке изображения: %s", e)
             return None
             
         else:
-            return photo_file
\ No newline at end of file
+            return photo_file
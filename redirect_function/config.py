@@ -1,13 +1,47 @@
+import asyncio
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
+import random
+import sys
 
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# Настройка логирования: запись уходит в очередь, в stdout её пишет отдельный поток
+_log_queue = queue.Queue()
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+logging.basicConfig(level=os.environ.get("LOG_LEVEL") or "INFO", handlers=[logging.handlers.QueueHandler(_log_queue)])
 logger = logging.getLogger(__name__)
 
+# доля апдейтов, тело которых попадает в лог, и предел длины тела в логе
+LOG_BODY_SAMPLE_RATE = float(os.environ.get("LOG_BODY_SAMPLE_RATE") or 0.1)
+LOG_BODY_MAX_CHARS = int(os.environ.get("LOG_BODY_MAX_CHARS") or 1000)
+
+
+def sample_payload(payload: str):
+    """Тело апдейта для лога (выборочно и обрезанное) или None"""
+    if LOG_BODY_SAMPLE_RATE < 1 and random.random() >= LOG_BODY_SAMPLE_RATE:
+        return None
+    if len(payload) > LOG_BODY_MAX_CHARS:
+        return f"{payload[:LOG_BODY_MAX_CHARS]}... ({len(payload)} символов)"
+    return payload
+
+
+async def flush_logging():
+    """Дождаться вывода логов до заморозки функции"""
+    await asyncio.to_thread(_log_queue.join)
+
 
 #ydb
 MQ2_URL = os.environ.get("MQ2_URL")
+# несколько очередей через запятую — шарды: апдейты одного пользователя всегда идут в одну очередь
+MQ2_URLS = [url.strip() for url in (MQ2_URL or "").split(",") if url.strip()]
 KEY_ID = os.environ.get("KEY_ID")
-SECRET_KEY = os.environ.get("SECRET_KEY")
\ No newline at end of file
+SECRET_KEY = os.environ.get("SECRET_KEY")
+MQ_ENDPOINT = os.environ.get("MQ_ENDPOINT") or "https://message-queue.api.cloud.yandex.net"
@@ -1,24 +1,141 @@
+import asyncio
+import hashlib
+import json
+import zlib
+from collections import defaultdict
 import aiobotocore.session
-from config import logger, MQ2_URL, KEY_ID, SECRET_KEY
+from config import logger, sample_payload, flush_logging, MQ2_URLS, KEY_ID, SECRET_KEY, MQ_ENDPOINT
 
 
-async def send_to_queue(body: str):
-    """Публикация апдейта в Yandex Message Queue"""
-    session = aiobotocore.session.get_session()
-    async with session.create_client(
-        "sqs",
-        endpoint_url="https://message-queue.api.cloud.yandex.net",
-        region_name="ru-central1",
-        aws_secret_access_key=SECRET_KEY,
-        aws_access_key_id=KEY_ID,
-    ) as client:
-        await client.send_message(QueueUrl=MQ2_URL, MessageBody=body)
+# SendMessageBatch принимает не больше 10 сообщений
+BATCH_SIZE = 10
+
+# Клиент SQS живёт между вызовами, пока функция тёплая: без нового TLS-рукопожатия на каждый апдейт
+_client = None
+_client_ctx = None
+_loop = None
+
+
+async def get_client():
+    """Общий клиент Yandex Message Queue (пересоздаётся, если рантайм сменил event loop)"""
+    global _client, _client_ctx, _loop
+
+    loop = asyncio.get_running_loop()
+    if _client is None or _loop is not loop:
+        # клиент прежнего loop закрываем, иначе его пул соединений утекает;
+        # ошибка закрытия не мешает создать новый
+        stale, _client, _client_ctx = _client_ctx, None, None
+        if stale is not None:
+            try:
+                await asyncio.wait_for(stale.__aexit__(None, None, None), timeout=5)
+            except Exception as e:
+                logger.warning("Ошибка закрытия клиента очереди прежнего event loop: %s", e)
+
+        session = aiobotocore.session.get_session()
+        _client_ctx = session.create_client(
+            "sqs",
+            endpoint_url=MQ_ENDPOINT,
+            region_name="ru-central1",
+            aws_secret_access_key=SECRET_KEY,
+            aws_access_key_id=KEY_ID,
+        )
+        _client = await _client_ctx.__aenter__()
+        _loop = loop
+
+    return _client
+
+
+async def close_client():
+    """Закрытие общего клиента (для локального запуска и тестов)"""
+    global _client, _client_ctx, _loop
+
+    if _client_ctx is not None:
+        await _client_ctx.__aexit__(None, None, None)
+
+    _client = None
+    _client_ctx = None
+    _loop = None
+
+
+def shard_key(body: str) -> str:
+    """
+    Ключ шарда: id пользователя из апдейта (как sharding.user_hash в основном боте),
+    без пользователя — update_id
+    """
+    try:
+        update = json.loads(body)
+    except Exception:
+        return ""
+    if not isinstance(update, dict):
+        return ""
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return str(value["from"].get("id"))
+    return str(update.get("update_id", ""))
+
+
+def make_entry(i: int, body: str, key: str, queue_url: str) -> dict:
+    entry = {"Id": str(i), "MessageBody": body}
+    # FIFO-очередь отдаёт сообщения одной группы строго по порядку — группа на пользователя
+    if queue_url.endswith(".fifo"):
+        entry["MessageGroupId"] = key or "none"
+        entry["MessageDeduplicationId"] = hashlib.sha256(body.encode()).hexdigest()
+    return entry
+
+
+async def send_batch(queue_url: str, items: list[tuple[str, str]]):
+    """Публикация до 10 апдейтов (тело, ключ шарда) одним SendMessageBatch"""
+    client = await get_client()
+    entries = [make_entry(i, body, key, queue_url) for i, (body, key) in enumerate(items)]
+
+    response = await client.send_message_batch(QueueUrl=queue_url, Entries=entries)
+
+    # FIFO-очередь: дослать отказанное сообщение после уже принятых — нарушить порядок апдейтов
+    # пользователя. Ошибка — Telegram повторит webhook, повторы принятых отбросит дедупликация очереди
+    failed_entries = response.get("Failed", [])
+    if failed_entries and queue_url.endswith(".fifo"):
+        raise RuntimeError(f"FIFO-очередь не приняла {len(failed_entries)} сообщений: {failed_entries}")
+
+    # не принятые очередью сообщения отправляем по одному; если и так не вышло — ошибка,
+    # Telegram повторит webhook
+    for failed in failed_entries:
+        logger.error("Сообщение не принято очередью: %s", failed)
+        entry = entries[int(failed["Id"])]
+        entry.pop("Id")
+        await client.send_message(QueueUrl=queue_url, **entry)
+
+
+async def send_to_queue(bodies: list[str]):
+    """
+    Публикация апдейтов в Yandex Message Queue: очередь-шард по хешу пользователя,
+    пачками по 10. Очереди заполняются параллельно. Пачки FIFO-очереди — по порядку,
+    чтобы апдейты пользователя не обогнали друг друга; стандартная очередь порядка
+    не держит, её пачки отправляются параллельно
+    """
+    # клиент создаётся до параллельной отправки: иначе каждая пачка создала бы свой
+    await get_client()
+
+    shards = defaultdict(list)
+    for body in bodies:
+        key = shard_key(body)
+        shards[MQ2_URLS[zlib.crc32(key.encode()) % len(MQ2_URLS)]].append((body, key))
+
+    async def send_shard(queue_url: str, items: list[tuple[str, str]]):
+        batches = [items[i:i + BATCH_SIZE] for i in range(0, len(items), BATCH_SIZE)]
+        if not queue_url.endswith(".fifo"):
+            await asyncio.gather(*(send_batch(queue_url, batch) for batch in batches))
+            return
+        for batch in batches:
+            await send_batch(queue_url, batch)
+
+    await asyncio.gather(*(send_shard(queue_url, items) for queue_url, items in shards.items()))
 
 
 async def handler(event, context):
     messages = event.get("messages", [])
-    logger.info(f"Всего сообщений: {len(messages)}")
+    logger.info("Всего сообщений: %s", len(messages))
 
+    bodies = []
     for msg in messages:
         details = msg.get("details", {})
         message = details.get("message", {})
@@ -27,10 +144,16 @@ async def handler(event, context):
         if not body_str:
             continue
 
-        logger.info(f"BODY: {body_str}")
+        preview = sample_payload(body_str)
+        if preview is not None:
+            logger.info("BODY: %s", preview)
+        bodies.append(body_str)
+
+    # просто кладём в очередь
+    if bodies:
+        await send_to_queue(bodies)
 
-        # просто кладём в очередь
-        await send_to_queue(body_str)
+    await flush_logging()
 
     # моментально возвращаем Telegram'у 200 OK
-    return {'statusCode': 200}
\ No newline at end of file
+    return {'statusCode': 200}
@@ -0,0 +1,279 @@
+import asyncio
+import logging
+from aiogram import Bot
+from config import (RESTORE_WORKERS, JOB_POLL_INTERVAL, JOB_POLL_MAX_INTERVAL, JOB_QUEUE_BACKEND, JOB_LEASE,
+                    JOB_MAX_ATTEMPTS)
+from delivery import send_by_file_id, send_result, send_album
+from jobs import JobQueue, job_queue
+from metrics import GENERATIONS, REFUNDS
+from log_config import set_request_id
+from languages import get_texts
+from photo_restorer import PhotoRestorer
+from result_cache import result_cache
+from ydb_models import Job, JobStatus, UserClient, YDBClient
+
+
+# Воркеры реставрации: берут задачи из очереди и выполняют скачивание → модель → отправку.
+# С бэкендом memory работают внутри процесса бота, с ydb — отдельными процессами:
+#   python restore_worker.py
+
+
+async def refund(bot: Bot, job: Job, texts: dict, failed: int = 1):
+    """
+    failed фото задачи не восстановились: сообщаем и возвращаем ровно их.
+    Бесплатная генерация списывается при постановке задачи — возвращаем её.
+    Оплата Stars, за которую не восстановилось ни одно фото, возвращается целиком;
+    вернуть часть платежа Telegram не даёт — за часть альбома зачисляем генерации (credits).
+    Сначала возврат, потом сообщение: пользователь мог заблокировать бота, возврат от этого не зависит
+    """
+    refunded = False
+    if job.paid and job.charge_id and failed >= len(job.album or [None]):
+        try:
+            await bot.refund_star_payment(job.telegram_id, job.charge_id)
+            REFUNDS.inc(kind="stars")
+            refunded = True
+        except Exception as e:
+            logging.error("⚠️ Не удалось вернуть Stars по задаче %s, зачисляем генерации: %s", job.job_id, e)
+
+    if not refunded:
+        async with UserClient() as user_client:
+            if job.paid:
+                await user_client.add_credits(job.telegram_id, failed)
+                REFUNDS.inc(failed, kind="credits")
+            else:
+                await user_client.update_field_free_generate(job.telegram_id, True)
+                REFUNDS.inc(kind="free")
+
+    try:
+        await bot.send_message(job.telegram_id, texts["TEXT"]["generation_error"])
+    except Exception as e:
+        logging.error("⚠️ Не удалось сообщить об ошибке генерации: %s", e)
+
+
+async def run_job(bot: Bot, job: Job) -> bool:
+    """Выполнение одной задачи. False — генерация не удалась"""
+    if job.album:
+        return await run_album_job(bot, job)
+
+    texts = await get_texts(job.language_code)
+
+    photo_restorer = PhotoRestorer()
+    cache_key = photo_restorer.cache_key(job.file_unique_id, job.caption)
+
+    # результат уже загружался в Telegram — отправляем по file_id
+    sent = await send_by_file_id(bot, job.telegram_id, cache_key, job.file_type,
+                                 texts["TEXT"]["photo_is_ready"], job.reply_to_message_id)
+
+    async def on_queued(position: int):
+        # модель занята другими пользователями — показываем место в очереди вместо «восстанавливаю»
+        if job.notif_message_id is not None:
+            await bot.edit_message_text(texts["TEXT"]["queue_position"].format(position=position),
+                                        chat_id=job.telegram_id, message_id=job.notif_message_id)
+
+    # получение и обработка фотографии (без file_id восстанавливать нечего)
+    try:
+        photo_file = None if sent or job.file_id is None else await photo_restorer.restore(
+            bot, job.file_id, job.caption, job.file_unique_id, job.telegram_id, on_queued)
+    except Exception as e:
+        logging.error("Ошибка при обработке изображения Nano Banano: %s", e)
+        photo_file = None
+
+    # не загрузилось в Telegram — для пользователя это та же неудача, что и ошибка модели
+    if not sent and photo_file is not None:
+        try:
+            await send_result(bot, job.telegram_id, cache_key, photo_file, job.file_type,
+                              texts["TEXT"]["photo_is_ready"], job.reply_to_message_id)
+        except Exception as e:
+            logging.error("⚠️ Не удалось отправить результат: %s", e)
+            photo_file = None
+
+    if not sent and photo_file is None:
+        await refund(bot, job, texts)
+
+    if job.notif_message_id is not None:
+        try:
+            await bot.delete_message(job.telegram_id, job.notif_message_id)
+        except Exception as e:
+            logging.error("Ошибка удаления сообщений: %s", e)
+
+    outcome = "reused" if sent else "ok" if photo_file is not None else "error"
+    GENERATIONS.inc(kind="paid" if job.paid else "free", outcome=outcome)
+
+    return sent or photo_file is not None
+
+
+async def run_album_job(bot: Bot, job: Job) -> bool:
+    """
+    Альбом: фото восстанавливаются параллельно (модель — в пределах лимитов admission),
+    готовые уходят одним sendMediaGroup. False — не восстановилось ни одно фото
+    """
+    texts = await get_texts(job.language_code)
+    photo_restorer = PhotoRestorer()
+
+    async def on_queued(position: int):
+        if job.notif_message_id is not None:
+            await bot.edit_message_text(texts["TEXT"]["queue_position"].format(position=position),
+                                        chat_id=job.telegram_id, message_id=job.notif_message_id)
+
+    async def restore_item(item: dict):
+        cache_key = photo_restorer.cache_key(item.get("file_unique_id"), job.caption)
+
+        # результат уже загружался в Telegram — в альбом идёт его file_id
+        if cache_key:
+            file_id = await result_cache.get_file_id(cache_key, job.file_type)
+            if file_id is not None:
+                return cache_key, file_id
+
+        if item.get("file_id") is None:
+            return None
+        try:
+            # фото альбома идут к модели параллельно: лимит пользователя — до размера альбома
+            photo_file = await photo_restorer.restore(bot, item["file_id"], job.caption, item.get("file_unique_id"),
+                                                      job.telegram_id, on_queued, allowance=len(job.album))
+        except Exception as e:
+            logging.error("Ошибка при обработке изображения Nano Banano: %s", e)
+            return None
+        return (cache_key, photo_file) if photo_file is not None else None
+
+    results = await asyncio.gather(*(restore_item(item) for item in job.album))
+    ready = [result for result in results if result is not None]
+
+    if ready:
+        try:
+            await send_album(bot, job.telegram_id, ready, job.file_type, texts["TEXT"]["photo_is_ready"],
+                             job.reply_to_message_id)
+        except Exception as e:
+            logging.error("⚠️ Не удалось отправить альбом: %s", e)
+            ready = []
+
+    # не получившиеся фото — сообщаем и возвращаем их долю
+    if len(ready) < len(job.album):
+        await refund(bot, job, texts, len(job.album) - len(ready))
+
+    if job.notif_message_id is not None:
+        try:
+            await bot.delete_message(job.telegram_id, job.notif_message_id)
+        except Exception as e:
+            logging.error("Ошибка удаления сообщений: %s", e)
+
+    kind = "paid" if job.paid else "free"
+    if ready:
+        GENERATIONS.inc(len(ready), kind=kind, outcome="ok")
+    if len(ready) < len(job.album):
+        GENERATIONS.inc(len(job.album) - len(ready), kind=kind, outcome="error")
+
+    return bool(ready)
+
+
+async def give_up(bot: Bot, job: Job):
+    """Задачу брали JOB_MAX_ATTEMPTS раз и ни разу не довели до конца — завершаем её с возвратом"""
+    logging.error("⚠️ Задача %s не выполнена за %s попыток, возвращаем генерацию", job.job_id, job.attempts - 1)
+    texts = await get_texts(job.language_code)
+    await refund(bot, job, texts, len(job.album) if job.album else 1)
+
+    if job.notif_message_id is not None:
+        try:
+            await bot.delete_message(job.telegram_id, job.notif_message_id)
+        except Exception as e:
+            logging.error("Ошибка удаления сообщений: %s", e)
+
+    GENERATIONS.inc(len(job.album) if job.album else 1, kind="paid" if job.paid else "free", outcome="error")
+
+
+async def keep_lease(queue: JobQueue, job: Job):
+    """Продление аренды задачи, пока воркер её выполняет"""
+    while True:
+        await asyncio.sleep(JOB_LEASE / 3)
+        try:
+            await queue.heartbeat(job)
+        except Exception as e:
+            logging.warning("⚠️ Не удалось продлить аренду задачи %s: %s", job.job_id, e)
+
+
+async def worker_loop(bot: Bot, queue: JobQueue):
+    """Один воркер: бесконечно берёт задачи из очереди"""
+    poll_interval = JOB_POLL_INTERVAL
+    while True:
+        try:
+            job = await queue.claim()
+        except Exception as e:
+            logging.error("⚠️ Ошибка получения задачи из очереди: %s", e)
+            job = None
+
+        # пустая очередь: опрашиваем всё реже, вдвое за раз, но не реже JOB_POLL_MAX_INTERVAL
+        if job is None:
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, JOB_POLL_MAX_INTERVAL)
+            continue
+        poll_interval = JOB_POLL_INTERVAL
+
+        # логи выполнения помечены id задачи
+        set_request_id(f"job:{job.job_id}")
+
+        try:
+            lease = asyncio.create_task(keep_lease(queue, job))
+            try:
+                if job.attempts > JOB_MAX_ATTEMPTS:
+                    await give_up(bot, job)
+                    ok = False
+                else:
+                    ok = await run_job(bot, job)
+            finally:
+                lease.cancel()
+            await queue.set_status(job, JobStatus.DONE if ok else JobStatus.FAILED)
+        except Exception as e:
+            logging.error("⚠️ Ошибка выполнения задачи %s: %s", job.job_id, e)
+            try:
+                await queue.set_status(job, JobStatus.FAILED)
+            except Exception as e:
+                logging.error("⚠️ Не удалось обновить статус задачи %s: %s", job.job_id, e)
+        finally:
+            queue.done(job)
+
+
+_workers = []
+_loop = None
+
+
+def start_restore_workers(bot: Bot, count: int = RESTORE_WORKERS, queue: JobQueue = job_queue):
+    """Запуск воркеров в текущем event loop (повторный вызов в том же loop ничего не делает)"""
+    global _workers, _loop
+
+    loop = asyncio.get_running_loop()
+    if _workers and _loop is loop:
+        return
+
+    _workers = [asyncio.create_task(worker_loop(bot, queue)) for _ in range(count)]
+    _loop = loop
+
+
+async def stop_restore_workers():
+    """Остановка воркеров текущего процесса"""
+    global _workers, _loop
+
+    for task in _workers:
+        task.cancel()
+    await asyncio.gather(*_workers, return_exceptions=True)
+
+    _workers = []
+    _loop = None
+
+
+async def main():
+    if JOB_QUEUE_BACKEND == "memory":
+        raise RuntimeError("Отдельные воркеры работают только с JOB_QUEUE_BACKEND=ydb")
+
+    from main import bot
+
+    logging.info("Воркеры реставрации запущены: %s", RESTORE_WORKERS)
+    start_restore_workers(bot)
+    try:
+        await asyncio.gather(*_workers)
+    finally:
+        await stop_restore_workers()
+        await YDBClient.shutdown()
+        await bot.session.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,265 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+from config import RESULT_CACHE_BACKEND, RESULT_CACHE_TTL, RESULT_CACHE_MAX_MB, RESULT_CACHE_DIR
+from ydb_models import Result, ResultClient
+from metrics import CACHE_REQUESTS
+
+
+# Кэш готовых реставраций: одно и то же фото с тем же промтом и моделью повторно не генерируем.
+# Ключ — file_unique_id из Telegram (или sha256 самой картинки) + промт + модель.
+
+
+def make_key(source_id: str, prompt: str, model: str) -> str:
+    """Ключ кэша: sha256 от источника, промта и модели"""
+    return hashlib.sha256(f"{source_id}|{prompt}|{model}".encode()).hexdigest()
+
+
+def image_hash(image: memoryview | bytes) -> str:
+    """Хэш содержимого картинки — источник ключа, когда file_unique_id неизвестен"""
+    return "sha256:" + hashlib.sha256(image).hexdigest()
+
+
+# ------------------------------------------------------------ ХРАНИЛИЩА -----------------------------------------------------------
+
+
+class ResultStore:
+    """Базовое хранилище результатов"""
+
+    async def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    async def set(self, key: str, image: bytes) -> None:
+        raise NotImplementedError
+
+
+class MemoryResultStore(ResultStore):
+    """LRU в памяти процесса с ограничением по суммарному размеру и TTL"""
+
+    def __init__(self, max_bytes: int, ttl: int):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._items: OrderedDict[str, tuple[float, bytes]] = OrderedDict()
+
+    async def get(self, key: str) -> Optional[bytes]:
+        item = self._items.get(key)
+        if item is None:
+            return None
+
+        created_at, image = item
+        if time.monotonic() - created_at > self.ttl:
+            self._pop(key)
+            return None
+
+        self._items.move_to_end(key)
+        return image
+
+    async def set(self, key: str, image: bytes) -> None:
+        if len(image) > self.max_bytes:
+            return
+
+        if key in self._items:
+            self._pop(key)
+
+        self._items[key] = (time.monotonic(), image)
+        self.size += len(image)
+
+        # вытесняем самые давно использованные записи
+        while self.size > self.max_bytes:
+            self._pop(next(iter(self._items)))
+
+    def _pop(self, key: str):
+        _, image = self._items.pop(key)
+        self.size -= len(image)
+
+
+class DiskResultStore(ResultStore):
+    """Файлы на локальном диске: TTL по mtime, вытеснение по времени последнего чтения"""
+
+    def __init__(self, directory: str, max_bytes: int, ttl: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        os.makedirs(directory, exist_ok=True)
+
+    async def get(self, key: str) -> Optional[bytes]:
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, image: bytes) -> None:
+        await asyncio.to_thread(self._set, key, image)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+
+            with open(path, "rb") as f:
+                image = f.read()
+
+            os.utime(path, (time.time(), os.path.getmtime(path)))  # отмечаем чтение для LRU
+            return image
+        except FileNotFoundError:
+            return None
+
+    def _set(self, key: str, image: bytes):
+        if len(image) > self.max_bytes:
+            return
+
+        # пишем во временный файл и переименовываем — читатель не увидит недописанный файл
+        tmp_path = self._path(key) + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(image)
+        os.replace(tmp_path, self._path(key))
+
+        self._evict()
+
+    def _evict(self):
+        now = time.time()
+        files = []
+        total = 0
+
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                continue
+            stat = entry.stat()
+            if now - stat.st_mtime > self.ttl:
+                os.remove(entry.path)
+                continue
+            files.append((stat.st_atime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+class YDBResultStore(ResultStore):
+    """Таблица results в YDB — кэш общий для всех инстансов, старые записи удаляет TTL таблицы"""
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    async def get(self, key: str) -> Optional[bytes]:
+        async with ResultClient() as result_client:
+            result = await result_client.get_result_by_key(key)
+
+        # TTL в YDB удаляет строки не мгновенно — проверяем срок сами
+        if result is None or time.time() - result.created_at > self.ttl:
+            return None
+
+        return result.image
+
+    async def set(self, key: str, image: bytes) -> None:
+        async with ResultClient() as result_client:
+            await result_client.insert_result(Result(key, image))
+
+
+# --------------------------------------------------------------- КЭШ ----------------------------------------------------------------
+
+
+class ResultCache:
+    """Кэш результатов генераций со счётчиками попаданий и промахов"""
+
+    def __init__(self, store: Optional[ResultStore]):
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+        self.file_id_hits = 0
+        self.file_id_misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.store is not None
+
+    async def get(self, key: str) -> Optional[bytes]:
+        if self.store is None:
+            return None
+
+        try:
+            image = await self.store.get(key)
+        except Exception as e:
+            logging.error("⚠️ Ошибка чтения кэша результатов: %s", e)
+            image = None
+
+        if image is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache="result", result="miss")
+        else:
+            self.hits += 1
+            CACHE_REQUESTS.inc(cache="result", result="hit")
+
+        return image
+
+    async def set(self, key: str, image: bytes) -> None:
+        if self.store is None:
+            return
+
+        try:
+            await self.store.set(key, image)
+        except Exception as e:
+            logging.error("⚠️ Ошибка записи в кэш результатов: %s", e)
+
+    async def get_file_id(self, key: str, file_type: str) -> Optional[str]:
+        """Telegram file_id уже отправленного результата в нужном формате (фото / документ)"""
+        if self.store is None:
+            return None
+
+        try:
+            file_id = await self.store.get(f"{key}:{file_type}")
+        except Exception as e:
+            logging.error("⚠️ Ошибка чтения file_id из кэша результатов: %s", e)
+            file_id = None
+
+        if file_id is None:
+            self.file_id_misses += 1
+            CACHE_REQUESTS.inc(cache="file_id", result="miss")
+            return None
+
+        self.file_id_hits += 1
+        CACHE_REQUESTS.inc(cache="file_id", result="hit")
+        return file_id.decode()
+
+    async def set_file_id(self, key: str, file_type: str, file_id: str) -> None:
+        """Запоминаем file_id, который Telegram вернул после загрузки результата"""
+        await self.set(f"{key}:{file_type}", file_id.encode())
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "file_id_hits": self.file_id_hits,
+            "file_id_misses": self.file_id_misses,
+        }
+
+
+def create_store(backend: str = RESULT_CACHE_BACKEND) -> Optional[ResultStore]:
+    """Хранилище по имени бэкенда из конфига"""
+    max_bytes = RESULT_CACHE_MAX_MB * 1024 * 1024
+
+    if backend == "memory":
+        return MemoryResultStore(max_bytes, RESULT_CACHE_TTL)
+    if backend == "disk":
+        return DiskResultStore(RESULT_CACHE_DIR, max_bytes, RESULT_CACHE_TTL)
+    if backend == "ydb":
+        return YDBResultStore(RESULT_CACHE_TTL)
+    if backend == "off":
+        return None
+
+    raise ValueError(f"Неизвестный бэкенд кэша результатов: {backend}")
+
+
+result_cache = ResultCache(create_store())
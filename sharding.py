@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import zlib
+from typing import TYPE_CHECKING, Optional
+from config import UPDATE_SHARDS, SHARD_QUEUE_SIZE
+from log_config import set_request_id
+from metrics import registry, ERRORS
+
+if TYPE_CHECKING:
+    # aiogram не импортируем: index.py берёт отсюда get_user_id на холодном старте
+    from aiogram import Bot, Dispatcher
+
+
+# Шардирование апдейтов по пользователю: апдейты одного пользователя всегда попадают в один шард
+# и обрабатываются в нём строго по порядку, шарды работают параллельно.
+#   - в режиме очереди шард — очередь Yandex Message Queue (redirect_function раскладывает апдейты по MQ2_URL);
+#   - в режиме webhook шард — процесс сервера (чужие апдейты пересылаются владельцу),
+#     а внутри процесса — одна из UPDATE_SHARDS задач-обработчиков.
+# Так состояние пользователя (альбомы, очередь допуска) живёт в одном процессе, а порядок не держится на блокировках.
+
+
+SHARD_UPDATES = registry.counter("shard_updates", "Апдейты по шардам обработчика")
+
+
+def get_user_id(update: dict) -> Optional[int]:
+    """id пользователя из апдейта (message.from, pre_checkout_query.from, ...)"""
+    for value in update.values():
+        if isinstance(value, dict) and isinstance(value.get("from"), dict):
+            return value["from"].get("id")
+    return None
+
+
+def user_hash(update: dict) -> int:
+    """
+    Стабильный хеш пользователя (одинаковый во всех процессах, в отличие от hash()).
+    Апдейты без пользователя раскладываются по update_id
+    """
+    user_id = get_user_id(update)
+    key = user_id if user_id is not None else update.get("update_id", 0)
+    return zlib.crc32(str(key).encode())
+
+
+class ShardedFeeder:
+    """
+    shards очередей, у каждой — своя задача, которая по одному передаёт апдейты в диспетчер.
+    stride — число шардов уровнем выше (процессов): внутри процесса берём следующие разряды хеша,
+    иначе все пользователи процесса легли бы в одни и те же шарды
+    """
+
+    def __init__(self, dp: "Dispatcher", bot: "Bot", shards: int = UPDATE_SHARDS,
+                 queue_size: int = SHARD_QUEUE_SIZE, stride: int = 1):
+        self.dp = dp
+        self.bot = bot
+        self.shards = max(1, shards)
+        self.queue_size = queue_size
+        self.stride = max(1, stride)
+        self._queues: list[asyncio.Queue] = []
+        self._tasks: list[asyncio.Task] = []
+
+    def shard_of(self, update: dict) -> int:
+        return (user_hash(update) // self.stride) % self.shards
+
+    def start(self):
+        if self._tasks:
+            return
+        self._queues = [asyncio.Queue(self.queue_size) for _ in range(self.shards)]
+        self._tasks = [asyncio.create_task(self._run(index, queue)) for index, queue in enumerate(self._queues)]
+        logging.info("🧩 Обработчиков апдейтов (шардов): %s", self.shards)
+
+    async def feed(self, update: dict):
+        """Поставить апдейт в очередь его шарда (ждёт, если очередь шарда заполнена)"""
+        if not self._tasks:
+            self.start()
+        index = self.shard_of(update)
+        SHARD_UPDATES.inc(shard=index)
+        await self._queues[index].put(update)
+
+    async def _run(self, index: int, queue: asyncio.Queue):
+        while True:
+            update = await queue.get()
+            set_request_id(update.get("update_id", "-"))
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception as e:
+                ERRORS.inc(stage="update")
+                logging.error("Ошибка при обработке update в шарде %s: %s", index, e)
+            finally:
+                queue.task_done()
+
+    async def join(self):
+        """Дождаться обработки всех поставленных апдейтов"""
+        await asyncio.gather(*(queue.join() for queue in self._queues))
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._queues = []
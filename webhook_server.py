@@ -0,0 +1,247 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import subprocess
+import sys
+from typing import Optional
+import aiohttp
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import setup_application
+from config import (WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET, WEBAPP_HOST, WEBAPP_PORT, WEBAPP_WORKERS,
+                    WEBAPP_SHUTDOWN_TIMEOUT, JOB_QUEUE_BACKEND, UPDATE_SHARDS, SHARD_PORT_BASE)
+from metrics import handle_metrics, ERRORS
+from sharding import ShardedFeeder, user_hash
+from albums import albums
+
+
+# Режим webhook на своём aiohttp-сервере (VM или контейнер, без очереди между Telegram и ботом):
+#   - Telegram получает 200 сразу, апдейт обрабатывается фоновой задачей;
+#   - WEBAPP_WORKERS процессов слушают один порт через SO_REUSEPORT, ядро раскидывает соединения;
+#   - при UPDATE_SHARDS > 0 апдейт обрабатывает процесс-владелец пользователя (хеш id пользователя),
+#     чужие апдейты пересылаются ему через 127.0.0.1:SHARD_PORT_BASE+i, внутри процесса — шард из UPDATE_SHARDS;
+#   - /healthz — процесс жив, /readyz — бот запущен и принимает апдейты, /metrics — метрики процесса.
+# Запуск: WEBHOOK_URL=https://example.com/webhook python main.py
+
+
+async def handle_health(request: web.Request) -> web.Response:
+    return web.Response(text="ok")
+
+
+async def handle_ready(request: web.Request) -> web.Response:
+    if request.app["ready"]:
+        return web.Response(text="ready")
+    return web.Response(status=503, text="not ready")
+
+
+def check_secret(request: web.Request) -> bool:
+    return not WEBHOOK_SECRET or hmac.compare_digest(
+        request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), WEBHOOK_SECRET)
+
+
+def parse_update(raw: bytes) -> Optional[dict]:
+    """Апдейт из тела запроса или None, если это не JSON-объект (повтор запроса этого не исправит)"""
+    try:
+        update = json.loads(raw)
+    except ValueError:
+        return None
+    return update if isinstance(update, dict) else None
+
+
+class BackgroundWebhook:
+    """
+    Приём webhook без шардирования: 200 сразу, апдейт обрабатывается фоновой задачей.
+    Задачи храним сами, чтобы при остановке дождаться обработки
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self._tasks: set[asyncio.Task] = set()
+
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        if not check_secret(request):
+            return web.Response(status=401, text="Unauthorized")
+
+        update = parse_update(await request.read())
+        if update is None:
+            return web.Response(status=400, text="Bad Request")
+
+        task = asyncio.create_task(self._feed(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.json_response({})
+
+    async def _feed(self, update: dict):
+        try:
+            await self.dp.feed_raw_update(self.bot, update)
+        except Exception as e:
+            ERRORS.inc(stage="update")
+            logging.error("Ошибка при обработке update: %s", e)
+
+    async def join(self, timeout: float):
+        """Дождаться апдейтов в обработке (не дольше timeout сек.)"""
+        if self._tasks:
+            await asyncio.wait(set(self._tasks), timeout=timeout)
+
+
+class ShardRouter:
+    """
+    Приём webhook с шардированием: апдейт обрабатывает процесс-владелец пользователя, а в нём — шард пользователя.
+    Если владелец недоступен (запускается или уже остановлен), апдейт обрабатывается здесь же:
+    лучше нарушить порядок, чем потерять апдейт
+    """
+
+    def __init__(self, dp: Dispatcher, bot: Bot, index: int = 0, workers: int = 1, shards: int = UPDATE_SHARDS):
+        self.index = index
+        self.workers = max(1, workers)
+        self.feeder = ShardedFeeder(dp, bot, shards=shards, stride=self.workers)
+        self._session = None
+        self._runner = None
+
+    def owner(self, update: dict) -> int:
+        return user_hash(update) % self.workers
+
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        if not check_secret(request):
+            return web.Response(status=401, text="Unauthorized")
+
+        raw = await request.read()
+        update = parse_update(raw)
+        if update is None:
+            return web.Response(status=400, text="Bad Request")
+
+        owner = self.owner(update)
+        if owner == self.index or not await self._forward(owner, raw):
+            await self.feeder.feed(update)
+        return web.json_response({})
+
+    async def handle_forwarded(self, request: web.Request) -> web.Response:
+        # слушаем только 127.0.0.1 — сюда пишут лишь соседние процессы, секрет уже проверен ими
+        await self.feeder.feed(await request.json())
+        return web.json_response({})
+
+    async def _forward(self, owner: int, raw: bytes) -> bool:
+        try:
+            async with self._session.post(f"http://127.0.0.1:{SHARD_PORT_BASE + owner}/shard", data=raw,
+                                          headers={"Content-Type": "application/json"}) as response:
+                response.raise_for_status()
+            return True
+        except Exception as e:
+            ERRORS.inc(stage="shard_forward")
+            logging.warning("⚠️ Не удалось передать апдейт процессу %s, обрабатываем здесь: %s", owner, e)
+            return False
+
+    async def start(self):
+        self.feeder.start()
+        if self.workers > 1:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+            app = web.Application()
+            app.router.add_post("/shard", self.handle_forwarded)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, "127.0.0.1", SHARD_PORT_BASE + self.index).start()
+
+    async def stop(self, timeout: float):
+        """Перестать принимать пересылки, доделать поставленные апдейты и остановить шарды"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+        if self._session is not None:
+            await self._session.close()
+        try:
+            await asyncio.wait_for(self.feeder.join(), timeout=timeout)
+        finally:
+            await self.feeder.stop()
+
+
+def build_app(dp: Dispatcher, bot: Bot, set_webhook: bool = True, index: int = 0, workers: int = 1) -> web.Application:
+    """aiohttp-приложение с webhook, health/readiness и метриками"""
+    app = web.Application()
+    app["ready"] = False
+
+    if UPDATE_SHARDS > 0:
+        handler = None
+        shard_router = ShardRouter(dp, bot, index, workers)
+    else:
+        handler = BackgroundWebhook(dp, bot)
+        shard_router = None
+
+    async def on_shutdown(app: web.Application):
+        # новые апдейты больше не берём: балансировщик уводит трафик по /readyz
+        app["ready"] = False
+
+        # дожидаемся апдейтов в обработке и задач реставрации этого процесса, потом гасим бота
+        try:
+            if shard_router is not None:
+                await shard_router.stop(WEBAPP_SHUTDOWN_TIMEOUT)
+            else:
+                await handler.join(WEBAPP_SHUTDOWN_TIMEOUT)
+            await asyncio.wait_for(albums.join(), timeout=WEBAPP_SHUTDOWN_TIMEOUT)
+            if JOB_QUEUE_BACKEND == "memory":
+                from jobs import job_queue
+                await asyncio.wait_for(job_queue.join(), timeout=WEBAPP_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logging.warning("⚠️ Не все апдейты обработаны за %s сек. до остановки", WEBAPP_SHUTDOWN_TIMEOUT)
+
+    # свой on_shutdown — первым: до закрытия сессии бота и dp.shutdown
+    app.on_shutdown.append(on_shutdown)
+
+    app.router.add_post(WEBHOOK_PATH, (shard_router or handler).handle_webhook)
+    setup_application(app, dp, bot=bot)
+
+    async def on_startup(app: web.Application):
+        if shard_router is not None:
+            await shard_router.start()
+        # webhook ставит один процесс, остальные только слушают порт
+        if set_webhook:
+            await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET,
+                                  allowed_updates=dp.resolve_used_update_types())
+            logging.info("🔗 Webhook установлен: %s", WEBHOOK_URL)
+        app["ready"] = True
+
+    # после dp.startup (setup_application): готовность — когда YDB и воркеры уже подняты
+    app.on_startup.append(on_startup)
+
+    app.router.add_get("/healthz", handle_health)
+    app.router.add_get("/readyz", handle_ready)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+def serve(index: int = 0, workers: int = WEBAPP_WORKERS, dp: Dispatcher = None, bot: Bot = None):
+    """Один процесс сервера (блокирует до SIGINT/SIGTERM)"""
+    if dp is None:
+        from main import dp, bot
+
+    app = build_app(dp, bot, set_webhook=index == 0, index=index, workers=workers)
+    web.run_app(app, host=WEBAPP_HOST, port=WEBAPP_PORT, reuse_port=workers > 1, print=None)
+
+
+def run_webhook(dp: Dispatcher, bot: Bot, workers: int = WEBAPP_WORKERS):
+    """Запуск workers процессов сервера на одном порту (этот процесс — первый из них)"""
+    logging.info("Бот запущен в режиме webhook: %s:%s%s, процессов: %s", WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, workers)
+
+    if workers <= 1:
+        serve(dp=dp, bot=bot)
+        return
+
+    # остальные процессы — отдельные интерпретаторы: fork унаследовал бы мёртвый поток логов
+    # и состояние event loop родителя
+    children = [
+        subprocess.Popen([sys.executable, "-c", f"from webhook_server import serve; serve({index}, {workers})"],
+                         cwd=os.path.dirname(os.path.abspath(__file__)))
+        for index in range(1, workers)
+    ]
+
+    try:
+        serve(0, workers, dp, bot)
+    finally:
+        for child in children:
+            child.terminate()
+        for child in children:
+            try:
+                child.wait(WEBAPP_SHUTDOWN_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                child.kill()
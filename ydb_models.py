@@ -1,11 +1,21 @@
 import asyncio
-import ydb
-import ydb.aio
+import json
+import logging
+import sys
 from typing import Optional, Dict, Any
-from config import YDB_ENDPOINT, YDB_PATH, YDB_TOKEN
-from dataclasses import dataclass
+from config import (YDB_ENDPOINT, YDB_PATH, YDB_TOKEN, YDB_POOL_SIZE, YDB_POOL_WARMUP, RESULT_CACHE_TTL,
+                    CACHE_TTL, JOB_TTL, JOB_LEASE, DEDUP_TTL)
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
 from enum import Enum
+from lazy_imports import lazy_import
+from metrics import YDB_QUERY_SECONDS, ERRORS
+
+
+# драйвер YDB загружается при первом запросе к базе (ydb.aio импортируется самим пакетом ydb)
+ydb = lazy_import("ydb")
+
+logger = logging.getLogger(__name__)
 
 
 # yc iam create-token   (12 часов действует)
@@ -20,6 +30,13 @@ __all__ = ['User',
            'Payment',
            'PaymentClient',
            'PaymentType',
+           'Settlement',
+           'Job',
+           'JobClient',
+           'JobStatus',
+           'ProcessedUpdateClient',
+           'Result',
+           'ResultClient',
            'YDBClient'
            ]
 
@@ -29,10 +46,22 @@ class PaymentType(Enum):
     ANIMATION = "animation"
 
 
+class JobStatus(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+
+
 # ---------------------------------------------------------- БАЗОВЫЙ КЛАСС ---------------------------------------------------------
 
 
 class YDBClient:
+    # Общие на весь процесс драйвер и пул сессий — по одному на (endpoint, database). Живут между вызовами
+    # облачной функции, пока контейнер тёплый; клиенты только берут на них ссылки.
+    _shared: dict[tuple[str, str], tuple] = {}  # (endpoint, database) -> (driver, pool, loop)
+    _shared_locks: dict[tuple[str, str], tuple] = {}  # (endpoint, database) -> (loop, lock)
+
     def __init__(self, endpoint: str = YDB_ENDPOINT, database: str = YDB_PATH, token: str = YDB_TOKEN):
         """
         Инициализация клиента YDB
@@ -42,7 +71,6 @@ class YDBClient:
         self.token = token
         self.driver = None
         self.pool = None
-        self.credentials = ydb.iam.MetadataUrlCredentials() # ydb.AccessTokenCredentials(self.token) # 
     
     async def __aenter__(self):
         """Async context manager entry"""
@@ -55,45 +83,120 @@ class YDBClient:
     
     async def connect(self):
         """
-        Создание соединения с YDB и инициализация пула сессий
+        Подключение к общему драйверу и пулу сессий YDB (создаются один раз на процесс)
         """
         if self.driver is not None:
             return  # уже подключены
-            
-        driver_config = ydb.DriverConfig(
-            self.endpoint, 
-            self.database,
-            credentials=self.credentials,
-            root_certificates=ydb.load_ydb_root_certificate(),
-        )
-        
-        self.driver = ydb.aio.Driver(driver_config)
-        
-        try:
-            await self.driver.wait(timeout=5)
-            self.pool = ydb.aio.QuerySessionPool(self.driver)
-            print("Successfully connected to YDB")
-        except TimeoutError:
-            print("Connect failed to YDB")
-            print("Last reported errors by discovery:")
-            print(self.driver.discovery_debug_details())
-            await self.driver.stop()
-            self.driver = None
-            raise
+
+        self.driver, self.pool = await YDBClient.startup(self.endpoint, self.database)
     
     async def close(self):
         """
-        Закрытие соединения с YDB
+        Освобождение ссылок на общий пул. Само соединение закрывается в YDBClient.shutdown()
         """
-        if self.pool:
-            await self.pool.stop()
-            self.pool = None
-        
-        if self.driver:
-            await self.driver.stop()
-            self.driver = None
-            print("YDB connection closed")
-    
+        self.pool = None
+        self.driver = None
+
+    @classmethod
+    async def startup(cls, endpoint: str = YDB_ENDPOINT, database: str = YDB_PATH, warmup: int = YDB_POOL_WARMUP):
+        """
+        Создание общего драйвера и пула сессий (если ещё не созданы) и прогрев сессий
+        """
+        key = (endpoint, database)
+        loop = asyncio.get_running_loop()
+
+        # драйвер привязан к event loop — если рантайм создал новый loop, старый останавливаем и подключаемся заново
+        shared = cls._shared.get(key)
+        if shared is not None and shared[2] is not loop:
+            del cls._shared[key]
+            await cls._stop(shared[0], shared[1])
+            shared = None
+
+        if shared is not None:
+            return shared[0], shared[1]
+
+        lock_loop, lock = cls._shared_locks.get(key, (None, None))
+        if lock_loop is not loop:
+            lock = asyncio.Lock()
+            cls._shared_locks[key] = (loop, lock)
+
+        async with lock:
+            shared = cls._shared.get(key)
+            if shared is not None:
+                return shared[0], shared[1]
+
+            driver_config = ydb.DriverConfig(
+                endpoint,
+                database,
+                credentials=ydb.iam.MetadataUrlCredentials(), # ydb.AccessTokenCredentials(YDB_TOKEN) #
+                root_certificates=ydb.load_ydb_root_certificate(),
+            )
+
+            driver = ydb.aio.Driver(driver_config)
+
+            try:
+                await driver.wait(timeout=5)
+            except TimeoutError:
+                logger.error("Connect failed to YDB. Last reported errors by discovery: %s",
+                             driver.discovery_debug_details())
+                await driver.stop()
+                raise
+
+            pool = ydb.aio.QuerySessionPool(driver, size=YDB_POOL_SIZE)
+            await cls._warmup(pool, warmup)
+
+            cls._shared[key] = (driver, pool, loop)
+            logger.info("Successfully connected to YDB")
+
+        return driver, pool
+
+    @staticmethod
+    async def _warmup(pool, count: int):
+        """
+        Прогрев: заранее открываем count сессий, чтобы первые запросы не ждали их создания
+        """
+        if count <= 0:
+            return
+
+        sessions = []
+        try:
+            for _ in range(count):
+                sessions.append(await pool.acquire())
+        except Exception as e:
+            logger.warning("⚠️ Ошибка прогрева пула сессий YDB: %s", e)
+        finally:
+            for session in sessions:
+                await pool.release(session)
+
+    @staticmethod
+    async def _stop(driver, pool):
+        """
+        Остановка пула и драйвера. Оставшиеся от старого event loop могут не закрыться чисто —
+        ошибка не мешает подключиться заново
+        """
+        try:
+            await asyncio.wait_for(pool.stop(), timeout=5)
+        except Exception as e:
+            logger.warning("⚠️ Ошибка остановки пула сессий YDB: %s", e)
+
+        try:
+            await asyncio.wait_for(driver.stop(), timeout=5)
+        except Exception as e:
+            logger.warning("⚠️ Ошибка остановки драйвера YDB: %s", e)
+
+    @classmethod
+    async def shutdown(cls):
+        """
+        Корректное закрытие всех общих пулов сессий и драйверов YDB
+        """
+        shared = list(cls._shared.values())
+        cls._shared.clear()
+        cls._shared_locks.clear()
+
+        for driver, pool, _ in shared:
+            await cls._stop(driver, pool)
+            logger.info("YDB connection closed")
+
     def _ensure_connected(self):
         """
         Проверка, что соединение установлено
@@ -117,22 +220,29 @@ class YDBClient:
         Создание таблицы с заданной схемой (если она не существует)
         """
         self._ensure_connected()
-        print(f"\nChecking if table {table_name} exists...")
+        logger.info("Checking if table %s exists...", table_name)
         try:
             await self.pool.execute_with_retries(schema)
-            print(f"Table {table_name} created successfully!")
+            logger.info("Table %s created successfully!", table_name)
         except ydb.GenericError as e:
             if "path exist" in str(e):
-                print(f"Table {table_name} already exists, skipping creation.")
+                logger.info("Table %s already exists, skipping creation.", table_name)
             else:
                 raise e
     
     async def execute_query(self, query: str, params: Optional[Dict[str, Any]] = None):
         """
-        Выполнение произвольного запроса
+        Выполнение произвольного запроса. Время пишется в метрики под именем вызвавшего метода клиента
         """
         self._ensure_connected()
-        return await self.pool.execute_with_retries(query, params)
+
+        name = f"{type(self).__name__}.{sys._getframe(1).f_code.co_name}"
+        try:
+            with YDB_QUERY_SECONDS.time(query=name):
+                return await self.pool.execute_with_retries(query, params)
+        except Exception:
+            ERRORS.inc(stage="ydb")
+            raise
     
     async def clear_all_tables(self):
         """Удаляет все записи во всех таблицах"""
@@ -142,14 +252,17 @@ class YDBClient:
             "users",
             "payments",
             "cache",
+            "results",
+            "jobs",
+            "processed_updates",
         ]
 
         for table in tables:
             try:
                 await self.execute_query(f"DELETE FROM `{table}`;")
-                print(f"Таблица {table} очищена.")
+                logger.info("Таблица %s очищена.", table)
             except Exception as e:
-                print(f"Ошибка при очистке {table}: {e}")
+                logger.error("Ошибка при очистке %s: %s", table, e)
 
 
 # ------------------------------------------------------------ АНКЕТА -----------------------------------------------------------
@@ -174,6 +287,7 @@ class UserClient(YDBClient):
                 `full_name` Utf8,
                 `language_code` Utf8,
                 `free_generate` Bool,
+                `credits` Uint32,
                 `created_at` Uint64,
                 PRIMARY KEY (`telegram_id`)
             )
@@ -182,20 +296,23 @@ class UserClient(YDBClient):
     async def create_users_table(self):
         """Создание таблицы users"""
         await self.create_table(self.table_name, self.table_schema)
+
+    async def migrate_users_table(self):
+        """Добавление колонки credits в таблицу users, созданную по старой схеме"""
+        try:
+            await self.execute_query("ALTER TABLE `users` ADD COLUMN `credits` Uint32;")
+        except ydb.Error as e:
+            logger.info("Пропускаем миграцию users: %s", e)
     
     async def insert_user(self, user: User) -> User:
-        """Вставка или обновление пользователя (UPSERT) и возврат объекта User"""
-
-        existing_user = await self.get_user_by_id(user.telegram_id)
-
-        # Если пользователь уже есть, сохраняем текущее значение free_generate
-        if existing_user is not None:
-            user.free_generate = existing_user.free_generate
-
+        """
+        Вставка или обновление пользователя (UPSERT) и возврат объекта User.
+        Один запрос: у существующего пользователя сохраняются free_generate и created_at
+        """
         if user.created_at is None:
             user.created_at = int(datetime.now(timezone.utc).timestamp())
 
-        await self.execute_query(
+        result = await self.execute_query(
             """
             DECLARE $telegram_id AS Uint64;
             DECLARE $full_name AS Utf8?;
@@ -203,15 +320,28 @@ class UserClient(YDBClient):
             DECLARE $free_generate AS Bool;
             DECLARE $created_at AS Uint64?;
 
+            $user = (
+                SELECT
+                    n.telegram_id AS telegram_id,
+                    $full_name AS full_name,
+                    $language_code AS language_code,
+                    COALESCE(u.free_generate, $free_generate) AS free_generate,
+                    COALESCE(u.created_at, $created_at) AS created_at
+                FROM AS_TABLE([<|telegram_id: $telegram_id|>]) AS n
+                LEFT JOIN users AS u ON u.telegram_id = n.telegram_id
+            );
+
+            SELECT telegram_id, full_name, language_code, free_generate, created_at FROM $user;
+
             UPSERT INTO users (
                 telegram_id, full_name, language_code, free_generate, created_at
-            ) VALUES (
-                $telegram_id, $full_name, $language_code, $free_generate, $created_at
-            );
+            )
+            SELECT telegram_id, full_name, language_code, free_generate, created_at FROM $user;
             """,
             self._to_params(user)
         )
-        return await self.get_user_by_id(user.telegram_id)
+
+        return self._row_to_user(result[0].rows[0])
 
     async def get_user_by_id(self, telegram_id: int) -> Optional[User]:
         """Получение пользователя по telegram_id"""
@@ -247,6 +377,46 @@ class UserClient(YDBClient):
 
         await self.execute_query(query, params)
 
+    async def add_credits(self, telegram_id: int, count: int):
+        """Зачислить count генераций (credits): возврат за оплаченные фото, которые не удалось восстановить"""
+        await self.execute_query(
+            """
+            DECLARE $telegram_id AS Uint64;
+            DECLARE $count AS Uint32;
+
+            UPDATE users SET credits = COALESCE(credits, 0u) + $count
+            WHERE telegram_id = $telegram_id;
+            """,
+            {"$telegram_id": (telegram_id, ydb.PrimitiveType.Uint64),
+             "$count": (count, ydb.PrimitiveType.Uint32)}
+        )
+
+    async def take_free_generate(self, telegram_id: int) -> bool:
+        """
+        Списать бесплатную генерацию, а если её нет — зачисленную (credits), условным UPDATE
+        (их меняют и другие процессы).
+        True — генерация была и списана этим вызовом; из параллельных вызовов её получит только один
+        """
+        result = await self.execute_query(
+            """
+            DECLARE $telegram_id AS Uint64;
+
+            $taken = (
+                SELECT COUNT(*) FROM users
+                WHERE telegram_id = $telegram_id AND (free_generate OR credits > 0u)
+            );
+
+            SELECT $taken > 0 AS taken;
+
+            UPDATE users
+            SET free_generate = false, credits = IF(free_generate, credits, credits - 1u)
+            WHERE telegram_id = $telegram_id AND (free_generate OR credits > 0u);
+            """,
+            {"$telegram_id": (telegram_id, ydb.PrimitiveType.Uint64)}
+        )
+
+        return result[0].rows[0]["taken"]
+
     async def delete_user(self, telegram_id: int) -> None:
         """Удаление пользователя"""
         await self.execute_query(
@@ -285,20 +455,25 @@ class Cache:
     photo_message_id: Optional[int] = None
     file_id: Optional[str] = None
     pay_message_id: Optional[int] = None
+    created_at: Optional[int] = None  # Храним как timestamp (секунды с эпохи)
 
 
 class CacheClient(YDBClient):
     def __init__(self, endpoint: str = YDB_ENDPOINT, database: str = YDB_PATH, token: str = YDB_TOKEN):
         super().__init__(endpoint, database, token)
         self.table_name = "cache"
-        self.table_schema = """
+        # неоплаченные счета удаляет TTL; свипер (cache_sweeper.py) успевает раньше и удаляет ещё и сообщения со счётом
+        self.table_schema = f"""
             CREATE TABLE `cache` (
                 `telegram_id` Uint64 NOT NULL,
                 `photo_message_id` Int32,
                 `file_id` Utf8,
                 `pay_message_id` Int32,
-                PRIMARY KEY (`telegram_id`, `photo_message_id`)
+                `created_at` Uint64,
+                PRIMARY KEY (`telegram_id`, `photo_message_id`),
+                INDEX `idx_created_at` GLOBAL ON (`created_at`)
             )
+            WITH (TTL = Interval("PT{CACHE_TTL}S") ON `created_at` AS SECONDS)
         """
         
     async def create_cache_table(self):
@@ -306,24 +481,96 @@ class CacheClient(YDBClient):
         Создание таблицы cache
         """
         await self.create_table(self.table_name, self.table_schema)
+
+    async def migrate_cache_table(self):
+        """
+        Добавление created_at, индекса и TTL в таблицу cache, созданную по старой схеме.
+        Старым записям проставляется текущее время — они истекут через CACHE_TTL
+        """
+        statements = [
+            "ALTER TABLE `cache` ADD COLUMN `created_at` Uint64;",
+            "ALTER TABLE `cache` ADD INDEX `idx_created_at` GLOBAL ON (`created_at`);",
+            f'ALTER TABLE `cache` SET (TTL = Interval("PT{CACHE_TTL}S") ON `created_at` AS SECONDS);',
+        ]
+        for statement in statements:
+            try:
+                await self.execute_query(statement)
+            except ydb.Error as e:
+                logger.info("Пропускаем миграцию cache (%s): %s", statement, e)
+
+        await self.execute_query(
+            """
+            DECLARE $now AS Uint64;
+            UPDATE cache SET created_at = $now WHERE created_at IS NULL;
+            """,
+            {"$now": (int(datetime.now(timezone.utc).timestamp()), ydb.PrimitiveType.Uint64)}
+        )
     
     async def insert_cache(self, cache: Cache) -> Cache:
         """
         Вставка записи в кэш
         """
+        if cache.created_at is None:
+            cache.created_at = int(datetime.now(timezone.utc).timestamp())
+
         await self.execute_query(
             """
             DECLARE $telegram_id AS Uint64;
             DECLARE $photo_message_id AS Int32?;
             DECLARE $file_id AS Utf8?;
             DECLARE $pay_message_id AS Int32?;
+            DECLARE $created_at AS Uint64?;
 
-            UPSERT INTO cache (telegram_id, photo_message_id, file_id, pay_message_id)
-            VALUES ($telegram_id, $photo_message_id, $file_id, $pay_message_id);
+            UPSERT INTO cache (telegram_id, photo_message_id, file_id, pay_message_id, created_at)
+            VALUES ($telegram_id, $photo_message_id, $file_id, $pay_message_id, $created_at);
             """,
             self._to_params(cache)
         )
 
+    async def insert_cache_batch(self, caches: list[Cache]) -> None:
+        """
+        Вставка пачки записей кэша одним запросом (фото альбома под одним счётом)
+        """
+        if not caches:
+            return
+
+        now = int(datetime.now(timezone.utc).timestamp())
+        for cache in caches:
+            if cache.created_at is None:
+                cache.created_at = now
+
+        row_type = ydb.StructType()
+        row_type.add_member("telegram_id", ydb.PrimitiveType.Uint64)
+        row_type.add_member("photo_message_id", ydb.OptionalType(ydb.PrimitiveType.Int32))
+        row_type.add_member("file_id", ydb.OptionalType(ydb.PrimitiveType.Utf8))
+        row_type.add_member("pay_message_id", ydb.OptionalType(ydb.PrimitiveType.Int32))
+        row_type.add_member("created_at", ydb.OptionalType(ydb.PrimitiveType.Uint64))
+
+        await self.execute_query(
+            """
+            DECLARE $rows AS List<Struct<telegram_id: Uint64, photo_message_id: Int32?, file_id: Utf8?,
+                                         pay_message_id: Int32?, created_at: Uint64?>>;
+
+            UPSERT INTO cache (telegram_id, photo_message_id, file_id, pay_message_id, created_at)
+            SELECT telegram_id, photo_message_id, file_id, pay_message_id, created_at FROM AS_TABLE($rows);
+            """,
+            {
+                "$rows": (
+                    [
+                        {
+                            "telegram_id": c.telegram_id,
+                            "photo_message_id": c.photo_message_id,
+                            "file_id": c.file_id,
+                            "pay_message_id": c.pay_message_id,
+                            "created_at": c.created_at,
+                        }
+                        for c in caches
+                    ],
+                    ydb.ListType(row_type),
+                )
+            }
+        )
+
     async def get_cache_by_telegram_id(self, telegram_id: int) -> dict[int, dict[str, str]]:
         """
         Получение всех записей кэша для пользователя в виде словаря:
@@ -349,6 +596,100 @@ class CacheClient(YDBClient):
             } for row in rows
             }
 
+    async def get_cache(self, telegram_id: int, photo_message_id: int) -> Optional[Cache]:
+        """
+        Точечное чтение записи кэша по первичному ключу (telegram_id, photo_message_id)
+        """
+        result = await self.execute_query(
+            """
+            DECLARE $telegram_id AS Uint64;
+            DECLARE $photo_message_id AS Int32;
+
+            SELECT telegram_id, photo_message_id, file_id, pay_message_id
+            FROM cache
+            WHERE telegram_id = $telegram_id AND photo_message_id = $photo_message_id;
+            """,
+            self._key_params(telegram_id, photo_message_id)
+        )
+
+        rows = result[0].rows
+        if not rows:
+            return None
+
+        return self._row_to_cache(rows[0])
+
+    async def take_cache(self, telegram_id: int, photo_message_id: int) -> Optional[Cache]:
+        """
+        Чтение и удаление записи кэша одним запросом (в одной транзакции).
+        Из параллельных вызовов запись получит только один
+        """
+        result = await self.execute_query(
+            """
+            DECLARE $telegram_id AS Uint64;
+            DECLARE $photo_message_id AS Int32;
+
+            SELECT telegram_id, photo_message_id, file_id, pay_message_id
+            FROM cache
+            WHERE telegram_id = $telegram_id AND photo_message_id = $photo_message_id;
+
+            DELETE FROM cache WHERE telegram_id = $telegram_id AND photo_message_id = $photo_message_id;
+            """,
+            self._key_params(telegram_id, photo_message_id)
+        )
+
+        rows = result[0].rows
+        if not rows:
+            return None
+
+        return self._row_to_cache(rows[0])
+
+    async def get_expired_cache(self, created_before: int, limit: int) -> list[Cache]:
+        """
+        Самые старые записи кэша, созданные раньше created_before (не больше limit штук)
+        """
+        result = await self.execute_query(
+            """
+            DECLARE $created_before AS Uint64;
+            DECLARE $limit AS Uint64;
+
+            SELECT telegram_id, photo_message_id, file_id, pay_message_id, created_at
+            FROM cache VIEW idx_created_at
+            WHERE created_at < $created_before
+            ORDER BY created_at
+            LIMIT $limit;
+            """,
+            {
+                "$created_before": (created_before, ydb.PrimitiveType.Uint64),
+                "$limit": (limit, ydb.PrimitiveType.Uint64),
+            }
+        )
+
+        return [self._row_to_cache(row) for row in result[0].rows]
+
+    async def delete_cache_batch(self, caches: list[Cache]) -> None:
+        """
+        Удаление пачки записей кэша по первичным ключам одним запросом
+        """
+        if not caches:
+            return
+
+        key_type = ydb.StructType()
+        key_type.add_member("telegram_id", ydb.PrimitiveType.Uint64)
+        key_type.add_member("photo_message_id", ydb.PrimitiveType.Int32)
+
+        await self.execute_query(
+            """
+            DECLARE $keys AS List<Struct<telegram_id: Uint64, photo_message_id: Int32>>;
+            DELETE FROM cache ON SELECT telegram_id, photo_message_id FROM AS_TABLE($keys);
+            """,
+            {
+                "$keys": (
+                    [{"telegram_id": c.telegram_id, "photo_message_id": c.photo_message_id} for c in caches],
+                    ydb.ListType(key_type),
+                )
+            }
+        )
+
     async def delete_cache_by_telegram_id(self, telegram_id: int) -> None:
         """
         Удаление всех записей кэша для пользователя
@@ -372,10 +713,7 @@ class CacheClient(YDBClient):
             
             DELETE FROM cache WHERE telegram_id = $telegram_id AND photo_message_id = $photo_message_id;
             """,
-            {
-                "$telegram_id": (telegram_id, ydb.PrimitiveType.Uint64),
-                "$photo_message_id": (photo_message_id, ydb.PrimitiveType.Int32)
-            }
+            self._key_params(telegram_id, photo_message_id)
         )
 
     # --- helpers ---
@@ -384,15 +722,23 @@ class CacheClient(YDBClient):
             telegram_id=row["telegram_id"],
             photo_message_id=row.get("photo_message_id"),
             file_id=row.get("file_id"),
-            pay_message_id=row.get("pay_message_id")
+            pay_message_id=row.get("pay_message_id"),
+            created_at=row.get("created_at")
         )
 
+    def _key_params(self, telegram_id: int, photo_message_id: int) -> dict:
+        return {
+            "$telegram_id": (telegram_id, ydb.PrimitiveType.Uint64),
+            "$photo_message_id": (photo_message_id, ydb.PrimitiveType.Int32),
+        }
+
     def _to_params(self, cache: Cache) -> dict:
         return {
             "$telegram_id": (cache.telegram_id, ydb.PrimitiveType.Uint64),
             "$photo_message_id": (cache.photo_message_id, ydb.OptionalType(ydb.PrimitiveType.Int32)),
             "$file_id": (cache.file_id, ydb.OptionalType(ydb.PrimitiveType.Utf8)),
             "$pay_message_id": (cache.pay_message_id, ydb.OptionalType(ydb.PrimitiveType.Int32)),
+            "$created_at": (cache.created_at, ydb.OptionalType(ydb.PrimitiveType.Uint64)),
         }
 
 
@@ -408,6 +754,14 @@ class Payment:
     created_at: Optional[int] = None  # Храним как timestamp (секунды с эпохи)
 
 
+@dataclass
+class Settlement:
+    file_id: Optional[str] = None  # None — записи в cache не нашлось
+    pay_message_id: Optional[int] = None
+    already_settled: bool = False  # платёж уже был проведён раньше (повторная доставка)
+    album_file_ids: dict[int, str] = field(default_factory=dict)  # альбом: photo_message_id -> file_id
+
+
 class PaymentClient(YDBClient):
     def __init__(self, endpoint: str = YDB_ENDPOINT, database: str = YDB_PATH, token: str = YDB_TOKEN):
         super().__init__(endpoint, database, token)
@@ -451,6 +805,98 @@ class PaymentClient(YDBClient):
             self._to_params(payment)
         )
 
+    async def settle_payment(self, payment: Payment) -> Settlement:
+        """
+        Проведение оплаты одной транзакцией и одним запросом: запись платежа и чтение соответствующей записи cache.
+        Повторная доставка того же платежа ничего не меняет и возвращает already_settled=True.
+        Запись cache удаляется только после постановки задачи — пока она есть, повторная доставка
+        платежа поставит задачу снова
+        """
+        if payment.created_at is None:
+            payment.created_at = int(datetime.now(timezone.utc).timestamp())
+
+        result = await self.execute_query(
+            """
+            DECLARE $telegram_id AS Uint64;
+            DECLARE $message_id AS Int32;
+            DECLARE $amount AS Uint16;
+            DECLARE $type AS Utf8;
+            DECLARE $created_at AS Uint64;
+
+            $settled = (
+                SELECT COUNT(*) FROM payments
+                WHERE telegram_id = $telegram_id AND message_id = $message_id
+            );
+
+            SELECT file_id, pay_message_id
+            FROM cache
+            WHERE telegram_id = $telegram_id AND photo_message_id = $message_id;
+
+            SELECT $settled > 0 AS already_settled;
+
+            INSERT INTO payments (telegram_id, message_id, amount, type, created_at)
+            SELECT telegram_id, message_id, amount, type, created_at
+            FROM AS_TABLE([<|telegram_id: $telegram_id, message_id: $message_id, amount: $amount,
+                             type: $type, created_at: $created_at|>])
+            WHERE $settled = 0;
+            """,
+            self._to_params(payment)
+        )
+
+        cache_rows = result[0].rows
+        return Settlement(
+            file_id=cache_rows[0].get("file_id") if cache_rows else None,
+            pay_message_id=cache_rows[0].get("pay_message_id") if cache_rows else None,
+            already_settled=result[1].rows[0]["already_settled"],
+        )
+
+    async def settle_album_payment(self, payment: Payment, message_ids: list[int]) -> Settlement:
+        """
+        Проведение оплаты альбома: как settle_payment, но записи cache читаются
+        по всем фото альбома. Платёж записывается на payment.message_id (первое фото)
+        """
+        if payment.created_at is None:
+            payment.created_at = int(datetime.now(timezone.utc).timestamp())
+
+        params = self._to_params(payment)
+        params["$message_ids"] = (message_ids, ydb.ListType(ydb.PrimitiveType.Int32))
+
+        result = await self.execute_query(
+            """
+            DECLARE $telegram_id AS Uint64;
+            DECLARE $message_id AS Int32;
+            DECLARE $message_ids AS List<Int32>;
+            DECLARE $amount AS Uint16;
+            DECLARE $type AS Utf8;
+            DECLARE $created_at AS Uint64;
+
+            $settled = (
+                SELECT COUNT(*) FROM payments
+                WHERE telegram_id = $telegram_id AND message_id = $message_id
+            );
+
+            SELECT photo_message_id, file_id, pay_message_id
+            FROM cache
+            WHERE telegram_id = $telegram_id AND photo_message_id IN $message_ids;
+
+            SELECT $settled > 0 AS already_settled;
+
+            INSERT INTO payments (telegram_id, message_id, amount, type, created_at)
+            SELECT telegram_id, message_id, amount, type, created_at
+            FROM AS_TABLE([<|telegram_id: $telegram_id, message_id: $message_id, amount: $amount,
+                             type: $type, created_at: $created_at|>])
+            WHERE $settled = 0;
+            """,
+            params
+        )
+
+        cache_rows = result[0].rows
+        return Settlement(
+            pay_message_id=cache_rows[0].get("pay_message_id") if cache_rows else None,
+            already_settled=result[1].rows[0]["already_settled"],
+            album_file_ids={row["photo_message_id"]: row.get("file_id") for row in cache_rows},
+        )
+
     async def delete_payment_by_telegram_and_message_id(self, telegram_id: int, message_id: int) -> None:
         """
         Удаление записи кэша по telegram_id и message_id
@@ -497,6 +943,494 @@ class PaymentClient(YDBClient):
         }
 
 
+# ------------------------------------------------------- РЕЗУЛЬТАТЫ ГЕНЕРАЦИЙ ----------------------------------------------------
+
+
+@dataclass
+class Result:
+    key: str
+    image: bytes
+    created_at: Optional[int] = None  # Храним как timestamp (секунды с эпохи)
+
+
+class ResultClient(YDBClient):
+    # предел размера значения String в YDB — 8 МБ, берём с запасом
+    MAX_IMAGE_SIZE = 7 * 1024 * 1024
+
+    def __init__(self, endpoint: str = YDB_ENDPOINT, database: str = YDB_PATH, token: str = YDB_TOKEN):
+        super().__init__(endpoint, database, token)
+        self.table_name = "results"
+        self.table_schema = f"""
+            CREATE TABLE `results` (
+                `key` Utf8 NOT NULL,
+                `image` String,
+                `created_at` Uint64,
+                PRIMARY KEY (`key`)
+            )
+            WITH (TTL = Interval("PT{RESULT_CACHE_TTL}S") ON `created_at` AS SECONDS)
+        """
+
+    async def create_results_table(self):
+        """
+        Создание таблицы results (старые записи удаляет TTL самой YDB)
+        """
+        await self.create_table(self.table_name, self.table_schema)
+
+    async def insert_result(self, result: Result) -> None:
+        """
+        Сохранение результата генерации по ключу
+        """
+        if len(result.image) > self.MAX_IMAGE_SIZE:
+            return
+
+        if result.created_at is None:
+            result.created_at = int(datetime.now(timezone.utc).timestamp())
+
+        await self.execute_query(
+            """
+            DECLARE $key AS Utf8;
+            DECLARE $image AS String;
+            DECLARE $created_at AS Uint64;
+
+            UPSERT INTO results (key, image, created_at)
+            VALUES ($key, $image, $created_at);
+            """,
+            self._to_params(result)
+        )
+
+    async def get_result_by_key(self, key: str) -> Optional[Result]:
+        """
+        Получение результата генерации по ключу
+        """
+        result = await self.execute_query(
+            """
+            DECLARE $key AS Utf8;
+            SELECT key, image, created_at FROM results WHERE key = $key;
+            """,
+            {"$key": (key, ydb.PrimitiveType.Utf8)}
+        )
+
+        rows = result[0].rows
+        if not rows:
+            return None
+
+        return self._row_to_result(rows[0])
+
+    async def delete_result_by_key(self, key: str) -> None:
+        """
+        Удаление результата генерации по ключу
+        """
+        await self.execute_query(
+            """
+            DECLARE $key AS Utf8;
+            DELETE FROM results WHERE key = $key;
+            """,
+            {"$key": (key, ydb.PrimitiveType.Utf8)}
+        )
+
+    # --- helpers ---
+    def _row_to_result(self, row) -> Result:
+        return Result(
+            key=row["key"],
+            image=row["image"],
+            created_at=row.get("created_at"),
+        )
+
+    def _to_params(self, result: Result) -> dict:
+        return {
+            "$key": (result.key, ydb.PrimitiveType.Utf8),
+            "$image": (result.image, ydb.PrimitiveType.String),
+            "$created_at": (result.created_at, ydb.PrimitiveType.Uint64),
+        }
+
+
+# ------------------------------------------------------- ЗАДАЧИ РЕСТАВРАЦИИ ----------------------------------------------------
+
+
+@dataclass
+class Job:
+    job_id: str
+    telegram_id: int
+    reply_to_message_id: int
+    file_id: Optional[str]
+    file_type: str
+    file_unique_id: Optional[str] = None
+    caption: Optional[str] = None
+    language_code: Optional[str] = None
+    notif_message_id: Optional[int] = None
+    paid: bool = False
+    album: Optional[list[dict]] = None  # альбом: [{"message_id", "file_id", "file_unique_id"}, ...]
+    charge_id: Optional[str] = None  # telegram_payment_charge_id оплаты Stars — для возврата
+    status: str = JobStatus.QUEUED.value
+    attempts: int = 0
+    created_at: Optional[int] = None  # Храним как timestamp (секунды с эпохи)
+    updated_at: Optional[int] = None
+
+
+class JobClient(YDBClient):
+    _columns = ("job_id, telegram_id, reply_to_message_id, file_id, file_type, file_unique_id, caption, "
+                "language_code, notif_message_id, paid, album, charge_id, status, attempts, created_at, updated_at")
+
+    def __init__(self, endpoint: str = YDB_ENDPOINT, database: str = YDB_PATH, token: str = YDB_TOKEN):
+        super().__init__(endpoint, database, token)
+        self.table_name = "jobs"
+        self.table_schema = f"""
+            CREATE TABLE `jobs` (
+                `job_id` Utf8 NOT NULL,
+                `telegram_id` Uint64 NOT NULL,
+                `reply_to_message_id` Int32,
+                `file_id` Utf8,
+                `file_type` Utf8,
+                `file_unique_id` Utf8,
+                `caption` Utf8,
+                `language_code` Utf8,
+                `notif_message_id` Int32,
+                `paid` Bool,
+                `album` Utf8,
+                `charge_id` Utf8,
+                `status` Utf8,
+                `attempts` Uint32,
+                `created_at` Uint64,
+                `updated_at` Uint64,
+                PRIMARY KEY (`job_id`),
+                INDEX `idx_status` GLOBAL ON (`status`, `created_at`)
+            )
+            WITH (TTL = Interval("PT{JOB_TTL}S") ON `created_at` AS SECONDS)
+        """
+
+    async def create_jobs_table(self):
+        """
+        Создание таблицы jobs
+        """
+        await self.create_table(self.table_name, self.table_schema)
+
+    async def migrate_jobs_table(self):
+        """
+        Добавление колонок album и charge_id в таблицу jobs, созданную по старой схеме
+        """
+        statements = [
+            "ALTER TABLE `jobs` ADD COLUMN `album` Utf8;",
+            "ALTER TABLE `jobs` ADD COLUMN `charge_id` Utf8;",
+        ]
+        for statement in statements:
+            try:
+                await self.execute_query(statement)
+            except ydb.Error as e:
+                logger.info("Пропускаем миграцию jobs (%s): %s", statement, e)
+
+    async def insert_job(self, job: Job) -> None:
+        """
+        Постановка задачи в очередь
+        """
+        now = int(datetime.now(timezone.utc).timestamp())
+        job.created_at = job.created_at or now
+        job.updated_at = now
+
+        await self.execute_query(
+            f"""
+            DECLARE $job_id AS Utf8;
+            DECLARE $telegram_id AS Uint64;
+            DECLARE $reply_to_message_id AS Int32;
+            DECLARE $file_id AS Utf8?;
+            DECLARE $file_type AS Utf8;
+            DECLARE $file_unique_id AS Utf8?;
+            DECLARE $caption AS Utf8?;
+            DECLARE $language_code AS Utf8?;
+            DECLARE $notif_message_id AS Int32?;
+            DECLARE $paid AS Bool;
+            DECLARE $album AS Utf8?;
+            DECLARE $charge_id AS Utf8?;
+            DECLARE $status AS Utf8;
+            DECLARE $attempts AS Uint32;
+            DECLARE $created_at AS Uint64;
+            DECLARE $updated_at AS Uint64;
+
+            UPSERT INTO jobs ({self._columns})
+            VALUES ($job_id, $telegram_id, $reply_to_message_id, $file_id, $file_type, $file_unique_id, $caption,
+                    $language_code, $notif_message_id, $paid, $album, $charge_id, $status, $attempts, $created_at,
+                    $updated_at);
+            """,
+            self._to_params(job)
+        )
+
+    async def insert_job_once(self, job: Job) -> bool:
+        """
+        Постановка задачи, только если задачи с таким job_id ещё нет (одним запросом).
+        False — задача уже была поставлена раньше
+        """
+        now = int(datetime.now(timezone.utc).timestamp())
+        job.created_at = job.created_at or now
+        job.updated_at = now
+
+        result = await self.execute_query(
+            f"""
+            DECLARE $job_id AS Utf8;
+            DECLARE $telegram_id AS Uint64;
+            DECLARE $reply_to_message_id AS Int32;
+            DECLARE $file_id AS Utf8?;
+            DECLARE $file_type AS Utf8;
+            DECLARE $file_unique_id AS Utf8?;
+            DECLARE $caption AS Utf8?;
+            DECLARE $language_code AS Utf8?;
+            DECLARE $notif_message_id AS Int32?;
+            DECLARE $paid AS Bool;
+            DECLARE $album AS Utf8?;
+            DECLARE $charge_id AS Utf8?;
+            DECLARE $status AS Utf8;
+            DECLARE $attempts AS Uint32;
+            DECLARE $created_at AS Uint64;
+            DECLARE $updated_at AS Uint64;
+
+            $exists = (SELECT COUNT(*) FROM jobs WHERE job_id = $job_id);
+
+            SELECT $exists > 0 AS exists;
+
+            UPSERT INTO jobs ({self._columns})
+            SELECT {self._columns}
+            FROM AS_TABLE([<|job_id: $job_id, telegram_id: $telegram_id, reply_to_message_id: $reply_to_message_id,
+                             file_id: $file_id, file_type: $file_type, file_unique_id: $file_unique_id,
+                             caption: $caption, language_code: $language_code, notif_message_id: $notif_message_id,
+                             paid: $paid, album: $album, charge_id: $charge_id, status: $status, attempts: $attempts,
+                             created_at: $created_at, updated_at: $updated_at|>])
+            WHERE $exists = 0;
+            """,
+            self._to_params(job)
+        )
+
+        return not result[0].rows[0]["exists"]
+
+    async def claim_job(self, lease: int = JOB_LEASE) -> Optional[Job]:
+        """
+        Взять самую старую задачу из очереди: чтение и перевод в running одной транзакцией.
+        Два воркера одну задачу не получат — конфликтующая транзакция перезапускается и берёт следующую.
+        Задача в running, которую не продлевали lease секунд (воркер упал), берётся так же, как новая
+        """
+        now = int(datetime.now(timezone.utc).timestamp())
+        result = await self.execute_query(
+            f"""
+            DECLARE $now AS Uint64;
+            DECLARE $stale_before AS Uint64;
+
+            $queued = SELECT job_id, created_at FROM jobs VIEW idx_status
+                WHERE status = "{JobStatus.QUEUED.value}"
+                ORDER BY created_at
+                LIMIT 1;
+
+            $stale = SELECT job_id, created_at FROM jobs VIEW idx_status
+                WHERE status = "{JobStatus.RUNNING.value}" AND updated_at < $stale_before
+                ORDER BY created_at
+                LIMIT 1;
+
+            $next = (
+                SELECT job_id FROM (SELECT * FROM $queued UNION ALL SELECT * FROM $stale)
+                ORDER BY created_at
+                LIMIT 1
+            );
+
+            SELECT {self._columns} FROM jobs WHERE job_id = $next;
+
+            UPDATE jobs
+            SET status = "{JobStatus.RUNNING.value}", attempts = attempts + 1, updated_at = $now
+            WHERE job_id = $next;
+            """,
+            {
+                "$now": (now, ydb.PrimitiveType.Uint64),
+                "$stale_before": (max(0, now - lease), ydb.PrimitiveType.Uint64),
+            }
+        )
+
+        rows = result[0].rows
+        if not rows:
+            return None
+
+        job = self._row_to_job(rows[0])
+        job.status = JobStatus.RUNNING.value
+        job.attempts += 1
+        return job
+
+    async def update_job_status(self, job_id: str, status: JobStatus) -> None:
+        """
+        Обновление статуса задачи
+        """
+        await self.execute_query(
+            """
+            DECLARE $job_id AS Utf8;
+            DECLARE $status AS Utf8;
+            DECLARE $updated_at AS Uint64;
+
+            UPDATE jobs SET status = $status, updated_at = $updated_at WHERE job_id = $job_id;
+            """,
+            {
+                "$job_id": (job_id, ydb.PrimitiveType.Utf8),
+                "$status": (status.value, ydb.PrimitiveType.Utf8),
+                "$updated_at": (int(datetime.now(timezone.utc).timestamp()), ydb.PrimitiveType.Uint64),
+            }
+        )
+
+    async def touch_job(self, job_id: str) -> None:
+        """
+        Продление аренды задачи: воркер ещё работает над ней
+        """
+        await self.execute_query(
+            f"""
+            DECLARE $job_id AS Utf8;
+            DECLARE $updated_at AS Uint64;
+
+            UPDATE jobs SET updated_at = $updated_at
+            WHERE job_id = $job_id AND status = "{JobStatus.RUNNING.value}";
+            """,
+            {
+                "$job_id": (job_id, ydb.PrimitiveType.Utf8),
+                "$updated_at": (int(datetime.now(timezone.utc).timestamp()), ydb.PrimitiveType.Uint64),
+            }
+        )
+
+    async def get_job_by_id(self, job_id: str) -> Optional[Job]:
+        """
+        Получение задачи по job_id
+        """
+        result = await self.execute_query(
+            f"""
+            DECLARE $job_id AS Utf8;
+            SELECT {self._columns} FROM jobs WHERE job_id = $job_id;
+            """,
+            {"$job_id": (job_id, ydb.PrimitiveType.Utf8)}
+        )
+
+        rows = result[0].rows
+        if not rows:
+            return None
+
+        return self._row_to_job(rows[0])
+
+    # --- helpers ---
+    def _row_to_job(self, row) -> Job:
+        return Job(
+            job_id=row["job_id"],
+            telegram_id=row["telegram_id"],
+            reply_to_message_id=row.get("reply_to_message_id"),
+            file_id=row.get("file_id"),
+            file_type=row.get("file_type"),
+            file_unique_id=row.get("file_unique_id"),
+            caption=row.get("caption"),
+            language_code=row.get("language_code"),
+            notif_message_id=row.get("notif_message_id"),
+            paid=row.get("paid"),
+            album=json.loads(row["album"]) if row.get("album") else None,
+            charge_id=row.get("charge_id"),
+            status=row.get("status"),
+            attempts=row.get("attempts"),
+            created_at=row.get("created_at"),
+            updated_at=row.get("updated_at"),
+        )
+
+    def _to_params(self, job: Job) -> dict:
+        return {
+            "$job_id": (job.job_id, ydb.PrimitiveType.Utf8),
+            "$telegram_id": (job.telegram_id, ydb.PrimitiveType.Uint64),
+            "$reply_to_message_id": (job.reply_to_message_id, ydb.PrimitiveType.Int32),
+            "$file_id": (job.file_id, ydb.OptionalType(ydb.PrimitiveType.Utf8)),
+            "$file_type": (job.file_type, ydb.PrimitiveType.Utf8),
+            "$file_unique_id": (job.file_unique_id, ydb.OptionalType(ydb.PrimitiveType.Utf8)),
+            "$caption": (job.caption, ydb.OptionalType(ydb.PrimitiveType.Utf8)),
+            "$language_code": (job.language_code, ydb.OptionalType(ydb.PrimitiveType.Utf8)),
+            "$notif_message_id": (job.notif_message_id, ydb.OptionalType(ydb.PrimitiveType.Int32)),
+            "$paid": (job.paid, ydb.PrimitiveType.Bool),
+            "$album": (json.dumps(job.album) if job.album else None, ydb.OptionalType(ydb.PrimitiveType.Utf8)),
+            "$charge_id": (job.charge_id, ydb.OptionalType(ydb.PrimitiveType.Utf8)),
+            "$status": (job.status, ydb.PrimitiveType.Utf8),
+            "$attempts": (job.attempts, ydb.PrimitiveType.Uint32),
+            "$created_at": (job.created_at, ydb.PrimitiveType.Uint64),
+            "$updated_at": (job.updated_at, ydb.PrimitiveType.Uint64),
+        }
+
+
+# ------------------------------------------------------ ОБРАБОТАННЫЕ АПДЕЙТЫ ----------------------------------------------------
+
+
+class ProcessedUpdateClient(YDBClient):
+    def __init__(self, endpoint: str = YDB_ENDPOINT, database: str = YDB_PATH, token: str = YDB_TOKEN):
+        super().__init__(endpoint, database, token)
+        self.table_name = "processed_updates"
+        # повторы приходят в пределах суток (Telegram хранит апдейты 24 ч) — дальше строки удаляет TTL
+        self.table_schema = f"""
+            CREATE TABLE `processed_updates` (
+                `update_id` Uint64 NOT NULL,
+                `created_at` Uint64,
+                `done` Bool,
+                PRIMARY KEY (`update_id`)
+            )
+            WITH (TTL = Interval("PT{DEDUP_TTL}S") ON `created_at` AS SECONDS)
+        """
+
+    async def create_processed_updates_table(self):
+        """
+        Создание таблицы processed_updates
+        """
+        await self.create_table(self.table_name, self.table_schema)
+
+    async def claim_updates(self, update_ids: list[int], lease: int) -> tuple[set[int], set[int]]:
+        """
+        Взять апдейты в обработку одной транзакцией. Возвращает уже занятые update_id двумя множествами:
+        (обработанные, взятые другим вызовом меньше lease секунд назад). Остальные записываются как взятые
+        """
+        now = int(datetime.now(timezone.utc).timestamp())
+        result = await self.execute_query(
+            """
+            DECLARE $ids AS List<Struct<update_id: Uint64>>;
+            DECLARE $now AS Uint64;
+            DECLARE $lease_before AS Uint64;
+
+            $taken = (
+                SELECT p.update_id AS update_id, p.done AS done
+                FROM processed_updates AS p
+                JOIN AS_TABLE($ids) AS n ON p.update_id = n.update_id
+                WHERE p.done OR p.created_at >= $lease_before
+            );
+
+            SELECT update_id, done FROM $taken;
+
+            UPSERT INTO processed_updates (update_id, created_at, done)
+            SELECT n.update_id AS update_id, $now AS created_at, false AS done
+            FROM AS_TABLE($ids) AS n
+            LEFT ONLY JOIN $taken AS t ON t.update_id = n.update_id;
+            """,
+            {
+                "$ids": self._ids_param(update_ids),
+                "$now": (now, ydb.PrimitiveType.Uint64),
+                "$lease_before": (max(0, now - lease), ydb.PrimitiveType.Uint64),
+            }
+        )
+
+        rows = result[0].rows
+        return ({row["update_id"] for row in rows if row["done"]},
+                {row["update_id"] for row in rows if not row["done"]})
+
+    async def finish_updates(self, done_ids: list[int], failed_ids: list[int]) -> None:
+        """
+        Отметить обработанные апдейты и освободить апдейты с ошибкой (их доставят повторно) одним запросом
+        """
+        await self.execute_query(
+            """
+            DECLARE $done AS List<Struct<update_id: Uint64>>;
+            DECLARE $failed AS List<Struct<update_id: Uint64>>;
+
+            UPDATE processed_updates ON SELECT update_id, true AS done FROM AS_TABLE($done);
+            DELETE FROM processed_updates ON SELECT update_id FROM AS_TABLE($failed);
+            """,
+            {
+                "$done": self._ids_param(done_ids),
+                "$failed": self._ids_param(failed_ids),
+            }
+        )
+
+    # --- helpers ---
+    def _ids_param(self, update_ids: list[int]) -> tuple:
+        id_type = ydb.StructType()
+        id_type.add_member("update_id", ydb.PrimitiveType.Uint64)
+        return [{"update_id": update_id} for update_id in update_ids], ydb.ListType(id_type)
+
+
 # --------------------------------------------------------- СОЗДАНИЕ ТАБЛИЦ -------------------------------------------------------
 
 
@@ -504,15 +1438,52 @@ async def create_tables_on_ydb():
     # Создание всех таблиц в базе
     async with UserClient() as client:
         await client.create_users_table()
-        print("Table 'USERS' created successfully!")
+        logger.info("Table 'USERS' created successfully!")
 
     async with CacheClient() as client:
         await client.create_cache_table()
-        print("Table 'CACHE' created successfully!")
+        logger.info("Table 'CACHE' created successfully!")
 
     async with PaymentClient() as client:
         await client.create_payments_table()
-        print("Table 'PAYMENTS' created successfully!")
+        logger.info("Table 'PAYMENTS' created successfully!")
+
+    async with ResultClient() as client:
+        await client.create_results_table()
+        logger.info("Table 'RESULTS' created successfully!")
+
+    async with JobClient() as client:
+        await client.create_jobs_table()
+        logger.info("Table 'JOBS' created successfully!")
+
+    async with ProcessedUpdateClient() as client:
+        await client.create_processed_updates_table()
+        logger.info("Table 'PROCESSED_UPDATES' created successfully!")
+
+    await YDBClient.shutdown()
+
+
+# ------------------------------------------------------- МИГРАЦИЯ ТАБЛИЦ -------------------------------------------------------
+
+
+async def migrate_tables_on_ydb():
+    # Приведение существующей базы к текущей схеме: недостающие таблицы создаются,
+    # в таблицы старой схемы добавляются новые колонки, индексы и TTL (повторный запуск безопасен)
+    await create_tables_on_ydb()
+
+    async with CacheClient() as client:
+        await client.migrate_cache_table()
+        logger.info("Table 'CACHE' migrated")
+
+    async with JobClient() as client:
+        await client.migrate_jobs_table()
+        logger.info("Table 'JOBS' migrated")
+
+    async with UserClient() as client:
+        await client.migrate_users_table()
+        logger.info("Table 'USERS' migrated")
+
+    await YDBClient.shutdown()
 
 
 # --------------------------------------------------------- ОЧИСТИТЬ ТАБЛИЦЫ -------------------------------------------------------
@@ -521,12 +1492,20 @@ async def create_tables_on_ydb():
 async def clear_tables_on_ydb():
     async with YDBClient() as client:
         await client.clear_all_tables()
-        print("Tables cleared successfully!")
+        logger.info("Tables cleared successfully!")
+
+    await YDBClient.shutdown()
 
 
 # --------------------------------------------------------- ЗАПУСК -------------------------------------------------------
 
 
+# python ydb_models.py [migrate|create|clear] — по умолчанию migrate
 if __name__ == "__main__":
-    asyncio.run(clear_tables_on_ydb())
+    logging.basicConfig(level=logging.INFO)
+    actions = {"migrate": migrate_tables_on_ydb, "create": create_tables_on_ydb, "clear": clear_tables_on_ydb}
+    action = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    if action not in actions:
+        sys.exit(f"Неизвестное действие: {action}, доступны: {', '.join(actions)}")
+    asyncio.run(actions[action]())
 